@@ -2,33 +2,119 @@ __version__ = "0.0.1"
 
 from .app import run
 
-from .azure import login, get_token
+from .azure import (
+    clear_token_cache,
+    get_access_token,
+    get_secret_via_identity,
+    get_token,
+    get_token_async,
+    login,
+    login_async,
+)
+
+from .batch import load_manifest, run_batch
+
+from .cache import (
+    clear_index_cache,
+    conditional_get,
+    configure_index_cache,
+    get_cached_index,
+    latest_compact_release,
+    load_cache_entry,
+    load_compact_releases,
+    lookup_parsed_version,
+    save_cache_entry,
+    store_cached_index,
+    store_parsed_version,
+    update_compact_index,
+    update_http_cache,
+)
+
+from .daemon import pop_due, run_daemon, schedule_repos
 
-from .cli import parse_args, check_parser
+from .cli import (
+    parse_args,
+    parse_batch_args,
+    parse_replay_args,
+    parse_webhook_args,
+    check_parser,
+)
 
 from .github import (
+    PreflightState,
     add_commit_push,
     add_labels,
     check_fork_exists,
     delete_old_branch,
     checkout_branch,
     clone_fork,
+    clone_from_mirror,
+    commit_file_via_api,
     create_pr,
     find_existing_pr,
+    get_file_contents,
+    get_ref_sha,
+    make_commit_msg,
     make_fork,
+    preflight,
     remove_fork,
+    set_branch_via_api,
     set_git_config,
+    sync_fork,
 )
 
 from .helper_functions import (
+    configure_commands,
+    configure_rate_limits,
+    configure_retries,
+    configure_session,
     delete_request,
+    get_paginated,
+    get_rate_limit_metrics,
     get_request,
+    get_session,
+    head_exists,
+    patch_request,
     post_request,
+    reset_rate_limits,
+    reset_retry_budget,
     run_cmd,
+    run_cmd_async,
 )
 
 from .pull_version_info import (
+    load_entries_from_stream,
+    load_index_entries,
+    pull_version_from_artifacthub,
     pull_version_from_requirements_file,
     pull_version_from_chart_file,
     pull_version_from_github_pages,
+    pull_version_from_helm_repo,
+    pull_version_from_oci_registry,
+)
+
+from .sources import (
+    DEFAULT_SOURCES,
+    SOURCES,
+    choose_source,
+    get_sources,
+    register_source,
+    resolve_source,
+)
+
+from .versions import (
+    is_upgrade,
+    latest_release,
+    parse_created,
+    parse_version,
+    version_key,
+)
+
+from .webhook import (
+    affected_dependencies,
+    replay_webhook,
+    serve_webhooks,
+    sign_payload,
+    verify_signature,
+    webhook_sources,
 )
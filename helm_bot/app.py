@@ -1,36 +1,72 @@
 import os
 import yaml
+import asyncio
 import shutil
 import logging
+import functools
 
 from itertools import compress
-
-from .azure import get_token
-
-from .pull_version_info import (
-    pull_version_from_requirements_file,
-    pull_version_from_chart_file,
-    pull_version_from_github_pages,
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+from .azure import get_token_async
+from .versions import is_upgrade
+from .sources import (
+    GITHUB_HOSTS,
+    SOURCES,
+    choose_source,
+    get_sources,
+    resolve_source,
 )
+from .pull_version_info import pull_version_from_requirements_file
 
 from .github import (
     add_commit_push,
-    check_fork_exists,
     checkout_branch,
     clone_fork,
+    clone_from_mirror,
+    commit_file_via_api,
     create_pr,
-    find_existing_pr,
+    get_file_contents,
+    get_ref_sha,
+    make_commit_msg,
     make_fork,
+    preflight,
+    set_branch_via_api,
     set_git_config,
+    sync_fork,
 )
 
-HERE = os.getcwd()
-
 logger = logging.getLogger()
 
 
+def bump_requirements(
+    chart_yaml: dict, charts_to_update: list, chart_info: dict
+) -> dict:
+    """Set new dependency versions in a parsed requirements file
+
+    Args:
+        chart_yaml (dict): The parsed requirements.yaml file
+        charts_to_update (list): A list of the dependencies that need updating
+        chart_info (dict): A dictionary of the dependent charts and their
+                           up-to-date versions
+
+    Returns:
+        dict: The updated requirements
+    """
+    for chart in charts_to_update:
+        for dep in chart_yaml["dependencies"]:
+            if dep["name"] == chart:
+                dep["version"] = chart_info[chart]
+
+    return chart_yaml
+
+
 def check_versions(
-    chart_name: str, chart_info: dict, dry_run: bool = False
+    chart_name: str,
+    chart_info: dict,
+    dry_run: bool = False,
+    policy: str = "prerelease",
 ) -> list:
     """Check if chart dependencies are up-to-date
 
@@ -39,6 +75,9 @@ def check_versions(
         chart_info (dict): Dictionary containing chart version info
         dry_run (bool, optional): For a dry-run, don't edit files.
                                   Defaults to False.
+        policy (str, optional): Which newer versions count as upgrades. One of
+                                "prerelease", "stable", "minor" or "patch".
+                                Defaults to "prerelease".
 
     Returns:
         list: A list of chart dependencies that need updating
@@ -47,7 +86,7 @@ def check_versions(
     charts.remove(chart_name)
 
     condition = [
-        (chart_info[chart] != chart_info[chart_name][chart])
+        is_upgrade(chart_info[chart_name][chart], chart_info[chart], policy)
         for chart in charts
     ]
     charts_to_update = list(compress(charts, condition))
@@ -71,72 +110,318 @@ def check_versions(
     return charts_to_update
 
 
-def clean_up(repo_name: str) -> None:
+def clean_up(repo_name: str, workdir: str = None) -> None:
     """Clean up the locally cloned repository
 
     Args:
         repo_name (str): The repository name
+        workdir (str, optional): The directory the repository was cloned
+                                 into. Defaults to None, which uses the
+                                 current working directory.
     """
-    cwd = os.getcwd()
-    this_dir = cwd.split("/")[-1]
-    if this_dir == repo_name:
-        os.chdir(os.pardir)
+    repo_dir = os.path.join(workdir or os.getcwd(), repo_name)
+
+    if os.path.exists(repo_dir):
+        logger.info("Deleting local repository: %s" % repo_dir)
+        shutil.rmtree(repo_dir)
+        logger.info("Deleted local repository: %s" % repo_dir)
+
+
+def pull_chart_version(
+    chart_info: dict,
+    chart: str,
+    chart_url: str,
+    token: str,
+    cache_dir: str = None,
+    version_cache: dict = None,
+    source: str = None,
+) -> dict:
+    """Pull the version of a single chart with a source backend
+
+    Args:
+        chart_info (dict): The dictionary to store versions in
+        chart (str): The name of the chart
+        chart_url (str): The URL of the remotely hosted versions
+        token (str): A GitHub API token. Only sent to GITHUB_HOSTS.
+        cache_dir (str, optional): Directory of an HTTP cache for the chart
+                                   sources. Defaults to None.
+        version_cache (dict, optional): Upstream versions already pulled by
+                                        this process, keyed by chart and URL.
+                                        Defaults to None.
+        source (str, optional): The name of the backend in SOURCES. Defaults
+                                to None, which chooses it from the URL.
 
-    if os.path.exists(repo_name):
-        logger.info("Deleting local repository: %s" % repo_name)
-        shutil.rmtree(repo_name)
-        logger.info("Deleted local repository: %s" % repo_name)
+    Returns:
+        dict: The updated chart_info dictionary
+    """
+    cache_key = (chart, chart_url)
+    if (version_cache is not None) and (cache_key in version_cache):
+        chart_info[chart] = version_cache[cache_key]
+        return chart_info
+
+    if source is None:
+        source = resolve_source(chart_url)
+
+    if source not in SOURCES:
+        msg = (
+            "Scraping from the following URL type is currently not implemented\n\t%s"
+            % chart_url
+        )
+        logger.error(NotImplementedError(msg))
+        raise NotImplementedError(msg)
+
+    if urlsplit(chart_url).netloc not in GITHUB_HOSTS:
+        token = None
+
+    chart_info = SOURCES[source](
+        chart_info, chart, chart_url, token, cache_dir=cache_dir
+    )
+
+    if version_cache is not None:
+        version_cache[cache_key] = chart_info[chart]
+
+    return chart_info
 
 
 def get_chart_versions(
-    chart_name: str, repo_owner: str, repo_name: str, token: str
+    chart_name: str,
+    repo_owner: str,
+    repo_name: str,
+    token: str,
+    concurrent: bool = False,
+    cache_dir: str = None,
+    version_cache: dict = None,
+    dependencies: list = None,
+    sources: dict = None,
 ) -> dict:
-    """Get the versions of dependent charts
+    """Get the versions of dependent charts. The chart's requirements file is
+    read first and only the dependencies it lists are pulled, each from the
+    source chosen by choose_source.
 
     Args:
         chart_name (str): The main chart to check
         repo_owner (str): The repository/chart owner
         repo_name (str): The name of the repository hosting the chart
         token (str): A GitHub API token
+        concurrent (bool, optional): Send the requests for all chart sources
+                                     at once from a thread pool.
+                                     Defaults to False.
+        cache_dir (str, optional): Directory of an HTTP cache for the chart
+                                   sources. Defaults to None.
+        version_cache (dict, optional): Upstream versions shared between
+                                        calls so that each chart source is
+                                        only fetched once. Defaults to None.
+        dependencies (list, optional): Only get the versions of these
+                                       dependencies. Those the chart does not
+                                       list are skipped. Defaults to None,
+                                       which gets all of them.
+        sources (dict, optional): The `source` backend and `url` of
+                                  dependencies, overriding DEFAULT_SOURCES.
+                                  Defaults to None.
 
     Returns:
         dict: A dictionary containing the chart dependencies and their
               up-to-date versions
     """
+    requirements_url = f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/main/{chart_name}/requirements.yaml"
+    pull_kwargs = {"cache_dir": cache_dir, "version_cache": version_cache}
+
     chart_info = {}
     chart_info[chart_name] = {}
-    chart_urls = {
-        chart_name: f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/main/{chart_name}/requirements.yaml",
-        "binderhub": "https://raw.githubusercontent.com/jupyterhub/helm-chart/gh-pages/index.yaml",
-        "ingress-nginx": "https://raw.githubusercontent.com/kubernetes/ingress-nginx/master/charts/ingress-nginx/Chart.yaml",
-    }
+    repositories = {}
+
+    chart_info = pull_version_from_requirements_file(
+        chart_info,
+        chart_name,
+        requirements_url,
+        token,
+        repositories=repositories,
+    )
 
-    for (chart, chart_url) in chart_urls.items():
-        if "requirements.yaml" in chart_url:
-            chart_info = pull_version_from_requirements_file(
-                chart_info, chart, chart_url, token
-            )
-        elif "Chart.yaml" in chart_url:
-            chart_info = pull_version_from_chart_file(
-                chart_info, chart, chart_url, token
+    configured = {}
+    for dep in chart_info[chart_name]:
+        if (dependencies is not None) and (dep not in dependencies):
+            continue
+
+        config = choose_source(dep, repositories.get(dep), sources)
+        if config is None:
+            logger.warning(
+                "Skipping %s, cannot pull versions from repository: %s"
+                % (dep, repositories.get(dep))
             )
-        elif "/gh-pages/" in chart_url:
-            chart_info = pull_version_from_github_pages(
-                chart_info, chart, chart_url, token
+            continue
+
+        configured[dep] = config
+
+    if (not concurrent) or (not configured):
+        for dep, config in configured.items():
+            chart_info = pull_chart_version(
+                chart_info,
+                dep,
+                config["url"],
+                token,
+                source=config["source"],
+                **pull_kwargs,
             )
-        else:
-            msg = (
-                "Scraping from the following URL type is currently not implemented\n\t%s"
-                % chart_url
+    else:
+        with ThreadPoolExecutor(max_workers=len(configured)) as executor:
+            # Each worker writes to its own dictionary which are merged in
+            # order
+            futures = [
+                executor.submit(
+                    pull_chart_version,
+                    {dep: {}},
+                    dep,
+                    config["url"],
+                    token,
+                    source=config["source"],
+                    **pull_kwargs,
+                )
+                for (dep, config) in configured.items()
+            ]
+
+            for future in futures:
+                chart_info.update(future.result())
+
+    # A webhook may trigger a check of every repository for a dependency
+    # that only some of their charts list
+    missing = [dep for dep in dependencies or [] if dep not in chart_info]
+    if missing:
+        logger.info(
+            "Not checking dependencies %s does not list: %s"
+            % (chart_name, missing)
+        )
+
+    return chart_info
+
+
+def pull_source_versions(
+    concurrent: bool = False,
+    cache_dir: str = None,
+    version_cache: dict = None,
+    dependencies: list = None,
+    sources: dict = None,
+) -> dict:
+    """Pull the versions of the dependencies with a source configured in the
+    manifest, which are used whenever the chart lists them. The sources are
+    public, so they are requested without a token.
+
+    Args:
+        concurrent (bool, optional): Send the requests for all chart sources
+                                     at once from a thread pool.
+                                     Defaults to False.
+        cache_dir (str, optional): Directory of an HTTP cache for the chart
+                                   sources. Defaults to None.
+        version_cache (dict, optional): Upstream versions shared between
+                                        calls so that each chart source is
+                                        only fetched once. Defaults to None.
+        dependencies (list, optional): Only get the versions of these
+                                       dependencies. Defaults to None, which
+                                       gets all of them.
+        sources (dict, optional): The `source` backend and `url` of
+                                  dependencies. Defaults to None.
+
+    Returns:
+        dict: The configured dependencies and their up-to-date versions
+    """
+    configured = {
+        dep: config
+        for (dep, config) in get_sources(sources, defaults=False).items()
+        if (dependencies is None) or (dep in dependencies)
+    }
+    pull_kwargs = {"cache_dir": cache_dir, "version_cache": version_cache}
+
+    chart_info = {}
+    if (not concurrent) or (not configured):
+        for dep, config in configured.items():
+            chart_info = pull_chart_version(
+                chart_info,
+                dep,
+                config["url"],
+                None,
+                source=config["source"],
+                **pull_kwargs,
             )
-            logger.error(NotImplementedError(msg))
-            raise NotImplementedError(msg)
+    else:
+        with ThreadPoolExecutor(max_workers=len(configured)) as executor:
+            futures = [
+                executor.submit(
+                    pull_chart_version,
+                    {dep: {}},
+                    dep,
+                    config["url"],
+                    None,
+                    source=config["source"],
+                    **pull_kwargs,
+                )
+                for (dep, config) in configured.items()
+            ]
+
+            for future in futures:
+                chart_info.update(future.result())
 
     return chart_info
 
 
+async def get_chart_versions_and_token(
+    chart_name: str,
+    repo_owner: str,
+    repo_name: str,
+    token_name: str,
+    keyvault: str,
+    identity: bool = False,
+    **kwargs,
+) -> tuple:
+    """Pull the versions of the sources configured in the manifest while the
+    GitHub token is retrieved from Azure Key Vault, then read the chart's
+    requirements file with the token.
+
+    Args:
+        chart_name (str): The main chart to check
+        repo_owner (str): The repository/chart owner
+        repo_name (str): The name of the repository hosting the chart
+        token_name (str): The name of the stored token
+        keyvault (str): An Azure keyvault the token is stored in
+        identity (bool, optional): Login to Azure with Managed System
+                                   Identity. Defaults to False.
+        **kwargs: Passed on to get_chart_versions
+
+    Returns:
+        tuple: The chart versions, as from get_chart_versions, and the token
+    """
+    if kwargs.get("version_cache") is None:
+        # get_chart_versions reuses the versions pulled before the token
+        kwargs["version_cache"] = {}
+
+    loop = asyncio.get_event_loop()
+    _, token = await asyncio.gather(
+        loop.run_in_executor(
+            None, functools.partial(pull_source_versions, **kwargs)
+        ),
+        get_token_async(token_name, keyvault, identity=identity),
+    )
+
+    chart_info = await loop.run_in_executor(
+        None,
+        functools.partial(
+            get_chart_versions,
+            chart_name,
+            repo_owner,
+            repo_name,
+            token,
+            **kwargs,
+        ),
+    )
+
+    return chart_info, token
+
+
 def update_local_file(
-    chart_name: str, charts_to_update: list, chart_info: dict, repo_name: str
+    chart_name: str,
+    charts_to_update: list,
+    chart_info: dict,
+    repo_name: str,
+    workdir: str = None,
 ) -> None:
     """Update the local helm chart
 
@@ -146,17 +431,22 @@ def update_local_file(
         chart_info (dict): A dictionary of the dependent charts and their
                            up-to-date versions
         repo_name (str): The name of the repository that hosts the helm chart
+        workdir (str, optional): The directory the repository was cloned
+                                 into. Defaults to None, which uses the
+                                 current working directory.
     """
     logger.info("Updating local helm chart: %s" % chart_name)
 
-    filename = os.path.join(HERE, repo_name, chart_name, "requirements.yaml")
+    if workdir is None:
+        workdir = os.getcwd()
+
+    filename = os.path.join(
+        workdir, repo_name, chart_name, "requirements.yaml"
+    )
     with open(filename, "r") as stream:
         chart_yaml = yaml.safe_load(stream)
 
-    for chart in charts_to_update:
-        for dep in chart_yaml["dependencies"]:
-            if dep["name"] == chart:
-                dep["version"] = chart_info[chart]
+    chart_yaml = bump_requirements(chart_yaml, charts_to_update, chart_info)
 
     with open(filename, "w") as stream:
         yaml.safe_dump(chart_yaml, stream)
@@ -176,6 +466,10 @@ def upgrade_chart(
     token: str,
     labels: list,
     pr_exists: bool,
+    clone_mode: str = "full",
+    mirror_dir: str = None,
+    workdir: str = None,
+    branch_exists: bool = None,
 ) -> None:
     """Upgrade the dependencies in the helm chart
 
@@ -193,20 +487,129 @@ def upgrade_chart(
         labels (list): A list of labels to add the the Pull Request
         pr_exists (bool): True if HelmUpgradeBot has previously opened a Pull
                           Request. Otherwise False.
+        clone_mode (str, optional): "full" to clone the whole fork or "sparse"
+                                    for a shallow clone of the chart directory
+                                    only. Defaults to "full".
+        mirror_dir (str, optional): Create the working copy from a persistent
+                                    mirror kept in this directory instead of
+                                    cloning. Defaults to None.
+        workdir (str, optional): The directory to clone the repository into.
+                                 Defaults to None, which uses the current
+                                 working directory.
+        branch_exists (bool, optional): Whether the target branch exists in
+                                        the fork, if already known.
+                                        Defaults to None.
     """
-    filename = os.path.join(HERE, repo_name, chart_name, "requirements.yaml")
+    if workdir is None:
+        workdir = os.getcwd()
 
-    clone_fork(repo_name)
+    repo_dir = os.path.join(workdir, repo_name)
+    filename = os.path.join(repo_dir, chart_name, "requirements.yaml")
 
-    os.chdir(repo_name)
-    checkout_branch(repo_owner, repo_name, target_branch, token, pr_exists)
-    update_local_file(chart_name, charts_to_update, chart_info, repo_name)
+    if mirror_dir is not None:
+        clone_from_mirror(
+            repo_owner, repo_name, mirror_dir, target_branch, workdir=workdir
+        )
+    elif clone_mode == "sparse":
+        clone_fork(repo_name, sparse_path=chart_name, workdir=workdir)
+    else:
+        clone_fork(repo_name, workdir=workdir)
+
+    checkout_branch(
+        repo_owner,
+        repo_name,
+        target_branch,
+        token,
+        pr_exists,
+        cwd=repo_dir,
+        branch_exists=branch_exists,
+    )
+    update_local_file(
+        chart_name, charts_to_update, chart_info, repo_name, workdir=workdir
+    )
     add_commit_push(
-        filename, charts_to_update, chart_info, repo_name, target_branch, token
+        filename,
+        charts_to_update,
+        chart_info,
+        repo_name,
+        target_branch,
+        token,
+        cwd=repo_dir,
     )
     create_pr(repo_api, base_branch, target_branch, token, labels)
 
 
+def upgrade_chart_via_api(
+    chart_name: str,
+    chart_info: dict,
+    charts_to_update: list,
+    repo_name: str,
+    repo_api: str,
+    base_branch: str,
+    target_branch: str,
+    token: str,
+    labels: list,
+    pr_exists: bool,
+    branch_exists: bool = None,
+) -> None:
+    """Upgrade the dependencies in the helm chart using only the GitHub API.
+    The branch, blob, tree and commit are created in HelmUpgradeBot's fork
+    without cloning the repository.
+
+    Args:
+        chart_name (str): The name of the helm-chart
+        chart_info (dict): A dictionary of the dependencies and their versions
+        charts_to_update (list): The dependencies that need updating
+        repo_name (str): The name of the repository hosting the helm chart
+        repo_api (str): The API URL of the original repository
+                        (not HelmUpgradeBot's fork)
+        base_branch (str): The base branch for opening the Pull Request
+        target_branch (str): The target branch for opening the Pull Request
+        token (str): A GitHub API token
+        labels (list): A list of labels to add the the Pull Request
+        pr_exists (bool): True if HelmUpgradeBot has previously opened a Pull
+                          Request. Otherwise False.
+        branch_exists (bool, optional): Whether the target branch exists in
+                                        the fork, if already known.
+                                        Defaults to None.
+    """
+    fork_api = f"https://api.github.com/repos/HelmUpgradeBot/{repo_name}/"
+    filepath = f"{chart_name}/requirements.yaml"
+
+    if pr_exists:
+        # Add a new commit to the branch of the open Pull Request
+        parent_sha = get_ref_sha(fork_api, target_branch, token)
+    else:
+        # Start a fresh branch from the tip of the upstream base branch
+        sync_fork(repo_name, base_branch, token)
+        parent_sha = get_ref_sha(repo_api, base_branch, token)
+
+    chart_yaml = yaml.safe_load(
+        get_file_contents(fork_api, filepath, parent_sha, token)
+    )
+    chart_yaml = bump_requirements(chart_yaml, charts_to_update, chart_info)
+
+    commit_sha = commit_file_via_api(
+        fork_api,
+        filepath,
+        yaml.safe_dump(chart_yaml),
+        make_commit_msg(charts_to_update, chart_info),
+        parent_sha,
+        token,
+    )
+    set_branch_via_api(
+        fork_api,
+        target_branch,
+        commit_sha,
+        token,
+        force=not pr_exists,
+        branch_exists=branch_exists,
+    )
+
+    if not pr_exists:
+        create_pr(repo_api, base_branch, target_branch, token, labels)
+
+
 def run(
     chart_name: str,
     repo_owner: str,
@@ -219,6 +622,15 @@ def run(
     keyvault: str,
     dry_run: bool = False,
     identity: bool = False,
+    concurrent: bool = False,
+    cache_dir: str = None,
+    policy: str = "prerelease",
+    clone_mode: str = "full",
+    mirror_dir: str = None,
+    version_cache: dict = None,
+    workdir: str = None,
+    dependencies: list = None,
+    sources: dict = None,
 ) -> None:
     """Run the HelmUpgradeBot app
 
@@ -234,29 +646,91 @@ def run(
         keyvault (str): An Azure keyvault the token is stored in
         dry_run (bool, optional): Don't open a Pull Request. Defaults to False.
         identity (bool, optional): Login to Azure with Managed System Identity. Defaults to False.
+        concurrent (bool, optional): Fetch all chart sources concurrently.
+                                     Defaults to False.
+        cache_dir (str, optional): Directory to cache chart source downloads
+                                   in between runs. Defaults to None.
+        policy (str, optional): Which newer versions count as upgrades.
+                                Defaults to "prerelease".
+        clone_mode (str, optional): "full" to clone the whole fork, "sparse"
+                                    for a shallow clone of the chart directory
+                                    only, or "api" to make the changes through
+                                    the GitHub API without cloning.
+                                    Defaults to "full".
+        mirror_dir (str, optional): Keep a mirror of the fork in this
+                                    directory between runs and only fetch new
+                                    objects into it. Defaults to None.
+        version_cache (dict, optional): Upstream chart versions shared
+                                        between runs in the same process.
+                                        Defaults to None.
+        workdir (str, optional): The directory to clone the repository into.
+                                 Defaults to None, which uses the current
+                                 working directory.
+        dependencies (list, optional): Only check these chart dependencies
+                                       for upgrades. Defaults to None, which
+                                       checks all of them.
+        sources (dict, optional): The `source` backend and `url` of
+                                  dependencies, overriding DEFAULT_SOURCES.
+                                  Defaults to None.
     """
     repo_api = f"https://api.github.com/repos/{repo_owner}/{repo_name}/"
 
-    if token is None:
-        token = get_token(token_name, keyvault, identity=identity)
-
     if identity:
         set_git_config()
 
-    chart_info = get_chart_versions(chart_name, repo_owner, repo_name, token)
-    charts_to_update = check_versions(chart_name, chart_info, dry_run=dry_run)
+    version_kwargs = {
+        "concurrent": concurrent,
+        "cache_dir": cache_dir,
+        "version_cache": version_cache,
+        "dependencies": dependencies,
+        "sources": sources,
+    }
 
-    if (len(charts_to_update) > 0) and (not dry_run):
-        # Check if Pull Request exists
-        pr_exists = find_existing_pr(repo_api, target_branch, token)
+    if token is None:
+        # Logging in to Azure is slow so overlap it with the downloads
+        chart_info, token = asyncio.run(
+            get_chart_versions_and_token(
+                chart_name,
+                repo_owner,
+                repo_name,
+                token_name,
+                keyvault,
+                identity=identity,
+                **version_kwargs,
+            )
+        )
+    else:
+        chart_info = get_chart_versions(
+            chart_name, repo_owner, repo_name, token, **version_kwargs
+        )
+    charts_to_update = check_versions(
+        chart_name, chart_info, dry_run=dry_run, policy=policy
+    )
 
-        # Check if a fork exists
-        fork_exists = check_fork_exists(repo_name, token)
+    if (len(charts_to_update) > 0) and (not dry_run):
+        # Check for an open Pull Request, a fork and a branch all at once
+        state = preflight(repo_owner, repo_name, target_branch, token)
 
-        if (not fork_exists) and (not pr_exists):
+        if (not state.fork_exists) and (not state.pr_exists):
             make_fork(repo_name, repo_api, token)
 
         # Upgrade the chart
+        if clone_mode == "api":
+            upgrade_chart_via_api(
+                chart_name,
+                chart_info,
+                charts_to_update,
+                repo_name,
+                repo_api,
+                base_branch,
+                target_branch,
+                token,
+                labels,
+                state.pr_exists,
+                branch_exists=state.branch_exists,
+            )
+            return
+
         upgrade_chart(
             chart_name,
             chart_info,
@@ -268,5 +742,9 @@ def run(
             target_branch,
             token,
             labels,
-            pr_exists,
+            state.pr_exists,
+            clone_mode=clone_mode,
+            mirror_dir=mirror_dir,
+            workdir=workdir,
+            branch_exists=state.branch_exists,
         )
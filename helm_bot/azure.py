@@ -1,15 +1,38 @@
+import os
+import time
+import asyncio
 import logging
-from .helper_functions import run_cmd
+import functools
+import threading
+from .helper_functions import get_request, run_cmd, run_cmd_async
 
 logger = logging.getLogger()
 
+# How long a secret retrieved from Key Vault is reused for, in seconds
+TOKEN_TTL = 3600
+
+# The Azure Instance Metadata Service, which issues access tokens for the
+# Managed System Identity of a VM. Override with the IMDS_ENDPOINT variable.
+IMDS_ENDPOINT = "http://169.254.169.254"
+KEYVAULT_RESOURCE = "https://vault.azure.net"
+KEYVAULT_API_VERSION = "7.4"
+
+# Secrets keyed by (keyvault, token_name), and IMDS access tokens keyed by
+# resource, each stored with the time.time() they expire at
+_token_cache = {}
+_access_token_cache = {}
+_token_cache_lock = threading.Lock()
 
-def login(identity: bool = False) -> None:
-    """Login to Azure
+
+def _login_cmd(identity: bool = False) -> list:
+    """Build the command to login to Azure
 
     Args:
         identity (bool, optional): Login with Managed System Identity.
                                    Defaults to False.
+
+    Returns:
+        list: The login command
     """
     login_cmd = ["az", "login"]
 
@@ -19,32 +42,22 @@ def login(identity: bool = False) -> None:
     else:
         logger.info("Login to Azure")
 
-    result = run_cmd(login_cmd)
+    return login_cmd
 
-    if result["returncode"] != 0:
-        logger.error(result["err_msg"])
-        raise RuntimeError(result["err_msg"])
-
-    logger.info("Successfully logged into Azure")
 
-
-def get_token(token_name: str, keyvault: str, identity: bool = False) -> str:
-    """Get GitHub API token from Azure Key Vault
+def _vault_cmd(token_name: str, keyvault: str) -> list:
+    """Build the command to read a secret from an Azure Key Vault
 
     Args:
         token_name (str): The name the token is stored as
         keyvault (str): The keyvault the token is stored within
-        identity (bool, optional): Access with a Managed System Identity.
-                                   Defaults to False.
 
     Returns:
-        str: The token value
+        list: The secret retrieval command
     """
-    login(identity)
-
     logger.info("Retrieving scret: %s" % token_name)
 
-    vault_cmd = [
+    return [
         "az",
         "keyvault",
         "secret",
@@ -59,12 +72,218 @@ def get_token(token_name: str, keyvault: str, identity: bool = False) -> str:
         "tsv",
     ]
 
-    result = run_cmd(vault_cmd)
+
+def clear_token_cache() -> None:
+    """Forget all cached secrets and access tokens"""
+    with _token_cache_lock:
+        _token_cache.clear()
+        _access_token_cache.clear()
+
+
+def _get_cached(cache: dict, key):
+    """Return an unexpired value from a token cache, or None"""
+    with _token_cache_lock:
+        if key in cache:
+            value, expires_at = cache[key]
+            if time.time() < expires_at:
+                return value
+
+            del cache[key]
+
+    return None
+
+
+def _set_cached(cache: dict, key, value, expires_at: float) -> None:
+    with _token_cache_lock:
+        cache[key] = (value, expires_at)
+
+
+def _cache_token(token_name: str, keyvault: str, token: str, ttl) -> None:
+    if ttl is None:
+        ttl = TOKEN_TTL
+
+    _set_cached(_token_cache, (keyvault, token_name), token, time.time() + ttl)
+
+
+def get_access_token(resource: str = KEYVAULT_RESOURCE) -> str:
+    """Get an access token for the Managed System Identity of this machine
+    directly from the Azure Instance Metadata Service. Tokens are reused
+    until shortly before they expire.
+
+    Args:
+        resource (str, optional): The resource to access. Defaults to
+                                  KEYVAULT_RESOURCE.
+
+    Returns:
+        str: The access token
+    """
+    access_token = _get_cached(_access_token_cache, resource)
+    if access_token is not None:
+        return access_token
+
+    logger.info("Requesting Managed System Identity token for: %s" % resource)
+
+    endpoint = os.environ.get("IMDS_ENDPOINT", IMDS_ENDPOINT).rstrip("/")
+    resp = get_request(
+        endpoint + "/metadata/identity/oauth2/token",
+        headers={"Metadata": "true"},
+        params={"api-version": "2018-02-01", "resource": resource},
+        json=True,
+    )
+
+    # Refresh a minute early so a token never expires mid-request
+    expires_at = float(resp["expires_on"]) - 60
+    _set_cached(
+        _access_token_cache, resource, resp["access_token"], expires_at
+    )
+
+    return resp["access_token"]
+
+
+def get_secret_via_identity(token_name: str, keyvault: str) -> str:
+    """Read a secret from Azure Key Vault with the Key Vault REST API,
+    authenticated as the Managed System Identity of this machine. The Azure
+    CLI is not needed.
+
+    Args:
+        token_name (str): The name the token is stored as
+        keyvault (str): The keyvault the token is stored within
+
+    Returns:
+        str: The token value
+    """
+    access_token = get_access_token(KEYVAULT_RESOURCE)
+
+    logger.info("Retrieving scret: %s" % token_name)
+
+    resp = get_request(
+        f"https://{keyvault}.vault.azure.net/secrets/{token_name}",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"api-version": KEYVAULT_API_VERSION},
+        json=True,
+    )
+
+    logger.info("Successfully pulled secret")
+
+    return resp["value"]
+
+
+def login(identity: bool = False) -> None:
+    """Login to Azure
+
+    Args:
+        identity (bool, optional): Login with Managed System Identity.
+                                   Defaults to False.
+    """
+    result = run_cmd(_login_cmd(identity))
 
     if result["returncode"] != 0:
         logger.error(result["err_msg"])
         raise RuntimeError(result["err_msg"])
 
-    logger.info("Successfully pulled secret")
+    logger.info("Successfully logged into Azure")
+
+
+async def login_async(identity: bool = False) -> None:
+    """Login to Azure without blocking the event loop
+
+    Args:
+        identity (bool, optional): Login with Managed System Identity.
+                                   Defaults to False.
+    """
+    result = await run_cmd_async(_login_cmd(identity))
+
+    if result["returncode"] != 0:
+        logger.error(result["err_msg"])
+        raise RuntimeError(result["err_msg"])
+
+    logger.info("Successfully logged into Azure")
+
+
+def get_token(
+    token_name: str, keyvault: str, identity: bool = False, ttl: float = None
+) -> str:
+    """Get GitHub API token from Azure Key Vault. The token is kept in memory
+    and reused, without logging in again, until `ttl` seconds have passed.
+
+    Args:
+        token_name (str): The name the token is stored as
+        keyvault (str): The keyvault the token is stored within
+        identity (bool, optional): Access with a Managed System Identity,
+                                   through the Instance Metadata Service and
+                                   the Key Vault REST API rather than the
+                                   Azure CLI. Defaults to False.
+        ttl (float, optional): How long to reuse the token for, in seconds.
+                               Defaults to None, which uses TOKEN_TTL.
+
+    Returns:
+        str: The token value
+    """
+    token = _get_cached(_token_cache, (keyvault, token_name))
+    if token is not None:
+        logger.info("Using cached secret: %s" % token_name)
+        return token
+
+    if identity:
+        token = get_secret_via_identity(token_name, keyvault)
+    else:
+        login()
+
+        result = run_cmd(_vault_cmd(token_name, keyvault))
+
+        if result["returncode"] != 0:
+            logger.error(result["err_msg"])
+            raise RuntimeError(result["err_msg"])
+
+        logger.info("Successfully pulled secret")
+        token = result["output"]
+
+    _cache_token(token_name, keyvault, token, ttl)
+
+    return token
+
+
+async def get_token_async(
+    token_name: str, keyvault: str, identity: bool = False, ttl: float = None
+) -> str:
+    """Get GitHub API token from Azure Key Vault without blocking the event
+    loop, so that other work can continue while the Azure CLI runs. The
+    token is cached as in get_token.
+
+    Args:
+        token_name (str): The name the token is stored as
+        keyvault (str): The keyvault the token is stored within
+        identity (bool, optional): Access with a Managed System Identity.
+                                   Defaults to False.
+        ttl (float, optional): How long to reuse the token for, in seconds.
+                               Defaults to None, which uses TOKEN_TTL.
+
+    Returns:
+        str: The token value
+    """
+    token = _get_cached(_token_cache, (keyvault, token_name))
+    if token is not None:
+        logger.info("Using cached secret: %s" % token_name)
+        return token
+
+    if identity:
+        loop = asyncio.get_event_loop()
+        token = await loop.run_in_executor(
+            None,
+            functools.partial(get_secret_via_identity, token_name, keyvault),
+        )
+    else:
+        await login_async()
+
+        result = await run_cmd_async(_vault_cmd(token_name, keyvault))
+
+        if result["returncode"] != 0:
+            logger.error(result["err_msg"])
+            raise RuntimeError(result["err_msg"])
+
+        logger.info("Successfully pulled secret")
+        token = result["output"]
+
+    _cache_token(token_name, keyvault, token, ttl)
 
-    return result["output"]
+    return token
@@ -0,0 +1,194 @@
+import yaml
+import shutil
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .app import run, clean_up
+from .azure import get_token
+from .helper_functions import get_rate_limit_metrics
+
+logger = logging.getLogger()
+
+# Keys every repository in a manifest must set, and defaults for the rest
+REQUIRED_KEYS = ("repo_owner", "repo_name", "chart_name")
+DEFAULTS = {
+    "base_branch": "main",
+    "target_branch": "helm_chart_bump",
+    "labels": None,
+    "sources": None,
+}
+
+
+def load_manifest(filename: str) -> list:
+    """Load a manifest of repositories to upgrade
+
+    The manifest is a YAML file with a list of `repos`, each setting
+    `repo_owner`, `repo_name` and `chart_name` and optionally `base_branch`,
+    `target_branch`, `labels` and the `sources` of chart dependencies. Values
+    under `defaults` apply to every repository that does not set them.
+
+    Args:
+        filename (str): The path to the manifest file
+
+    Returns:
+        list: A dictionary of settings for each repository
+    """
+    with open(filename, "r") as stream:
+        manifest = yaml.safe_load(stream) or {}
+
+    defaults = dict(DEFAULTS)
+    defaults.update(manifest.get("defaults") or {})
+
+    repos = []
+    for entry in manifest.get("repos") or []:
+        missing = [key for key in REQUIRED_KEYS if key not in entry]
+        if missing:
+            raise ValueError(
+                "Manifest entry %s is missing required keys: %s"
+                % (entry, missing)
+            )
+
+        repo = dict(defaults)
+        repo.update(entry)
+        repos.append(repo)
+
+    if not repos:
+        raise ValueError("Manifest does not list any repos: %s" % filename)
+
+    return repos
+
+
+def _run_repo(repo: dict, workdir: str = None, **kwargs) -> None:
+    """Run the HelmUpgradeBot app for a single repository of a batch
+
+    Args:
+        repo (dict): The settings for the repository, as from load_manifest
+        workdir (str, optional): A directory of its own to clone the
+                                 repository into. Defaults to None, which
+                                 uses the current working directory.
+        **kwargs: Passed on to run
+    """
+    try:
+        run(
+            chart_name=repo["chart_name"],
+            repo_owner=repo["repo_owner"],
+            repo_name=repo["repo_name"],
+            base_branch=repo["base_branch"],
+            target_branch=repo["target_branch"],
+            labels=repo["labels"],
+            sources=repo.get("sources"),
+            workdir=workdir,
+            **kwargs,
+        )
+    finally:
+        clean_up(repo["repo_name"], workdir=workdir)
+
+
+def run_batch(
+    repos: list,
+    token: str = None,
+    token_name: str = None,
+    keyvault: str = None,
+    identity: bool = False,
+    workers: int = 1,
+    **kwargs,
+) -> dict:
+    """Run the HelmUpgradeBot app for many repositories in one process. The
+    GitHub token, HTTP connection pool and upstream chart versions are shared
+    between all repositories.
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        token (str, optional): A GitHub API token. Defaults to None.
+        token_name (str, optional): The name of the stored token.
+                                    Defaults to None.
+        keyvault (str, optional): An Azure keyvault the token is stored in.
+                                  Defaults to None.
+        identity (bool, optional): Login to Azure with Managed System
+                                   Identity. Defaults to False.
+        workers (int, optional): The maximum number of repositories to
+                                 upgrade at once. Each is upgraded in a worker
+                                 thread with its own working directory.
+                                 Defaults to 1, which upgrades them one after
+                                 another.
+        **kwargs: Passed on to run for every repository
+
+    Returns:
+        dict: The error raised for each repository that failed, keyed by
+              "repo_owner/repo_name"
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1: %s" % workers)
+
+    if token is None:
+        token = get_token(token_name, keyvault, identity=identity)
+
+    kwargs.update(
+        {
+            "token": token,
+            "token_name": token_name,
+            "keyvault": keyvault,
+            "identity": identity,
+        }
+    )
+    kwargs.setdefault("version_cache", {})
+    failures = {}
+
+    if workers == 1:
+        for repo in repos:
+            repo_id = "%s/%s" % (repo["repo_owner"], repo["repo_name"])
+            logger.info("Processing repository: %s" % repo_id)
+
+            try:
+                _run_repo(repo, **kwargs)
+            except Exception as err:
+                logger.error("Failed to process %s: %s" % (repo_id, err))
+                failures[repo_id] = err
+    else:
+        failures = _run_batch_in_threads(repos, workers, **kwargs)
+
+    logger.info(
+        "Processed %d repositories, %d failed" % (len(repos), len(failures))
+    )
+    logger.info("HTTP request metrics: %s" % get_rate_limit_metrics())
+
+    return failures
+
+
+def _run_batch_in_threads(repos: list, workers: int, **kwargs) -> dict:
+    """Upgrade repositories in a pool of worker threads, each in a temporary
+    working directory of its own
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        workers (int): The maximum number of worker threads
+        **kwargs: Passed on to run for every repository
+
+    Returns:
+        dict: The error raised for each repository that failed, keyed by
+              "repo_owner/repo_name"
+    """
+    failures = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for repo in repos:
+            repo_id = "%s/%s" % (repo["repo_owner"], repo["repo_name"])
+            workdir = tempfile.mkdtemp(prefix="%s-" % repo["repo_name"])
+            logger.info("Processing repository: %s in %s" % (repo_id, workdir))
+
+            future = executor.submit(
+                _run_repo, repo, workdir=workdir, **kwargs
+            )
+            futures[future] = (repo_id, workdir)
+
+        for future, (repo_id, workdir) in futures.items():
+            try:
+                future.result()
+            except Exception as err:
+                logger.error("Failed to process %s: %s" % (repo_id, err))
+                failures[repo_id] = err
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    return failures
@@ -0,0 +1,472 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import timezone
+from urllib.parse import urlsplit, urlunsplit
+from .helper_functions import get_request
+from .versions import parse_created, version_key
+
+logger = logging.getLogger()
+
+# The maximum number of parsed versions to keep in the on-disk store
+MAX_PARSED_VERSIONS = 128
+
+# The number of seconds a parsed Helm repository index is reused for
+INDEX_TTL = 300
+
+_parsed_versions_lock = threading.Lock()
+_compact_index_lock = threading.Lock()
+
+_index_cache_config = {"ttl": INDEX_TTL}
+_index_cache = {}
+_index_cache_lock = threading.Lock()
+_index_locks = {}
+
+
+def _entry_path(cache_dir: str, store: str, key: str) -> str:
+    """Build the path of a cache entry file
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        store (str): The name of the store within the cache
+        key (str): The key of the entry
+
+    Returns:
+        str: The path to the entry file
+    """
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, store, f"{digest}.json")
+
+
+def load_cache_entry(cache_dir: str, store: str, key: str) -> dict:
+    """Load an entry from the on-disk cache
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        store (str): The name of the store within the cache
+        key (str): The key of the entry
+
+    Returns:
+        dict: The cached entry. Empty if the entry does not exist or cannot
+              be read.
+    """
+    filepath = _entry_path(cache_dir, store, key)
+
+    try:
+        with open(filepath, "r") as stream:
+            return json.load(stream)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        logger.warning(
+            "Ignoring unreadable cache entry %s: %s" % (filepath, err)
+        )
+        return {}
+
+
+def save_cache_entry(
+    cache_dir: str, store: str, key: str, entry: dict
+) -> None:
+    """Atomically write an entry to the on-disk cache
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        store (str): The name of the store within the cache
+        key (str): The key of the entry
+        entry (dict): The JSON-serialisable entry to store
+    """
+    filepath = _entry_path(cache_dir, store, key)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+
+    tmp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_filepath, "w") as stream:
+        json.dump(entry, stream)
+
+    os.replace(tmp_filepath, filepath)
+
+
+def conditional_get(
+    url: str,
+    headers: dict,
+    dependency: str,
+    cache_dir: str = None,
+    revalidate: bool = False,
+    **kwargs,
+):
+    """Send a conditional GET request for a URL whose parsed result may be
+    cached. If a version of `dependency` was previously parsed from this URL,
+    the stored ETag/Last-Modified validators are sent with the request.
+
+    Args:
+        url (str): The URL to send the request to
+        headers (dict): A dictionary of headers to send with the request
+        dependency (str): The dependency the parsed result is stored under
+        cache_dir (str, optional): The directory the cache is stored in.
+                                   Defaults to None, which disables caching.
+        revalidate (bool, optional): Send the validators even if no version
+                                     of `dependency` is stored, because the
+                                     caller can answer from its own cache of
+                                     the content. Defaults to False.
+        **kwargs: Passed on to get_request
+
+    Returns:
+        tuple: The response, or None if the content has not changed, and the
+               cache entry for the URL
+    """
+    entry = {}
+    headers = dict(headers or {})
+
+    if cache_dir is not None:
+        entry = load_cache_entry(cache_dir, "http", url)
+
+        if revalidate or (dependency in entry.get("versions", {})):
+            if entry.get("etag") is not None:
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified") is not None:
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+    resp = get_request(url, headers=headers, **kwargs)
+
+    if resp.status_code == 304:
+        resp.close()
+        logger.info("Not modified, using cached version: %s" % url)
+        return None, entry
+
+    return resp, entry
+
+
+def update_http_cache(
+    cache_dir: str, url: str, resp, entry: dict, dependency: str, version
+) -> None:
+    """Store the validators of a response and the version parsed from it
+
+    Args:
+        cache_dir (str): The directory the cache is stored in. If None,
+                         nothing is stored.
+        url (str): The URL the response was requested from
+        resp (requests.Response): The response to a conditional_get request
+        entry (dict): The cache entry returned by conditional_get
+        dependency (str): The dependency the version belongs to
+        version: The version parsed from the response
+    """
+    if cache_dir is None:
+        return
+
+    etag = resp.headers.get("ETag")
+    last_modified = resp.headers.get("Last-Modified")
+
+    if (etag is None) and (last_modified is None):
+        return
+
+    if (etag, last_modified) != (
+        entry.get("etag"),
+        entry.get("last_modified"),
+    ):
+        # The content has changed so versions of other dependencies are stale
+        entry = {"etag": etag, "last_modified": last_modified, "versions": {}}
+
+    entry.setdefault("versions", {})[dependency] = version
+    save_cache_entry(cache_dir, "http", url, entry)
+
+
+def _parsed_version_key(content: bytes, dependency: str) -> str:
+    """Build the key a parsed version is stored under"""
+    return "%s:%s" % (hashlib.sha256(content).hexdigest(), dependency)
+
+
+def lookup_parsed_version(cache_dir: str, content: bytes, dependency: str):
+    """Look up the version of a dependency previously parsed from identical
+    content
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        content (bytes): The downloaded content
+        dependency (str): The dependency to look up the version of
+
+    Returns:
+        The stored version, or None if this content has not been parsed before
+    """
+    key = _parsed_version_key(content, dependency)
+
+    # Lookups are read-only so that concurrent processes only race on stores
+    store = load_cache_entry(cache_dir, "versions", "parsed")
+    if key not in store:
+        return None
+
+    logger.info("Content unchanged, using parsed version of: %s" % dependency)
+
+    return store[key]["version"]
+
+
+def store_parsed_version(
+    cache_dir: str,
+    content: bytes,
+    dependency: str,
+    version,
+    max_entries: int = MAX_PARSED_VERSIONS,
+) -> None:
+    """Store the version of a dependency parsed from some content. The least
+    recently stored entries are evicted once the store holds more than
+    `max_entries`.
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        content (bytes): The downloaded content
+        dependency (str): The dependency the version belongs to
+        version: The version parsed from the content
+        max_entries (int, optional): The maximum number of entries to keep.
+                                     Defaults to MAX_PARSED_VERSIONS.
+    """
+    key = _parsed_version_key(content, dependency)
+
+    with _parsed_versions_lock:
+        store = load_cache_entry(cache_dir, "versions", "parsed")
+        store[key] = {"version": version, "last_used": time.time()}
+
+        if len(store) > max_entries:
+            by_age = sorted(store, key=lambda k: store[k]["last_used"])
+            for old_key in by_age[: len(store) - max_entries]:
+                del store[old_key]
+
+        save_cache_entry(cache_dir, "versions", "parsed", store)
+
+
+def _compact_index_path(cache_dir: str, url: str) -> str:
+    """Build the path of the compact index of a Helm repository"""
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "index", f"{digest}.jsonl")
+
+
+def _normalise_created(created) -> str:
+    """Format a `created` timestamp in UTC so that timestamps sort
+    chronologically as strings"""
+    return parse_created(created).astimezone(timezone.utc).isoformat()
+
+
+def load_compact_releases(cache_dir: str, url: str, chart: str) -> list:
+    """Load the releases of a chart from the compact index of a Helm
+    repository. Each line of the index is a JSON array of a chart name and
+    its [version, created] pairs in order of creation, and a chart may span
+    several lines as new releases are appended. Only the lines of `chart`
+    are decoded.
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        url (str): The URL of the Helm repository index
+        chart (str): The chart to load the releases of
+
+    Returns:
+        list: The [version, created] pairs of the chart, oldest first. Empty
+              if the chart is not in the index.
+    """
+    prefix = "[%s, " % json.dumps(chart)
+    releases = []
+
+    try:
+        with open(_compact_index_path(cache_dir, url), "r") as stream:
+            for line in stream:
+                if line.startswith(prefix):
+                    releases.extend(json.loads(line)[1])
+    except FileNotFoundError:
+        return []
+
+    # Appended lines are each in order so only need merging
+    releases.sort(key=lambda release: release[1])
+
+    return releases
+
+
+def latest_compact_release(releases: list, by: str = "created") -> str:
+    """Select the latest version from the releases of a compact index
+
+    Args:
+        releases (list): The [version, created] pairs, oldest first
+        by (str, optional): Select by the "created" timestamp or by semantic
+                            "version". Defaults to "created".
+
+    Returns:
+        str: The latest version
+    """
+    if not releases:
+        raise ValueError("No release entries to select from")
+
+    if by == "created":
+        return releases[-1][0]
+    elif by == "version":
+        return max(releases, key=lambda release: version_key(release[0]))[0]
+
+    raise ValueError("by must be one of 'created' or 'version': %s" % by)
+
+
+def update_compact_index(cache_dir: str, url: str, index: dict) -> int:
+    """Append the releases of a parsed Helm repository index that are not yet
+    in its compact index
+
+    Args:
+        cache_dir (str): The directory the cache is stored in
+        url (str): The URL of the Helm repository index
+        index (dict): The release entries of each chart, as from
+                      load_index_entries
+
+    Returns:
+        int: The number of releases appended
+    """
+    filepath = _compact_index_path(cache_dir, url)
+
+    with _compact_index_lock:
+        known = {}
+        try:
+            with open(filepath, "r") as stream:
+                for line in stream:
+                    chart, releases = json.loads(line)
+                    known.setdefault(chart, set()).update(
+                        version for (version, _) in releases
+                    )
+        except FileNotFoundError:
+            pass
+
+        lines = []
+        count = 0
+        for chart, entries in index.items():
+            releases = []
+            for entry in entries:
+                version = str(entry.get("version"))
+                if version in known.get(chart, ()):
+                    continue
+
+                try:
+                    created = _normalise_created(entry.get("created"))
+                except ValueError as err:
+                    logger.warning(
+                        "Skipping release entry %s of %s: %s"
+                        % (version, chart, err)
+                    )
+                    continue
+
+                releases.append([version, created])
+
+            if releases:
+                releases.sort(key=lambda release: release[1])
+                lines.append(json.dumps([chart, releases]) + "\n")
+                count += len(releases)
+
+        if not lines:
+            return 0
+
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "a") as stream:
+            stream.writelines(lines)
+
+    logger.info("Added %d releases to compact index of: %s" % (count, url))
+
+    return count
+
+
+def configure_index_cache(ttl: float = INDEX_TTL) -> None:
+    """Configure the in-memory cache of parsed Helm repository indexes and
+    empty it
+
+    Args:
+        ttl (float, optional): The number of seconds a parsed index is reused
+                               for. Zero disables the cache.
+                               Defaults to INDEX_TTL.
+    """
+    if ttl < 0:
+        raise ValueError("ttl must not be negative: %s" % ttl)
+
+    _index_cache_config["ttl"] = ttl
+    clear_index_cache()
+
+
+def clear_index_cache() -> None:
+    """Forget all parsed Helm repository indexes"""
+    with _index_cache_lock:
+        _index_cache.clear()
+
+
+def index_cache_enabled() -> bool:
+    """Check whether parsed Helm repository indexes are cached
+
+    Returns:
+        bool: True if indexes are cached
+    """
+    return _index_cache_config["ttl"] > 0
+
+
+def _index_key(url: str) -> str:
+    """Normalise the URL of a Helm repository index for the in-memory cache.
+    The gh-pages branch of a GitHub repository is served both from
+    raw.githubusercontent.com and GitHub Pages, so both share one entry.
+
+    Args:
+        url (str): The URL of the index
+
+    Returns:
+        str: The key of the index in the cache
+    """
+    parts = urlsplit(url)
+    scheme, host = parts.scheme, parts.netloc.lower()
+    path = re.sub(r"/+", "/", parts.path)
+
+    segments = path.strip("/").split("/")
+    if (
+        (host == "raw.githubusercontent.com")
+        and (len(segments) > 3)
+        and (segments[2] == "gh-pages")
+    ):
+        scheme, host = "https", segments[0].lower() + ".github.io"
+        path = "/" + "/".join([segments[1]] + segments[3:])
+
+    return urlunsplit((scheme, host, path, parts.query, ""))
+
+
+def index_lock(url: str) -> threading.Lock:
+    """Get the lock that serialises downloads of a Helm repository index, so
+    that dependencies pulled at the same time wait for a single download
+
+    Args:
+        url (str): The URL of the index
+
+    Returns:
+        threading.Lock: The lock for the URL
+    """
+    with _index_cache_lock:
+        return _index_locks.setdefault(_index_key(url), threading.Lock())
+
+
+def get_cached_index(url: str) -> dict:
+    """Look up a parsed Helm repository index
+
+    Args:
+        url (str): The URL of the index
+
+    Returns:
+        dict: The release entries of each chart in the index, or None if it
+              has not been parsed within the TTL
+    """
+    with _index_cache_lock:
+        cached = _index_cache.get(_index_key(url))
+
+    if (cached is None) or (cached[0] <= time.monotonic()):
+        return None
+
+    return cached[1]
+
+
+def store_cached_index(url: str, entries: dict) -> None:
+    """Store a parsed Helm repository index for the TTL
+
+    Args:
+        url (str): The URL of the index
+        entries (dict): The release entries of each chart in the index
+    """
+    if not index_cache_enabled():
+        return
+
+    expires = time.monotonic() + _index_cache_config["ttl"]
+    with _index_cache_lock:
+        _index_cache[_index_key(url)] = (expires, entries)
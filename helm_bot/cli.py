@@ -1,9 +1,21 @@
 import os
 import sys
 import atexit
+import signal
 import logging
 import argparse
+import threading
 from .app import run, clean_up
+from .batch import load_manifest, run_batch
+from .cache import INDEX_TTL, configure_index_cache
+from .daemon import DEFAULT_INTERVAL, run_daemon
+from .helper_functions import (
+    configure_commands,
+    configure_retries,
+    configure_session,
+)
+from .versions import UPGRADE_POLICIES
+from .webhook import RECHECK_DELAY, replay_webhook, serve_webhooks
 
 # from .github import remove_fork
 
@@ -26,21 +38,8 @@ def logging_setup(verbose=False):
         )
 
 
-def parse_args(args):
-    # Create argument parser
-    DESCRIPTION = "Upgrade the Helm Chart of the Hub23 Helm Chart in the hub23-deploy GitHub repository"
-    parser = argparse.ArgumentParser(description=DESCRIPTION)
-
-    # Define positional arguments
-    parser.add_argument(
-        "repo_owner", type=str, help="The GitHub repository owner"
-    )
-    parser.add_argument("repo_name", type=str, help="The deployment repo name")
-    parser.add_argument(
-        "chart_name", type=str, help="The name of the local helm chart"
-    )
-
-    # Define optional arguments that take parameters
+def add_token_args(parser):
+    # Define optional arguments locating the GitHub token
     parser.add_argument(
         "-k",
         "--keyvault",
@@ -53,26 +52,68 @@ def parse_args(args):
         type=str,
         help="Name of the bot's access token as stored in the Azure Key Vault",
     )
+
+
+def add_common_args(parser):
+    # Define optional arguments shared by all entry points
     parser.add_argument(
-        "-t",
-        "--target-branch",
+        "--pool-size",
+        type=int,
+        default=10,
+        help="Maximum number of pooled HTTP connections per host. Default: 10.",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=60,
+        help="Timeout in seconds for HTTP requests. Default: 60.",
+    )
+    parser.add_argument(
+        "--retry-budget",
+        type=float,
+        default=120,
+        help="Total seconds to spend retrying transient HTTP and git failures, per round of checks in daemon and webhook mode. Default: 120.",
+    )
+    parser.add_argument(
+        "--index-ttl",
+        type=float,
+        default=INDEX_TTL,
+        help="Seconds to reuse a parsed Helm repository index for. 0 disables the cache. Default: %d."
+        % INDEX_TTL,
+    )
+    parser.add_argument(
+        "--cmd-timeout",
+        type=float,
+        default=None,
+        help="Timeout in seconds after which git and az commands are killed. Default is no timeout.",
+    )
+
+    parser.add_argument(
+        "-p",
+        "--policy",
         type=str,
-        default="helm_chart_bump",
-        help="The git branch to commit to. Default: helm_chart_bump.",
+        choices=UPGRADE_POLICIES,
+        default="prerelease",
+        help="Which newer chart versions count as upgrades. Default: prerelease.",
     )
     parser.add_argument(
-        "-b",
-        "--base-branch",
+        "--clone-mode",
         type=str,
-        default="main",
-        help="The base branch to open the Pull Request against. Default: main.",
+        choices=["full", "sparse", "api"],
+        default="full",
+        help="Clone the whole fork, only a shallow, sparse checkout of the chart directory, or make the changes through the GitHub API without cloning. Default: full.",
     )
     parser.add_argument(
-        "-l",
-        "--labels",
-        nargs="+",
+        "--mirror-dir",
+        type=str,
         default=None,
-        help="List of labels to assign to the Pull Request",
+        help="Directory to keep a mirror of the fork in between runs. Only new objects are fetched on each run.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory to cache chart source downloads in between runs",
     )
 
     # Define optional boolean flags
@@ -84,6 +125,11 @@ def parse_args(args):
     parser.add_argument(
         "--dry-run", action="store_true", help="Perform a dry-run helm upgrade"
     )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="Fetch all chart sources concurrently",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -91,6 +137,47 @@ def parse_args(args):
         help="Print output to the console. Default is to write to a log file.",
     )
 
+
+def parse_args(args):
+    # Create argument parser
+    DESCRIPTION = "Upgrade the Helm Chart of the Hub23 Helm Chart in the hub23-deploy GitHub repository"
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+
+    # Define positional arguments
+    parser.add_argument(
+        "repo_owner", type=str, help="The GitHub repository owner"
+    )
+    parser.add_argument("repo_name", type=str, help="The deployment repo name")
+    parser.add_argument(
+        "chart_name", type=str, help="The name of the local helm chart"
+    )
+
+    # Define optional arguments that take parameters
+    add_token_args(parser)
+    parser.add_argument(
+        "-t",
+        "--target-branch",
+        type=str,
+        default="helm_chart_bump",
+        help="The git branch to commit to. Default: helm_chart_bump.",
+    )
+    parser.add_argument(
+        "-b",
+        "--base-branch",
+        type=str,
+        default="main",
+        help="The base branch to open the Pull Request against. Default: main.",
+    )
+    parser.add_argument(
+        "-l",
+        "--labels",
+        nargs="+",
+        default=None,
+        help="List of labels to assign to the Pull Request",
+    )
+
+    add_common_args(parser)
+
     return parser.parse_args()
 
 
@@ -127,6 +214,10 @@ def main():
     atexit.register(clean_up, repo_name=args.repo_name)
 
     logging_setup(verbose=args.verbose)
+    configure_session(pool_size=args.pool_size, timeout=args.timeout)
+    configure_commands(timeout=args.cmd_timeout)
+    configure_retries(budget=args.retry_budget)
+    configure_index_cache(ttl=args.index_ttl)
 
     run(
         chart_name=args.chart_name,
@@ -140,8 +231,241 @@ def main():
         keyvault=args.keyvault,
         dry_run=args.dry_run,
         identity=args.identity,
+        concurrent=args.concurrent,
+        cache_dir=args.cache_dir,
+        policy=args.policy,
+        clone_mode=args.clone_mode,
+        mirror_dir=args.mirror_dir,
+    )
+
+
+def parse_batch_args(args):
+    # Create argument parser
+    DESCRIPTION = "Upgrade the Helm Charts of all the deployment repositories listed in a manifest"
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+
+    # Define positional arguments
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="A YAML file listing the repositories and charts to upgrade",
+    )
+
+    # Define optional arguments
+    add_token_args(parser)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Maximum number of repositories to upgrade at once. Default: 1.",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        help="Seconds between checks of each repository in daemon mode. Default: %d."
+        % DEFAULT_INTERVAL,
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0,
+        help="Maximum seconds added to each interval at random in daemon mode. Default: 0.",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running and check the repositories on a schedule",
+    )
+    add_common_args(parser)
+
+    return parser.parse_args(args)
+
+
+def batch_main():
+    """Main Function for upgrading many repositories in one process"""
+    args = parse_batch_args(sys.argv[1:])
+    check_parser(args)
+
+    logging_setup(verbose=args.verbose)
+    configure_session(pool_size=args.pool_size, timeout=args.timeout)
+    configure_commands(timeout=args.cmd_timeout)
+    configure_retries(budget=args.retry_budget)
+    configure_index_cache(ttl=args.index_ttl)
+
+    repos = load_manifest(args.manifest)
+    batch_kwargs = {
+        "token": args.token,
+        "token_name": args.token_name,
+        "keyvault": args.keyvault,
+        "identity": args.identity,
+        "workers": args.workers,
+        "dry_run": args.dry_run,
+        "concurrent": args.concurrent,
+        "cache_dir": args.cache_dir,
+        "policy": args.policy,
+        "clone_mode": args.clone_mode,
+        "mirror_dir": args.mirror_dir,
+    }
+
+    if args.daemon:
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+        try:
+            run_daemon(
+                repos,
+                interval=args.interval,
+                jitter=args.jitter,
+                stop_event=stop_event,
+                **batch_kwargs,
+            )
+        except KeyboardInterrupt:
+            pass
+
+        return
+
+    failures = run_batch(repos, **batch_kwargs)
+
+    if failures:
+        sys.exit(1)
+
+
+def parse_webhook_args(args):
+    # Create argument parser
+    DESCRIPTION = "Listen for GitHub webhooks from the upstream chart repositories and upgrade the Helm Charts listed in a manifest"
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+
+    # Define positional arguments
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="A YAML file listing the repositories and charts to upgrade",
     )
 
+    # Define optional arguments
+    add_token_args(parser)
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="",
+        help="Address to listen on. Default is all interfaces.",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8080,
+        help="Port to listen on. Default: 8080.",
+    )
+    parser.add_argument(
+        "--recheck-delay",
+        type=float,
+        default=RECHECK_DELAY,
+        help="Seconds after a triggered check to check the dependencies again, once upstream caches have expired. 0 disables the recheck. Default: %d."
+        % RECHECK_DELAY,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Maximum number of repositories to upgrade at once. Default: 1.",
+    )
+    add_common_args(parser)
+
+    return parser.parse_args(args)
+
+
+def webhook_main():
+    """Main Function for upgrading repositories when webhooks are received"""
+    args = parse_webhook_args(sys.argv[1:])
+    check_parser(args)
+
+    secret = os.environ.get("WEBHOOK_SECRET")
+    if secret is None:
+        raise ValueError(
+            "The webhook secret must be provided with the WEBHOOK_SECRET environment variable"
+        )
+
+    logging_setup(verbose=args.verbose)
+    configure_session(pool_size=args.pool_size, timeout=args.timeout)
+    configure_commands(timeout=args.cmd_timeout)
+    configure_retries(budget=args.retry_budget)
+    configure_index_cache(ttl=args.index_ttl)
+
+    repos = load_manifest(args.manifest)
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    try:
+        serve_webhooks(
+            repos,
+            secret,
+            host=args.host,
+            port=args.port,
+            stop_event=stop_event,
+            recheck_delay=args.recheck_delay,
+            token=args.token,
+            token_name=args.token_name,
+            keyvault=args.keyvault,
+            identity=args.identity,
+            workers=args.workers,
+            dry_run=args.dry_run,
+            concurrent=args.concurrent,
+            cache_dir=args.cache_dir,
+            policy=args.policy,
+            clone_mode=args.clone_mode,
+            mirror_dir=args.mirror_dir,
+        )
+    except KeyboardInterrupt:
+        pass
+
+
+def parse_replay_args(args):
+    # Create argument parser
+    DESCRIPTION = "Replay a saved GitHub webhook delivery to a local helm-bot-webhook listener"
+    parser = argparse.ArgumentParser(description=DESCRIPTION)
+
+    # Define positional arguments
+    parser.add_argument(
+        "event", type=str, help="The event type, e.g. push or release"
+    )
+    parser.add_argument(
+        "payload", type=str, help="A JSON file containing the payload"
+    )
+
+    # Define optional arguments
+    parser.add_argument(
+        "-u",
+        "--url",
+        type=str,
+        default="http://localhost:8080",
+        help="URL of the listener. Default: http://localhost:8080.",
+    )
+
+    return parser.parse_args(args)
+
+
+def replay_main():
+    """Main Function for replaying webhook deliveries"""
+    args = parse_replay_args(sys.argv[1:])
+
+    secret = os.environ.get("WEBHOOK_SECRET")
+    if secret is None:
+        raise ValueError(
+            "The webhook secret must be provided with the WEBHOOK_SECRET environment variable"
+        )
+
+    with open(args.payload, "rb") as stream:
+        body = stream.read()
+
+    resp = replay_webhook(args.url, args.event, body, secret)
+    print(resp.status_code)
+
+    if not resp:
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
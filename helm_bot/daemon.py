@@ -0,0 +1,163 @@
+import time
+import heapq
+import random
+import logging
+import threading
+from .batch import run_batch
+from .helper_functions import reset_retry_budget
+
+logger = logging.getLogger()
+
+# The default number of seconds between checks of each repository
+DEFAULT_INTERVAL = 3600
+
+
+def _next_check(now: float, interval: float, jitter: float) -> float:
+    """Calculate when a repository is next due to be checked
+
+    Args:
+        now (float): The current time, from time.monotonic
+        interval (float): The number of seconds between checks
+        jitter (float): Up to this many seconds are randomly added to the
+                        interval so that checks of different repositories
+                        drift apart
+
+    Returns:
+        float: The time the next check is due
+    """
+    return now + interval + random.uniform(0, jitter)
+
+
+def schedule_repos(
+    repos: list,
+    interval: float = DEFAULT_INTERVAL,
+    jitter: float = 0,
+    now: float = None,
+) -> list:
+    """Build a schedule of repository checks. Every repository is due
+    immediately, apart from its jitter. Repositories may set their own
+    `interval` and `jitter` in the manifest.
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        interval (float, optional): The default number of seconds between
+                                    checks. Defaults to DEFAULT_INTERVAL.
+        jitter (float, optional): The default maximum number of seconds added
+                                  to each interval at random. Defaults to 0.
+        now (float, optional): The current time, from time.monotonic.
+                               Defaults to None, which reads the clock.
+
+    Returns:
+        list: A heap of (due, index, repo) tuples
+    """
+    if now is None:
+        now = time.monotonic()
+
+    schedule = []
+    for index, repo in enumerate(repos):
+        repo = dict(repo)
+        repo.setdefault("interval", interval)
+        repo.setdefault("jitter", jitter)
+
+        if repo["interval"] <= 0:
+            raise ValueError(
+                "interval must be positive for %s/%s: %s"
+                % (repo["repo_owner"], repo["repo_name"], repo["interval"])
+            )
+        if repo["jitter"] < 0:
+            raise ValueError(
+                "jitter must not be negative for %s/%s: %s"
+                % (repo["repo_owner"], repo["repo_name"], repo["jitter"])
+            )
+
+        due = now + random.uniform(0, repo["jitter"])
+        heapq.heappush(schedule, (due, index, repo))
+
+    return schedule
+
+
+def pop_due(schedule: list, now: float) -> list:
+    """Remove every check that is due from a schedule
+
+    Args:
+        schedule (list): A heap of checks, as from schedule_repos
+        now (float): The current time, from time.monotonic
+
+    Returns:
+        list: The (due, index, repo) tuples of the checks that are due
+    """
+    due = []
+    while schedule and (schedule[0][0] <= now):
+        due.append(heapq.heappop(schedule))
+
+    return due
+
+
+def run_daemon(
+    repos: list,
+    interval: float = DEFAULT_INTERVAL,
+    jitter: float = 0,
+    stop_event: threading.Event = None,
+    max_rounds: int = None,
+    **kwargs,
+) -> None:
+    """Check repositories on a schedule in a long-running process. The HTTP
+    connection pool, GitHub token and parsed versions stay warm between
+    checks, and a repository is only cloned and a Pull Request only opened
+    when check_versions finds an upgrade. Repositories that are due at the
+    same time are checked together so that their upstream chart versions are
+    only fetched once.
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        interval (float, optional): The default number of seconds between
+                                    checks of each repository.
+                                    Defaults to DEFAULT_INTERVAL.
+        jitter (float, optional): The default maximum number of seconds added
+                                  to each interval at random. Defaults to 0.
+        stop_event (threading.Event, optional): Set to stop the daemon.
+                                                Defaults to None.
+        max_rounds (int, optional): Stop after this many rounds of checks.
+                                    Defaults to None, which runs until
+                                    stop_event is set.
+        **kwargs: Passed on to run_batch for every round
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    schedule = schedule_repos(repos, interval=interval, jitter=jitter)
+    rounds = 0
+
+    logger.info("Scheduled checks of %d repositories" % len(schedule))
+
+    while not stop_event.is_set():
+        delay = schedule[0][0] - time.monotonic()
+        if delay > 0:
+            stop_event.wait(delay)
+            continue
+
+        checks = pop_due(schedule, time.monotonic())
+        reset_retry_budget()
+
+        try:
+            # Each round pulls fresh upstream versions
+            run_batch(
+                [repo for (_, _, repo) in checks],
+                version_cache={},
+                **kwargs,
+            )
+        except Exception as err:
+            logger.error("Round of checks failed: %s" % err)
+
+        now = time.monotonic()
+        for _, index, repo in checks:
+            due = _next_check(now, repo["interval"], repo["jitter"])
+            heapq.heappush(schedule, (due, index, repo))
+
+        rounds += 1
+        if (max_rounds is not None) and (rounds >= max_rounds):
+            break
+
+        logger.info("Next check in %d seconds" % max(schedule[0][0] - now, 0))
+
+    logger.info("Daemon stopped after %d rounds of checks" % rounds)
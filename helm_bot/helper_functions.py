@@ -1,9 +1,435 @@
+import os
+import re
+import time
+import random
+import shutil
+import signal
+import asyncio
 import logging
+import weakref
 import requests
+import threading
 import subprocess
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger()
 
+# The shared HTTP session and the settings it was created with
+_session = None
+_session_lock = threading.RLock()
+_session_config = {"pool_size": 10, "timeout": (10, 60)}
+
+# Settings for pacing requests to rate limited APIs. Once fewer than
+# `reserve` requests remain, the rest are spread evenly until the limit
+# resets. Rate limited responses are retried up to `max_retries` times.
+_rate_limit_config = {
+    "reserve": 100,
+    "max_retries": 3,
+    "backoff": 60,
+    "max_wait": 900,
+}
+
+# The last seen quota of each rate limited API, keyed by host and resource,
+# and counters of how requests have been throttled
+_rate_limits = {}
+_rate_limit_metrics = {
+    "requests": 0,
+    "rate_limited": 0,
+    "retried": 0,
+    "waited": 0.0,
+}
+_rate_limit_lock = threading.Lock()
+
+# Settings for retrying transient failures. Waits grow exponentially from
+# `backoff` seconds up to `max_backoff`, and stop once `budget` seconds have
+# been spent waiting in total, so that a run cannot overrun its schedule.
+_retry_config = {
+    "max_retries": 3,
+    "backoff": 2,
+    "max_backoff": 30,
+    "budget": 120,
+}
+_retry_spent = {"seconds": 0.0}
+_retry_lock = threading.Lock()
+
+# Only requests that can safely be repeated are retried
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+TRANSIENT_STATUSES = (500, 502, 503, 504)
+
+# git subcommands that talk to a remote, and the errors they report when
+# the network or the remote has a temporary problem
+NETWORK_GIT_COMMANDS = ("clone", "fetch", "pull", "push", "ls-remote")
+TRANSIENT_GIT_ERRORS = re.compile(
+    r"could not resolve host|connection (timed out|reset|refused)"
+    r"|operation timed out|the remote end hung up unexpectedly|early eof"
+    r"|rpc failed|returned error: 5\d\d|http 5\d\d|tls connection"
+    r"|gnutls_handshake|unexpected disconnect|temporary failure"
+    r"|command timed out after",
+    re.IGNORECASE,
+)
+
+# Options of `git clone` that take their value as the next argument
+GIT_CLONE_VALUE_OPTIONS = (
+    "-b",
+    "--branch",
+    "-c",
+    "--config",
+    "--depth",
+    "-j",
+    "--jobs",
+    "-o",
+    "--origin",
+    "--reference",
+    "--reference-if-able",
+    "--separate-git-dir",
+    "--shallow-exclude",
+    "--shallow-since",
+    "--template",
+    "-u",
+    "--upload-pack",
+)
+
+# Settings for running shell commands and the per-event-loop semaphores
+# limiting how many run at once
+_cmd_config = {"max_concurrent": 4, "timeout": None}
+_cmd_semaphores = weakref.WeakKeyDictionary()
+
+
+def configure_session(
+    pool_size: int = 10, timeout=(10, 60)
+) -> requests.Session:
+    """Create the shared HTTP session used by all requests. Connections are
+    kept alive and pooled per host so that repeated calls to the same API
+    reuse an open TCP/TLS connection.
+
+    Args:
+        pool_size (int, optional): The maximum number of connections to keep
+                                   open per host. Defaults to 10.
+        timeout (float or tuple, optional): The timeout, or (connect, read)
+                                            timeouts, in seconds to apply to
+                                            every request. Defaults to (10, 60).
+
+    Returns:
+        requests.Session: The shared session
+    """
+    global _session
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+
+        _session = session
+        _session_config["pool_size"] = pool_size
+        _session_config["timeout"] = timeout
+
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the shared HTTP session, creating it with the default settings
+    if it has not been configured yet
+
+    Returns:
+        requests.Session: The shared session
+    """
+    with _session_lock:
+        if _session is None:
+            configure_session(**_session_config)
+
+        return _session
+
+
+def configure_retries(
+    max_retries: int = 3,
+    backoff: float = 2,
+    max_backoff: float = 30,
+    budget: float = 120,
+) -> None:
+    """Configure how transient HTTP and git failures are retried. Calling
+    this also resets the retry time spent so far.
+
+    Args:
+        max_retries (int, optional): The number of times to retry a failed
+                                     request or command. Defaults to 3.
+        backoff (float, optional): The base delay in seconds, doubled on
+                                   each attempt. Defaults to 2.
+        max_backoff (float, optional): The longest delay in seconds between
+                                       two attempts. Defaults to 30.
+        budget (float, optional): The total seconds that may be spent
+                                  waiting to retry, across all requests and
+                                  commands. Defaults to 120.
+    """
+    with _retry_lock:
+        _retry_config["max_retries"] = max_retries
+        _retry_config["backoff"] = backoff
+        _retry_config["max_backoff"] = max_backoff
+        _retry_config["budget"] = budget
+        _retry_spent["seconds"] = 0.0
+
+
+def reset_retry_budget() -> None:
+    """Reset the retry time spent so far, so that a long-running process
+    gets the full budget for each round of checks"""
+    with _retry_lock:
+        _retry_spent["seconds"] = 0.0
+
+
+def _retry_delay(attempt: int):
+    """Decide whether to retry a transient failure, and reserve the time to
+    wait from the retry budget
+
+    Args:
+        attempt (int): The number of retries already made
+
+    Returns:
+        float: The number of seconds to wait before retrying, or None if no
+               retries or budget are left
+    """
+    if attempt >= _retry_config["max_retries"]:
+        return None
+
+    # Capped exponential backoff with jitter
+    cap = min(
+        _retry_config["max_backoff"], _retry_config["backoff"] * 2**attempt
+    )
+    delay = random.uniform(cap / 2, cap)
+
+    with _retry_lock:
+        if _retry_spent["seconds"] + delay > _retry_config["budget"]:
+            return None
+
+        _retry_spent["seconds"] += delay
+
+    return delay
+
+
+def configure_rate_limits(
+    reserve: int = 100,
+    max_retries: int = 3,
+    backoff: float = 60,
+    max_wait: float = 900,
+) -> None:
+    """Configure how requests to rate limited APIs are paced
+
+    Args:
+        reserve (int, optional): Start spacing requests out once fewer than
+                                 this many remain in the quota.
+                                 Defaults to 100.
+        max_retries (int, optional): The number of times to retry a rate
+                                     limited request. Defaults to 3.
+        backoff (float, optional): The base delay in seconds before retrying
+                                   a request that was rate limited without
+                                   saying for how long. Defaults to 60, as
+                                   GitHub recommends.
+        max_wait (float, optional): The longest time in seconds to wait
+                                    before any one request. Defaults to 900.
+    """
+    _rate_limit_config["reserve"] = reserve
+    _rate_limit_config["max_retries"] = max_retries
+    _rate_limit_config["backoff"] = backoff
+    _rate_limit_config["max_wait"] = max_wait
+
+
+def reset_rate_limits() -> None:
+    """Forget all recorded quotas and reset the throttling counters"""
+    with _rate_limit_lock:
+        _rate_limits.clear()
+        _rate_limit_metrics.update(
+            {"requests": 0, "rate_limited": 0, "retried": 0, "waited": 0.0}
+        )
+
+
+def get_rate_limit_metrics() -> dict:
+    """Report the last seen quota of each rate limited API and how requests
+    have been throttled
+
+    Returns:
+        dict: The number of requests sent, the number that were rate limited
+              and retried after transient failures, the total seconds spent
+              waiting and the quota of each API, keyed by "host/resource"
+    """
+    with _rate_limit_lock:
+        metrics = dict(_rate_limit_metrics)
+        metrics["quotas"] = {
+            "%s/%s" % key: dict(quota) for (key, quota) in _rate_limits.items()
+        }
+
+    return metrics
+
+
+def _rate_limit_key(url: str) -> tuple:
+    """Build the key the quota for a URL is tracked under. GitHub counts
+    GraphQL requests separately from REST requests."""
+    parts = urlsplit(url)
+    resource = (
+        "graphql" if parts.path.rstrip("/").endswith("/graphql") else "core"
+    )
+    return (parts.netloc, resource)
+
+
+def _rate_limit_delay(key: tuple) -> float:
+    """Work out how long to wait before the next request so that the
+    remaining quota lasts until it resets"""
+    with _rate_limit_lock:
+        quota = _rate_limits.get(key)
+
+    if quota is None:
+        return 0
+
+    until_reset = quota["reset"] - time.time()
+    if (until_reset <= 0) or (
+        quota["remaining"] >= _rate_limit_config["reserve"]
+    ):
+        return 0
+
+    if quota["remaining"] <= 0:
+        return until_reset
+
+    return until_reset / (quota["remaining"] + 1)
+
+
+def _record_rate_limit(key: tuple, resp) -> None:
+    """Store the quota reported in the headers of a response"""
+    headers = resp.headers
+    if "X-RateLimit-Remaining" not in headers:
+        return
+
+    try:
+        quota = {
+            "limit": int(headers.get("X-RateLimit-Limit", 0)),
+            "remaining": int(headers["X-RateLimit-Remaining"]),
+            "reset": float(headers.get("X-RateLimit-Reset", 0)),
+        }
+    except ValueError:
+        return
+
+    with _rate_limit_lock:
+        _rate_limits[key] = quota
+
+
+def _retry_after(key: tuple, resp, attempt: int):
+    """Decide whether a response was rate limited and how long to wait
+    before retrying it
+
+    Returns:
+        float: The number of seconds to wait, or None if the response was not
+               rate limited
+    """
+    if resp.status_code not in (403, 429):
+        return None
+
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+    if resp.headers.get("X-RateLimit-Remaining") == "0":
+        return max(_rate_limit_delay(key), 1)
+
+    if (resp.status_code == 429) or ("rate limit" in resp.text.lower()):
+        # A secondary rate limit. Back off exponentially with full jitter.
+        return random.uniform(1, _rate_limit_config["backoff"] * 2**attempt)
+
+    return None
+
+
+def _wait(seconds: float) -> None:
+    seconds = min(seconds, _rate_limit_config["max_wait"])
+
+    with _rate_limit_lock:
+        _rate_limit_metrics["waited"] += seconds
+
+    time.sleep(seconds)
+
+
+def _send(method: str, url: str, **kwargs) -> requests.Response:
+    """Send a request with the shared session, pacing it to the remaining
+    quota of rate limited APIs and retrying it if it is rate limited.
+    Idempotent requests are also retried after connection errors and
+    transient server errors.
+
+    Args:
+        method (str): The HTTP method
+        url (str): The URL to send the request to
+        **kwargs: Passed on to requests.Session.request
+
+    Returns:
+        requests.Response: The final response
+    """
+    key = _rate_limit_key(url)
+    kwargs.setdefault("timeout", _session_config["timeout"])
+    idempotent = method.upper() in IDEMPOTENT_METHODS
+
+    attempt = 0
+    transient_attempt = 0
+    while True:
+        delay = _rate_limit_delay(key)
+        if delay > 0:
+            logger.info("Pacing requests to %s for %.1fs" % (key[0], delay))
+            _wait(delay)
+
+        with _rate_limit_lock:
+            _rate_limit_metrics["requests"] += 1
+
+        try:
+            resp = get_session().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as err:
+            retry_delay = (
+                _retry_delay(transient_attempt) if idempotent else None
+            )
+            if retry_delay is None:
+                raise
+
+            _retry_transient(url, err, retry_delay)
+            transient_attempt += 1
+            continue
+
+        _record_rate_limit(key, resp)
+
+        if idempotent and (resp.status_code in TRANSIENT_STATUSES):
+            retry_delay = _retry_delay(transient_attempt)
+            if retry_delay is not None:
+                resp.close()
+                _retry_transient(url, resp.status_code, retry_delay)
+                transient_attempt += 1
+                continue
+
+        wait = _retry_after(key, resp, attempt)
+        if wait is None:
+            return resp
+
+        with _rate_limit_lock:
+            _rate_limit_metrics["rate_limited"] += 1
+
+        if attempt >= _rate_limit_config["max_retries"]:
+            return resp
+
+        logger.warning(
+            "Rate limited by %s, retrying in %.1fs" % (key[0], wait)
+        )
+        resp.close()
+        _wait(wait)
+        attempt += 1
+
+
+def _retry_transient(url: str, reason, delay: float) -> None:
+    logger.warning(
+        "Request to %s failed (%s), retrying in %.1fs" % (url, reason, delay)
+    )
+
+    with _rate_limit_lock:
+        _rate_limit_metrics["retried"] += 1
+
+    _wait(delay)
+
 
 def delete_request(url: str, headers: dict = None) -> None:
     """Send a DELETE request to an HTTP API endpoint
@@ -13,7 +439,7 @@ def delete_request(url: str, headers: dict = None) -> None:
         headers (dict, optional): A dictionary of any headers to send with the
                                   request. Defaults to None.
     """
-    resp = requests.delete(url, headers=headers)
+    resp = _send("DELETE", url, headers=headers)
 
     if not resp:
         logger.error(resp.text)
@@ -26,6 +452,7 @@ def get_request(
     params: dict = None,
     json: bool = False,
     text: bool = False,
+    stream: bool = False,
 ):
     """Send a GET request to an HTTP API endpoint
 
@@ -35,11 +462,18 @@ def get_request(
         params (dict): A dictionary of parameters to send with the request
         json (bool, optional): Returns the json payload. Defaults to False.
         text (bool, optional): Returns the text payload. Defaults to False.
+        stream (bool, optional): Don't download the body up front. The
+                                 response is returned so that its body can be
+                                 consumed incrementally via `resp.raw`.
+                                 Defaults to False.
     """
     if json and text:
         raise ValueError("json and text kwargs cannot both be true")
 
-    resp = requests.get(url, headers=headers, params=params)
+    if stream and (json or text):
+        raise ValueError("stream kwarg cannot be used with json or text")
+
+    resp = _send("GET", url, headers=headers, params=params, stream=stream)
 
     if not resp:
         logger.error(resp.text)
@@ -53,6 +487,87 @@ def get_request(
         return resp
 
 
+def get_paginated(
+    url: str, headers: dict = None, params: dict = None, per_page: int = 100
+):
+    """Lazily iterate over the items of a paginated GitHub API list endpoint.
+    Pages are requested one at a time by following the `Link: rel="next"`
+    header, so a caller that stops iterating early, e.g. with `any()` or
+    `next()`, never requests the remaining pages.
+
+    Args:
+        url (str): The URL of the list endpoint
+        headers (dict, optional): A dictionary of any headers to send with the
+                                  requests. Defaults to None.
+        params (dict, optional): A dictionary of parameters to send with the
+                                 first request. Defaults to None.
+        per_page (int, optional): The number of items to request per page.
+                                  Defaults to 100, the GitHub maximum.
+
+    Yields:
+        The items of each page in turn
+    """
+    params = dict(params or {})
+    params.setdefault("per_page", per_page)
+
+    while url is not None:
+        resp = get_request(url, headers=headers, params=params)
+        yield from resp.json()
+
+        # The next page URL already carries the query parameters
+        url = resp.links.get("next", {}).get("url")
+        params = None
+
+
+def head_exists(url: str, headers: dict = None) -> bool:
+    """Check whether an HTTP API resource exists without downloading it
+
+    Args:
+        url (str): The URL of the resource
+        headers (dict, optional): A dictionary of any headers to send with the
+                                  request. Defaults to None.
+
+    Returns:
+        bool: True if the resource exists, False if the server responds with
+              404 Not Found
+    """
+    resp = _send("HEAD", url, headers=headers, allow_redirects=True)
+
+    if resp.status_code == 404:
+        return False
+
+    if not resp:
+        msg = "HEAD %s failed with status %s" % (url, resp.status_code)
+        logger.error(msg)
+        raise RuntimeError(msg)
+
+    return True
+
+
+def patch_request(
+    url: str, headers: dict = None, json: dict = None, return_json: bool = True
+):
+    """Send a PATCH request to an HTTP API endpoint
+
+    Args:
+        url (str): The URL to send the request to
+        headers (dict, optional): A dictionary of any headers to send with the
+                                  request. Defaults to None.
+        json (dict, optional): A dictionary containing JSON payload to send with
+                               the request. Defaults to None.
+        return_json (bool, optional): Return the JSON payload response.
+                                      Defaults to True.
+    """
+    resp = _send("PATCH", url, headers=headers, json=json)
+
+    if not resp:
+        logger.error(resp.text)
+        raise RuntimeError(resp.text)
+
+    if return_json:
+        return resp.json()
+
+
 def post_request(
     url: str, headers: dict = None, json: dict = None, return_json: bool = True
 ) -> None:
@@ -67,7 +582,7 @@ def post_request(
         return_json (bool, optional): Return the JSON payload response.
                                       Defaults to False.
     """
-    resp = requests.post(url, headers=headers, json=json)
+    resp = _send("POST", url, headers=headers, json=json)
 
     if not resp:
         logger.error(resp.text)
@@ -77,21 +592,179 @@ def post_request(
         return resp.json()
 
 
-def run_cmd(cmd: list) -> dict:
-    """Use Popen to run a bash command in a sub-shell
+def configure_commands(max_concurrent: int = 4, timeout: float = None):
+    """Configure how shell commands are run
+
+    Args:
+        max_concurrent (int, optional): The maximum number of commands
+                                        run_cmd_async runs at once in an
+                                        event loop. Defaults to 4.
+        timeout (float, optional): The number of seconds after which a
+                                   command is killed. Defaults to None, which
+                                   never kills commands.
+    """
+    if max_concurrent < 1:
+        raise ValueError(
+            "max_concurrent must be at least 1: %s" % max_concurrent
+        )
+
+    _cmd_config["max_concurrent"] = max_concurrent
+    _cmd_config["timeout"] = timeout
+    _cmd_semaphores.clear()
+
+
+def _timeout_msg(cmd: list, timeout: float) -> str:
+    # Only name the command, its arguments may contain credentials
+    return "Command timed out after %s seconds: %s" % (
+        timeout,
+        " ".join(cmd[:2]),
+    )
+
+
+def _kill(proc) -> None:
+    # Kill the whole process group, since children such as git's remote
+    # helpers would otherwise keep the pipes open after the parent has died
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _is_network_git_cmd(cmd: list) -> bool:
+    """Check if a command is a git subcommand that talks to a remote"""
+    if (len(cmd) == 0) or (os.path.basename(cmd[0]) != "git"):
+        return False
+
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ("-C", "-c"):
+            # Skip the value of global options
+            next(args, None)
+        elif not arg.startswith("-"):
+            return arg in NETWORK_GIT_COMMANDS
+
+    return False
+
+
+def _clone_destination(cmd: list, cwd: str = None) -> str:
+    """Find the directory a `git clone` command clones into
+
+    Args:
+        cmd (list): The git command
+        cwd (str, optional): The directory the command runs in. Defaults to
+                             None, which uses the current working directory.
+
+    Returns:
+        str: The path of the destination, or None if cmd is not a clone
+    """
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg == "-C":
+            cwd = os.path.join(cwd or "", next(args, ""))
+        elif arg == "-c":
+            next(args, None)
+        elif not arg.startswith("-"):
+            if arg != "clone":
+                return None
+            break
+    else:
+        return None
+
+    positional = []
+    for arg in args:
+        if arg in GIT_CLONE_VALUE_OPTIONS:
+            next(args, None)
+        elif arg == "--":
+            positional.extend(args)
+        elif not arg.startswith("-"):
+            positional.append(arg)
+
+    if len(positional) > 1:
+        dest = positional[1]
+    elif positional:
+        # git names the directory after the repository
+        dest = re.sub(r"(/\.git|\.git)?/*$", "", positional[0])
+        dest = re.split(r"[/:]", dest)[-1]
+    else:
+        return None
+
+    return os.path.join(cwd or "", dest)
+
+
+def run_cmd(cmd: list, cwd: str = None, timeout: float = None) -> dict:
+    """Use Popen to run a bash command in a sub-shell. git commands that talk
+    to a remote are retried if they fail with a transient network error.
 
     Args:
         cmd (list): The bash command to run
+        cwd (str, optional): The directory to run the command in. Defaults to
+                             None, which uses the current working directory.
+        timeout (float, optional): The number of seconds after which the
+                                   command is killed. Defaults to None, which
+                                   uses the configured timeout.
 
     Returns:
         dict: The output of the command, including status code and error
               messages
     """
+    retry = _is_network_git_cmd(cmd)
+
+    # A clone killed by the timeout leaves a partly written destination
+    # behind that every retry would fail on. Only remove one this call made.
+    clone_dest = _clone_destination(cmd, cwd) if retry else None
+    if (clone_dest is not None) and os.path.exists(clone_dest):
+        clone_dest = None
+
+    attempt = 0
+    while True:
+        result = _run_cmd_once(cmd, cwd=cwd, timeout=timeout)
+
+        if (
+            (result["returncode"] == 0)
+            or (not retry)
+            or (not TRANSIENT_GIT_ERRORS.search(result["err_msg"]))
+        ):
+            return result
+
+        delay = _retry_delay(attempt)
+        if delay is None:
+            return result
+
+        # Only name the command, its arguments may contain credentials
+        logger.warning(
+            "%s failed with a transient error, retrying in %.1fs: %s"
+            % (" ".join(cmd[:2]), delay, result["err_msg"])
+        )
+        with _rate_limit_lock:
+            _rate_limit_metrics["retried"] += 1
+
+        if (clone_dest is not None) and os.path.exists(clone_dest):
+            shutil.rmtree(clone_dest, ignore_errors=True)
+
+        time.sleep(delay)
+        attempt += 1
+
+
+def _run_cmd_once(cmd: list, cwd: str = None, timeout: float = None) -> dict:
+    """Run a bash command once. See run_cmd."""
+    if timeout is None:
+        timeout = _cmd_config["timeout"]
+
     proc = subprocess.Popen(
-        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        start_new_session=timeout is not None,
     )
 
-    msgs = proc.communicate()
+    timed_out = False
+    try:
+        msgs = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _kill(proc)
+        msgs = proc.communicate()
+        timed_out = True
 
     result = {
         "returncode": proc.returncode,
@@ -99,4 +772,91 @@ def run_cmd(cmd: list) -> dict:
         "err_msg": msgs[1].decode(encoding=("utf-8")).strip("\n"),
     }
 
+    if timed_out:
+        result["err_msg"] = "\n".join(
+            filter(None, [result["err_msg"], _timeout_msg(cmd, timeout)])
+        )
+
+    return result
+
+
+def _get_cmd_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore limiting the commands run in the current event
+    loop. asyncio primitives cannot be shared between loops so each loop gets
+    its own."""
+    loop = asyncio.get_running_loop()
+
+    if loop not in _cmd_semaphores:
+        _cmd_semaphores[loop] = asyncio.Semaphore(
+            _cmd_config["max_concurrent"]
+        )
+
+    return _cmd_semaphores[loop]
+
+
+async def _read_lines(stream: asyncio.StreamReader, lines: list) -> None:
+    # Drain a pipe as output arrives so that a chatty command cannot block on
+    # a full pipe buffer, and so partial output survives a timeout
+    async for line in stream:
+        lines.append(line.decode(encoding="utf-8"))
+
+
+async def run_cmd_async(
+    cmd: list, cwd: str = None, timeout: float = None
+) -> dict:
+    """Run a bash command in a sub-shell without blocking the event loop.
+    At most the configured number of commands run at once per event loop.
+
+    Args:
+        cmd (list): The bash command to run
+        cwd (str, optional): The directory to run the command in. Defaults to
+                             None, which uses the current working directory.
+        timeout (float, optional): The number of seconds after which the
+                                   command is killed. Defaults to None, which
+                                   uses the configured timeout.
+
+    Returns:
+        dict: The output of the command, including status code and error
+              messages
+    """
+    if timeout is None:
+        timeout = _cmd_config["timeout"]
+
+    async with _get_cmd_semaphore():
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            start_new_session=timeout is not None,
+        )
+
+        output = []
+        err_msg = []
+        timed_out = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    _read_lines(proc.stdout, output),
+                    _read_lines(proc.stderr, err_msg),
+                    proc.wait(),
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            timed_out = True
+
+    result = {
+        "returncode": proc.returncode,
+        "output": "".join(output).strip("\n"),
+        "err_msg": "".join(err_msg).strip("\n"),
+    }
+
+    if timed_out:
+        result["err_msg"] = "\n".join(
+            filter(None, [result["err_msg"], _timeout_msg(cmd, timeout)])
+        )
+
     return result
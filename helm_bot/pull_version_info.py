@@ -1,9 +1,138 @@
+import re
 import yaml
-from .helper_functions import get_request
+import logging
+from urllib.parse import urljoin, urlsplit
+from .helper_functions import _send, get_request
+from .versions import latest_release, parse_version, version_key
+from .cache import (
+    conditional_get,
+    get_cached_index,
+    index_cache_enabled,
+    index_lock,
+    latest_compact_release,
+    load_compact_releases,
+    lookup_parsed_version,
+    store_cached_index,
+    store_parsed_version,
+    update_compact_index,
+    update_http_cache,
+)
+
+logger = logging.getLogger()
+
+# Prefer the libyaml bindings when they are available
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parameters of a `WWW-Authenticate: Bearer realm="...",service="..."` header
+AUTH_PARAM_REGEX = re.compile(r'(\w+)="([^"]*)"')
+
+_resolver = yaml.resolver.Resolver()
+_constructor = yaml.constructor.SafeConstructor()
+
+
+def _construct_scalar(event):
+    """Construct a Python object from a YAML scalar event using the same tag
+    resolution as yaml.safe_load"""
+    tag = event.tag
+    if tag in (None, "!"):
+        tag = _resolver.resolve(yaml.ScalarNode, event.value, event.implicit)
+
+    node = yaml.ScalarNode(tag, event.value, style=event.style)
+    construct = _constructor.yaml_constructors.get(
+        tag, _constructor.yaml_constructors[None]
+    )
+
+    return construct(_constructor, node)
+
+
+def load_entries_from_stream(stream, dependency: str) -> list:
+    """Walk the YAML event stream of a Helm repository index and only
+    materialise the release entries for a single dependency. All other nodes
+    are skipped without being constructed into Python objects.
+
+    Args:
+        stream: A string or file-like object containing the index.yaml file
+        dependency (str): The dependency to extract the entries of
+
+    Returns:
+        list: The release entries under `entries[dependency]`
+    """
+    # Each frame is [is_mapping, expecting_key, current_key]
+    stack = []
+    # Each frame is [container, pending_key]
+    build = None
+
+    for event in yaml.parse(stream, Loader=SafeLoader):
+        if build is not None:
+            if isinstance(event, yaml.CollectionEndEvent):
+                value = build.pop()[0]
+                if not build:
+                    return value
+            elif isinstance(event, yaml.MappingStartEvent):
+                build.append([{}, None])
+                continue
+            elif isinstance(event, yaml.SequenceStartEvent):
+                build.append([[], None])
+                continue
+            elif isinstance(event, yaml.ScalarEvent):
+                value = _construct_scalar(event)
+            else:
+                continue
+
+            frame = build[-1]
+            if isinstance(frame[0], list):
+                frame[0].append(value)
+            elif frame[1] is None:
+                frame[1] = (value,)
+            else:
+                frame[0][frame[1][0]] = value
+                frame[1] = None
+
+            continue
+
+        if isinstance(event, yaml.CollectionEndEvent):
+            stack.pop()
+            continue
+
+        if not isinstance(event, yaml.NodeEvent):
+            continue
+
+        parent = stack[-1] if stack else None
+        is_mapping = isinstance(event, yaml.MappingStartEvent)
+        is_start = isinstance(event, yaml.CollectionStartEvent)
+
+        if (parent is not None) and parent[0] and parent[1]:
+            # This node is a mapping key
+            parent[1] = False
+            parent[2] = (
+                event.value if isinstance(event, yaml.ScalarEvent) else None
+            )
+            if is_start:
+                stack.append([is_mapping, True, None])
+            continue
+
+        if (parent is not None) and parent[0]:
+            parent[1] = True
+
+        path = [frame[2] if frame[0] else None for frame in stack]
+        if path == ["entries", dependency]:
+            if not is_start:
+                return _construct_scalar(event)
+            build = [[{} if is_mapping else [], None]]
+            continue
+
+        if is_start:
+            stack.append([is_mapping, True, None])
+
+    raise KeyError(dependency)
 
 
 def pull_version_from_requirements_file(
-    output_dict: dict, chart_name: str, url: str, token: str
+    output_dict: dict,
+    chart_name: str,
+    url: str,
+    token: str,
+    repositories: dict = None,
 ) -> dict:  # noqa: E501
     """Pull dependency versions requirements.yml file.
 
@@ -11,19 +140,30 @@ def pull_version_from_requirements_file(
         output_dict (dict): The dictionary to store versions in
         chart_name (str): The name of the helm chart
         url (str): The URL of the remotely hosted versions
-        token (str): A GitHub API token
+        token (str): A GitHub API token. Public sources are requested
+                     anonymously if None.
+        repositories (dict, optional): A dictionary to store the `repository`
+                                       of each dependency in.
+                                       Defaults to None.
     """
-    header = {"Authorization": f"token {token}"}
+    header = {} if token is None else {"Authorization": f"token {token}"}
     chart_reqs = yaml.safe_load(get_request(url, headers=header, text=True))
 
     for chart in chart_reqs["dependencies"]:
         output_dict[chart_name][chart["name"]] = chart["version"]
 
+        if repositories is not None:
+            repositories[chart["name"]] = chart.get("repository")
+
     return output_dict
 
 
 def pull_version_from_chart_file(
-    output_dict: dict, dependency: str, url: str, token: str
+    output_dict: dict,
+    dependency: str,
+    url: str,
+    token: str,
+    cache_dir: str = None,
 ) -> dict:  # noqa: E501
     """Pull recent, up-to-date version from remote host stored in a Chart.yml
     file.
@@ -32,32 +172,392 @@ def pull_version_from_chart_file(
         output_dict (dict): The dictionary to store versions in
         dependency (str): The dependency to get a new version for
         url (str): The URL of the remotely hosted versions
-        token (str): A GitHub API token
+        token (str): A GitHub API token. Public sources are requested
+                     anonymously if None.
+        cache_dir (str, optional): Directory of an on-disk cache to revalidate
+                                   the file and look up previously parsed
+                                   content in. Defaults to None.
     """
-    header = {"Authorization": f"token {token}"}
-    chart_reqs = yaml.safe_load(get_request(url, headers=header, text=True))
-    output_dict[dependency] = chart_reqs["version"]
+    header = {} if token is None else {"Authorization": f"token {token}"}
+    resp, entry = conditional_get(url, header, dependency, cache_dir=cache_dir)
+
+    if resp is None:
+        output_dict[dependency] = entry["versions"][dependency]
+        return output_dict
+
+    version = None
+    if cache_dir is not None:
+        version = lookup_parsed_version(cache_dir, resp.content, dependency)
+
+    if version is None:
+        chart_reqs = yaml.safe_load(resp.text)
+        version = chart_reqs["version"]
+
+        if cache_dir is not None:
+            store_parsed_version(cache_dir, resp.content, dependency, version)
+
+    output_dict[dependency] = version
+    update_http_cache(
+        cache_dir, url, resp, entry, dependency, output_dict[dependency]
+    )
 
     return output_dict
 
 
+def load_index_entries(stream) -> dict:
+    """Walk the YAML event stream of a whole Helm repository index, keeping
+    only the `version` and `created` fields of each release entry. All other
+    nodes are skipped without being constructed into Python objects.
+
+    Args:
+        stream: A string or file-like object containing the index.yaml file
+
+    Returns:
+        dict: The release entries of each chart in the index
+    """
+    # Each frame is [is_mapping, expecting_key, current_key]
+    stack = []
+    index = {}
+
+    for event in yaml.parse(stream, Loader=SafeLoader):
+        if isinstance(event, yaml.CollectionEndEvent):
+            stack.pop()
+            continue
+
+        if not isinstance(event, yaml.NodeEvent):
+            continue
+
+        parent = stack[-1] if stack else None
+        is_mapping = isinstance(event, yaml.MappingStartEvent)
+        is_start = isinstance(event, yaml.CollectionStartEvent)
+
+        if (parent is not None) and parent[0] and parent[1]:
+            # This node is a mapping key
+            parent[1] = False
+            parent[2] = (
+                event.value if isinstance(event, yaml.ScalarEvent) else None
+            )
+            if is_start:
+                stack.append([is_mapping, True, None])
+            continue
+
+        if (parent is not None) and parent[0]:
+            parent[1] = True
+
+        path = [frame[2] if frame[0] else None for frame in stack]
+        if (len(path) == 2) and (path[0] == "entries"):
+            # The releases of a chart
+            index[path[1]] = []
+        elif (
+            (len(path) == 3)
+            and (path[0] == "entries")
+            and (path[2] is None)
+            and is_mapping
+        ):
+            # A release entry
+            index[path[1]].append({"version": None, "created": None})
+        elif (
+            (len(path) == 4)
+            and (path[0] == "entries")
+            and (path[2] is None)
+            and (path[3] in ("version", "created"))
+            and isinstance(event, yaml.ScalarEvent)
+        ):
+            index[path[1]][-1][path[3]] = _construct_scalar(event)
+
+        if is_start:
+            stack.append([is_mapping, True, None])
+
+    return index
+
+
 def pull_version_from_github_pages(
-    output_dict: dict, dependency: str, url: str, token: str
+    output_dict: dict,
+    dependency: str,
+    url: str,
+    token: str,
+    stream: bool = False,
+    cache_dir: str = None,
+    latest_by: str = "created",
 ) -> dict:
     """Pull recent, up-to-date version from remote host listed on a GitHub Pages
-    site.
+    site. While the index cache is enabled, the whole index is parsed once
+    and the versions of other dependencies are answered from memory until
+    the cache expires.
 
     Args:
         output_dict (dict): The dictionary to store versions in
         dependency (str): The dependency to get a version for
         url (str): The URL of the remotely hosted versions
-        token (str): A GitHub API token
+        token (str): A GitHub API token. Public sources are requested
+                     anonymously if None.
+        stream (bool, optional): Parse the index as it downloads and only
+                                 materialise the entries for `dependency`.
+                                 Defaults to False.
+        cache_dir (str, optional): Directory of an on-disk cache to revalidate
+                                   the index and look up previously parsed
+                                   content in. The whole index is downloaded
+                                   before parsing so that it can be hashed,
+                                   and its releases are kept in a compact
+                                   index that answers requests for any
+                                   dependency while the index is not
+                                   modified. Defaults to None.
+        latest_by (str, optional): Pick the latest release by its "created"
+                                   timestamp or by semantic "version".
+                                   Defaults to "created".
     """
-    header = {"Authorization": f"token {token}"}
-    chart_reqs = yaml.safe_load(get_request(url, headers=header, text=True))
-    updates_sorted = sorted(
-        chart_reqs["entries"][dependency], key=lambda k: k["created"]
+    if not index_cache_enabled():
+        return _pull_version_from_index(
+            output_dict, dependency, url, token, stream, cache_dir, latest_by
+        )
+
+    # Dependencies from the same index wait for a single download
+    with index_lock(url):
+        index = get_cached_index(url)
+        if index is not None:
+            logger.info("Using parsed index for %s: %s" % (dependency, url))
+            output_dict[dependency] = latest_release(
+                index[dependency], by=latest_by
+            )["version"]
+            return output_dict
+
+        return _pull_version_from_index(
+            output_dict, dependency, url, token, stream, cache_dir, latest_by
+        )
+
+
+def _pull_version_from_index(
+    output_dict: dict,
+    dependency: str,
+    url: str,
+    token: str,
+    stream: bool,
+    cache_dir: str,
+    latest_by: str,
+) -> dict:
+    """Download and parse a Helm repository index for
+    pull_version_from_github_pages"""
+    header = {} if token is None else {"Authorization": f"token {token}"}
+
+    # The on-disk caches store the latest release under the dependency, so
+    # other ways of picking it are stored separately
+    cache_name = dependency
+    if latest_by != "created":
+        cache_name = "%s:%s" % (dependency, latest_by)
+
+    releases = []
+    if cache_dir is not None:
+        releases = load_compact_releases(cache_dir, url, dependency)
+
+    resp, entry = conditional_get(
+        url,
+        header,
+        cache_name,
+        cache_dir=cache_dir,
+        revalidate=bool(releases),
+        stream=stream,
+    )
+
+    if resp is None:
+        if releases:
+            output_dict[dependency] = latest_compact_release(
+                releases, by=latest_by
+            )
+        else:
+            output_dict[dependency] = entry["versions"][cache_name]
+        return output_dict
+
+    content = None
+    version = None
+    if cache_dir is not None:
+        content = resp.content
+        version = lookup_parsed_version(cache_dir, content, cache_name)
+
+    if version is None:
+        if content is not None:
+            # Every chart is extracted so that other dependencies can be
+            # answered from the compact index without parsing
+            index = load_index_entries(content)
+            update_compact_index(cache_dir, url, index)
+            store_cached_index(url, index)
+            entries = index[dependency]
+        elif index_cache_enabled():
+            if stream:
+                resp.raw.decode_content = True
+                try:
+                    index = load_index_entries(resp.raw)
+                finally:
+                    resp.close()
+            else:
+                index = load_index_entries(resp.text)
+
+            store_cached_index(url, index)
+            entries = index[dependency]
+        elif stream:
+            resp.raw.decode_content = True
+            try:
+                entries = load_entries_from_stream(resp.raw, dependency)
+            finally:
+                resp.close()
+        else:
+            chart_reqs = yaml.safe_load(resp.text)
+            entries = chart_reqs["entries"][dependency]
+
+        version = latest_release(entries, by=latest_by)["version"]
+
+        if content is not None:
+            store_parsed_version(cache_dir, content, cache_name, version)
+
+    output_dict[dependency] = version
+    update_http_cache(
+        cache_dir, url, resp, entry, cache_name, output_dict[dependency]
+    )
+
+    return output_dict
+
+
+def pull_version_from_helm_repo(
+    output_dict: dict,
+    dependency: str,
+    url: str,
+    token: str,
+    cache_dir: str = None,
+) -> dict:
+    """Pull recent, up-to-date version from the index of a Helm chart
+    repository, such as the `repository` of a dependency in a requirements
+    file
+
+    Args:
+        output_dict (dict): The dictionary to store versions in
+        dependency (str): The dependency to get a version for
+        url (str): The URL of the Helm chart repository
+        token (str): A GitHub API token. Not sent to the chart repository.
+        cache_dir (str, optional): Directory of an on-disk cache to revalidate
+                                   the index and look up previously parsed
+                                   content in. Defaults to None.
+    """
+    return pull_version_from_github_pages(
+        output_dict,
+        dependency,
+        url.rstrip("/") + "/index.yaml",
+        None,
+        stream=True,
+        cache_dir=cache_dir,
+    )
+
+
+def _get_registry_token(resp) -> str:
+    """Request an anonymous pull token for an OCI registry from the realm in
+    the `WWW-Authenticate` header of an unauthorised response
+
+    Args:
+        resp (requests.Response): The 401 response of the registry
+
+    Returns:
+        str: The bearer token
+    """
+    challenge = resp.headers.get("WWW-Authenticate", "")
+    if not challenge.lower().startswith("bearer "):
+        logger.error(resp.text)
+        raise RuntimeError(resp.text)
+
+    params = dict(AUTH_PARAM_REGEX.findall(challenge))
+    realm = params.pop("realm")
+    token_info = get_request(realm, params=params, json=True)
+
+    return token_info.get("token") or token_info["access_token"]
+
+
+def pull_version_from_oci_registry(
+    output_dict: dict,
+    dependency: str,
+    url: str,
+    token: str,
+    cache_dir: str = None,
+) -> dict:
+    """Pull the highest version of a chart stored in an OCI registry from the
+    tags of its repository
+
+    Args:
+        output_dict (dict): The dictionary to store versions in
+        dependency (str): The dependency to get a version for
+        url (str): The registry and namespace of the chart,
+                   e.g. oci://ghcr.io/owner/charts
+        token (str): A GitHub API token. Not sent to the registry.
+        cache_dir (str, optional): Unused. Tag lists are small and not cached.
+                                   Defaults to None.
+    """
+    parts = urlsplit(url)
+    repository = "/".join(
+        part for part in (parts.path.strip("/"), dependency) if part
+    )
+    tags_url = f"https://{parts.netloc}/v2/{repository}/tags/list"
+
+    headers = {}
+    tags = []
+    while tags_url is not None:
+        resp = _send("GET", tags_url, headers=headers)
+
+        if (resp.status_code == 401) and ("Authorization" not in headers):
+            registry_token = _get_registry_token(resp)
+            headers["Authorization"] = f"Bearer {registry_token}"
+            continue
+
+        if not resp:
+            logger.error(resp.text)
+            raise RuntimeError(resp.text)
+
+        tags.extend(resp.json().get("tags") or [])
+
+        next_link = resp.links.get("next")
+        tags_url = (
+            None if next_link is None else urljoin(tags_url, next_link["url"])
+        )
+
+    # OCI tags cannot contain "+" so Helm replaces it with "_"
+    versions = [tag.replace("_", "+") for tag in tags]
+    versions = [version for version in versions if parse_version(version)]
+    if not versions:
+        raise ValueError("No chart versions tagged in: %s" % url)
+
+    output_dict[dependency] = max(versions, key=version_key)
+
+    return output_dict
+
+
+def pull_version_from_artifacthub(
+    output_dict: dict,
+    dependency: str,
+    url: str,
+    token: str,
+    cache_dir: str = None,
+) -> dict:
+    """Pull the latest version of a chart from the Artifact Hub API
+
+    Args:
+        output_dict (dict): The dictionary to store versions in
+        dependency (str): The dependency to get a version for
+        url (str): The Artifact Hub page or API URL of the package,
+                   e.g. https://artifacthub.io/packages/helm/repo/chart
+        token (str): A GitHub API token. Not sent to Artifact Hub.
+        cache_dir (str, optional): Directory of an on-disk cache to revalidate
+                                   the package in. Defaults to None.
+    """
+    parts = urlsplit(url)
+    path = parts.path
+    if not path.startswith("/api/"):
+        path = "/api/v1" + path
+    api_url = f"{parts.scheme}://{parts.netloc}{path}"
+
+    resp, entry = conditional_get(api_url, {}, dependency, cache_dir=cache_dir)
+
+    if resp is None:
+        output_dict[dependency] = entry["versions"][dependency]
+        return output_dict
+
+    output_dict[dependency] = resp.json()["version"]
+    update_http_cache(
+        cache_dir, api_url, resp, entry, dependency, output_dict[dependency]
     )
-    output_dict[dependency] = updates_sorted[-1]["version"]
 
     return output_dict
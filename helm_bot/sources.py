@@ -0,0 +1,156 @@
+import logging
+from functools import partial
+from urllib.parse import urlsplit
+from .pull_version_info import (
+    pull_version_from_artifacthub,
+    pull_version_from_chart_file,
+    pull_version_from_github_pages,
+    pull_version_from_helm_repo,
+    pull_version_from_oci_registry,
+)
+
+logger = logging.getLogger()
+
+# Backends pulling the latest version of a dependency, keyed by name. Each is
+# called as backend(output_dict, dependency, url, token, cache_dir=None)
+SOURCES = {
+    "artifacthub": pull_version_from_artifacthub,
+    "chart-file": pull_version_from_chart_file,
+    "gh-pages": partial(pull_version_from_github_pages, stream=True),
+    "helm-repo": pull_version_from_helm_repo,
+    "oci": pull_version_from_oci_registry,
+}
+
+# Sources used for dependencies that are not configured otherwise and are
+# listed without a `repository` that a backend can read
+DEFAULT_SOURCES = {
+    "binderhub": {
+        "source": "gh-pages",
+        "url": "https://raw.githubusercontent.com/jupyterhub/helm-chart/gh-pages/index.yaml",
+    },
+    "ingress-nginx": {
+        "source": "chart-file",
+        "url": "https://raw.githubusercontent.com/kubernetes/ingress-nginx/master/charts/ingress-nginx/Chart.yaml",
+    },
+}
+
+# The only hosts a GitHub token is sent to. Other sources are requested
+# without it so that the token cannot leak to third parties.
+GITHUB_HOSTS = ("raw.githubusercontent.com", "api.github.com")
+
+
+def register_source(name: str, backend) -> None:
+    """Register a backend for pulling dependency versions
+
+    Args:
+        name (str): The name to configure the backend by
+        backend (callable): Called as backend(output_dict, dependency, url,
+                            token, cache_dir=None) and returns output_dict
+                            with the latest version of the dependency set
+    """
+    SOURCES[name] = backend
+
+
+def resolve_source(url: str) -> str:
+    """Choose the backend to pull versions from a URL with
+
+    Args:
+        url (str): The URL of the versions, or the `repository` of a
+                   dependency in a requirements file
+
+    Returns:
+        str: The name of the backend, or None if no backend can read the URL
+    """
+    if not url:
+        return None
+
+    parts = urlsplit(url)
+
+    if parts.scheme == "oci":
+        return "oci"
+    elif parts.scheme not in ("http", "https"):
+        return None
+    elif parts.netloc == "artifacthub.io":
+        return "artifacthub"
+    elif parts.path.endswith("Chart.yaml"):
+        return "chart-file"
+    elif parts.path.endswith("index.yaml"):
+        return "gh-pages"
+
+    return "helm-repo"
+
+
+def _source_config(dependency: str, config: dict) -> dict:
+    """Fill in the backend of a configured dependency source
+
+    Args:
+        dependency (str): The name of the dependency
+        config (dict): The `url` and optionally the `source` backend
+
+    Returns:
+        dict: The {"source": ..., "url": ...} of the dependency
+    """
+    source = config.get("source") or resolve_source(config["url"])
+    if source not in SOURCES:
+        msg = "Unknown source for %s: %s" % (dependency, source)
+        logger.error(msg)
+        raise ValueError(msg)
+
+    return {"source": source, "url": config["url"]}
+
+
+def get_sources(sources: dict = None, defaults: bool = True) -> dict:
+    """Merge configured dependency sources with the defaults
+
+    Args:
+        sources (dict, optional): The `url` and optionally the `source`
+                                  backend of dependencies, keyed by
+                                  dependency. A null value removes a default.
+                                  Defaults to None.
+        defaults (bool, optional): Include DEFAULT_SOURCES. Defaults to True.
+
+    Returns:
+        dict: The {"source": ..., "url": ...} of each configured dependency
+    """
+    merged = {}
+    for dependency, config in {
+        **(DEFAULT_SOURCES if defaults else {}),
+        **(sources or {}),
+    }.items():
+        if config is None:
+            continue
+
+        merged[dependency] = _source_config(dependency, config)
+
+    return merged
+
+
+def choose_source(
+    dependency: str, repository: str, sources: dict = None
+) -> dict:
+    """Choose where to pull the versions of a dependency listed in a
+    requirements file from. A source configured in the manifest wins, then
+    the `repository` the dependency is listed with, then DEFAULT_SOURCES.
+
+    Args:
+        dependency (str): The name of the dependency
+        repository (str): The `repository` the dependency is listed with
+        sources (dict, optional): Configured sources, as passed to
+                                  get_sources. Defaults to None.
+
+    Returns:
+        dict: The {"source": ..., "url": ...} of the dependency, or None if
+              there is nowhere to pull its versions from
+    """
+    sources = sources or {}
+    if sources.get(dependency) is not None:
+        return _source_config(dependency, sources[dependency])
+
+    source = resolve_source(repository)
+    if source is not None:
+        return {"source": source, "url": repository}
+
+    if (dependency in sources) or (dependency not in DEFAULT_SOURCES):
+        return None
+
+    return _source_config(dependency, DEFAULT_SOURCES[dependency])
@@ -0,0 +1,231 @@
+import re
+import logging
+from functools import lru_cache
+from collections import namedtuple
+from datetime import datetime, timezone, timedelta
+
+# Helm writes timestamps with nanosecond precision, e.g.
+# 2020-07-26T15:33:00.123456789Z, which datetime.fromisoformat cannot parse
+CREATED_REGEX = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})[Tt ](\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?"
+    r"\s*(?:(Z|z)|([+-])(\d{2}):?(\d{2}))?$"
+)
+
+SEMVER_REGEX = re.compile(
+    r"^v?(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)"
+    r"(?:-([0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*))?"
+    r"(?:\+([0-9A-Za-z-]+(?:\.[0-9A-Za-z-]+)*))?$"
+)
+
+NATURAL_REGEX = re.compile(r"(\d+)")
+
+logger = logging.getLogger()
+
+# Policies deciding which newer versions count as an upgrade
+UPGRADE_POLICIES = ("prerelease", "stable", "minor", "patch")
+
+Version = namedtuple(
+    "Version", ["major", "minor", "patch", "prerelease", "build", "key"]
+)
+
+
+def parse_created(created) -> datetime:
+    """Parse the `created` timestamp of a Helm repository index entry
+
+    Args:
+        created (str or datetime): The timestamp. Naive datetimes are assumed
+                                   to be in UTC.
+
+    Returns:
+        datetime: A timezone-aware datetime
+    """
+    if isinstance(created, datetime):
+        if created.tzinfo is None:
+            return created.replace(tzinfo=timezone.utc)
+        return created
+
+    match = CREATED_REGEX.match(str(created).strip())
+    if match is None:
+        raise ValueError("Invalid created timestamp: %s" % created)
+
+    year, month, day, hour, minute, second = map(int, match.groups()[:6])
+    fraction = match.group(7) or "0"
+    microsecond = int(fraction[:6].ljust(6, "0"))
+
+    tzinfo = timezone.utc
+    if match.group(9) is not None:
+        offset = timedelta(
+            hours=int(match.group(10)), minutes=int(match.group(11))
+        )
+        tzinfo = timezone(-offset if match.group(9) == "-" else offset)
+
+    return datetime(
+        year, month, day, hour, minute, second, microsecond, tzinfo=tzinfo
+    )
+
+
+def _identifier_key(identifier: str) -> tuple:
+    """Build a sort key for a single pre-release identifier. Numeric
+    identifiers sort before alphanumeric ones as in the semver spec, and runs
+    of digits inside alphanumeric identifiers are compared numerically so that
+    chartpress versions such as 0.2.0-n99.h1 < 0.2.0-n100.h2."""
+    if identifier.isdigit():
+        return (0, int(identifier))
+
+    return (
+        1,
+        tuple(
+            (0, int(part), "") if part.isdigit() else (1, 0, part)
+            for part in NATURAL_REGEX.split(identifier)
+            if part
+        ),
+    )
+
+
+@lru_cache(maxsize=4096)
+def _parse_version(version: str):
+    match = SEMVER_REGEX.match(version.strip())
+    if match is None:
+        return None
+
+    major, minor, patch, prerelease, build = match.groups()
+
+    if prerelease is None:
+        prerelease_key = (1,)
+    else:
+        prerelease_key = (
+            0,
+            tuple(_identifier_key(part) for part in prerelease.split(".")),
+        )
+
+    key = (1, int(major), int(minor), int(patch), prerelease_key)
+
+    return Version(int(major), int(minor), int(patch), prerelease, build, key)
+
+
+def parse_version(version):
+    """Parse a semantic version. Results are cached so that each distinct
+    version string is only parsed once.
+
+    Args:
+        version (str): The version to parse
+
+    Returns:
+        Version: The parsed version, or None if it is not a semantic version
+    """
+    return _parse_version(str(version))
+
+
+def version_key(version) -> tuple:
+    """Build a sort key for a semantic version. Releases sort after their
+    pre-releases and build metadata is ignored. Strings that are not semantic
+    versions sort before all valid versions.
+
+    Args:
+        version (str): The version to build a key for
+
+    Returns:
+        tuple: The sort key
+    """
+    parsed = parse_version(version)
+    if parsed is None:
+        return (0,)
+
+    return parsed.key
+
+
+def is_upgrade(current, candidate, policy: str = "prerelease") -> bool:
+    """Decide whether moving from one version to another is an upgrade that
+    should be made
+
+    Policies:
+        prerelease: Any newer version, including pre-releases
+        stable: Any newer version that is not a pre-release
+        minor: A newer stable version with the same major version
+        patch: A newer stable version with the same major and minor versions
+
+    Downgrades and versions that only differ in build metadata are never
+    upgrades. If either version is not a semantic version, any difference is
+    treated as an upgrade.
+
+    Args:
+        current (str): The version currently in use
+        candidate (str): The version available upstream
+        policy (str, optional): The upgrade policy. Defaults to "prerelease".
+
+    Returns:
+        bool: True if the candidate version should be upgraded to
+    """
+    if policy not in UPGRADE_POLICIES:
+        raise ValueError(
+            "policy must be one of %s: %s" % (UPGRADE_POLICIES, policy)
+        )
+
+    current_version = parse_version(current)
+    candidate_version = parse_version(candidate)
+
+    if (current_version is None) or (candidate_version is None):
+        return str(current) != str(candidate)
+
+    if candidate_version.key <= current_version.key:
+        return False
+
+    if policy == "prerelease":
+        return True
+
+    if candidate_version.prerelease is not None:
+        return False
+
+    if policy == "minor":
+        return candidate_version.major == current_version.major
+    elif policy == "patch":
+        return (candidate_version.major, candidate_version.minor) == (
+            current_version.major,
+            current_version.minor,
+        )
+
+    return True
+
+
+def latest_release(entries: list, by: str = "created") -> dict:
+    """Select the latest release from the entries of a Helm repository index
+    in a single pass, without building a sorted copy
+
+    Entries whose `created` timestamp cannot be parsed are skipped with a
+    warning when selecting by "created".
+
+    Args:
+        entries (list): The release entries of a chart
+        by (str, optional): Select by the "created" timestamp or by semantic
+                            "version". Defaults to "created".
+
+    Returns:
+        dict: The latest release entry. Ties go to the entry listed last.
+    """
+    if by == "created":
+        key = lambda entry: parse_created(entry["created"])  # noqa: E731
+    elif by == "version":
+        key = lambda entry: version_key(entry["version"])  # noqa: E731
+    else:
+        raise ValueError("by must be one of 'created' or 'version': %s" % by)
+
+    latest = None
+    latest_key = None
+
+    for entry in entries:
+        try:
+            entry_key = key(entry)
+        except (KeyError, ValueError) as err:
+            logger.warning(
+                "Skipping release entry %s: %s" % (entry.get("version"), err)
+            )
+            continue
+
+        if (latest is None) or (entry_key >= latest_key):
+            latest = entry
+            latest_key = entry_key
+
+    if latest is None:
+        raise ValueError("No release entries to select from")
+
+    return latest
@@ -0,0 +1,341 @@
+import hmac
+import json
+import time
+import queue
+import hashlib
+import logging
+import threading
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .batch import run_batch
+from .cache import clear_index_cache
+from .helper_functions import get_session, reset_retry_budget
+from .sources import get_sources
+
+logger = logging.getLogger()
+
+# The release actions that trigger a check of the released dependency
+RELEASE_ACTIONS = ("published", "released")
+
+# raw.githubusercontent.com serves files cached for up to five minutes, so a
+# check that starts as a push arrives may still see the old index. Each
+# triggered dependency is checked again after this many seconds.
+RECHECK_DELAY = 300
+
+
+def webhook_sources(repos: list = None) -> dict:
+    """Map the upstream GitHub repositories publishing the chart dependencies
+    to the branch each dependency is published on. Only dependencies with a
+    source on raw.githubusercontent.com are included, as those pulled from
+    the `repository` in a requirements file are not known until it is read.
+
+    Args:
+        repos (list, optional): Settings for each repository, as from
+                                load_manifest, whose `sources` are merged
+                                with the defaults. Defaults to None, which
+                                uses DEFAULT_SOURCES.
+
+    Returns:
+        dict: The {dependency: branch} of each "owner/name" repository
+    """
+    sources = {}
+    for repo in repos or [{}]:
+        for dependency, config in get_sources(repo.get("sources")).items():
+            parts = urlsplit(config["url"])
+            if parts.netloc != "raw.githubusercontent.com":
+                continue
+
+            owner, name, branch = parts.path.strip("/").split("/")[:3]
+            sources.setdefault(f"{owner}/{name}", {})[dependency] = branch
+
+    return sources
+
+
+def sign_payload(body: bytes, secret: str) -> str:
+    """Sign a webhook payload as GitHub does in the X-Hub-Signature-256 header
+
+    Args:
+        body (bytes): The raw payload
+        secret (str): The webhook secret
+
+    Returns:
+        str: The signature
+    """
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256)
+    return "sha256=" + digest.hexdigest()
+
+
+def verify_signature(body: bytes, signature: str, secret: str) -> bool:
+    """Verify the X-Hub-Signature-256 header of a webhook delivery
+
+    Args:
+        body (bytes): The raw payload
+        signature (str): The value of the X-Hub-Signature-256 header
+        secret (str): The webhook secret
+
+    Returns:
+        bool: True if the payload was signed with the secret
+    """
+    if not signature:
+        return False
+
+    return hmac.compare_digest(sign_payload(body, secret), signature)
+
+
+def affected_dependencies(
+    event: str, payload: dict, sources: dict = None
+) -> list:
+    """Find the chart dependencies a webhook event may have released a new
+    version of. Pushes count when they are to the branch a dependency is
+    published on, and releases when they are published.
+
+    Args:
+        event (str): The value of the X-GitHub-Event header
+        payload (dict): The parsed payload
+        sources (dict, optional): The upstream repositories, as from
+                                  webhook_sources. Defaults to None, which
+                                  uses those of DEFAULT_SOURCES.
+
+    Returns:
+        list: The affected dependencies
+    """
+    if sources is None:
+        sources = webhook_sources()
+
+    repo = (payload.get("repository") or {}).get("full_name", "")
+    branches = sources.get(repo, {})
+
+    if event == "push":
+        return [
+            dependency
+            for (dependency, branch) in branches.items()
+            if payload.get("ref") == f"refs/heads/{branch}"
+        ]
+    elif event == "release":
+        if payload.get("action") in RELEASE_ACTIONS:
+            return list(branches.keys())
+
+    return []
+
+
+def make_handler(
+    secret: str, trigger_queue: queue.Queue, sources: dict = None
+):
+    """Build a request handler that verifies webhook deliveries and queues
+    the affected dependencies for checking
+
+    Args:
+        secret (str): The webhook secret
+        trigger_queue (queue.Queue): The queue to put lists of affected
+                                     dependencies on
+        sources (dict, optional): The upstream repositories, as from
+                                  webhook_sources. Defaults to None, which
+                                  uses those of DEFAULT_SOURCES.
+
+    Returns:
+        type: A BaseHTTPRequestHandler subclass
+    """
+    if sources is None:
+        sources = webhook_sources()
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            delivery = self.headers.get("X-GitHub-Delivery")
+
+            if not verify_signature(
+                body, self.headers.get("X-Hub-Signature-256"), secret
+            ):
+                logger.error("Invalid signature on delivery: %s" % delivery)
+                self.send_response(401)
+                self.end_headers()
+                return
+
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                logger.error("Invalid payload in delivery: %s" % delivery)
+                self.send_response(400)
+                self.end_headers()
+                return
+
+            dependencies = affected_dependencies(
+                self.headers.get("X-GitHub-Event"), payload, sources
+            )
+            if dependencies:
+                logger.info(
+                    "Delivery %s triggers a check of: %s"
+                    % (delivery, dependencies)
+                )
+                trigger_queue.put(dependencies)
+                self.send_response(202)
+            else:
+                self.send_response(204)
+
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logger.debug("Webhook: " + format % args)
+
+    return WebhookHandler
+
+
+def _check_dependencies(repos: list, dependencies: list, **kwargs) -> None:
+    """Check repositories for upgrades of some dependencies with fresh
+    upstream versions
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        dependencies (list): The dependencies to check
+        **kwargs: Passed on to run_batch
+    """
+    # The webhook announces a change, so cached indexes are stale
+    clear_index_cache()
+    reset_retry_budget()
+
+    try:
+        run_batch(
+            repos,
+            dependencies=dependencies,
+            version_cache={},
+            **kwargs,
+        )
+    except Exception as err:
+        logger.error("Check of %s failed: %s" % (dependencies, err))
+
+
+def process_triggers(
+    repos: list,
+    trigger_queue: queue.Queue,
+    stop_event: threading.Event,
+    recheck_delay: float = RECHECK_DELAY,
+    **kwargs,
+) -> None:
+    """Check repositories for upgrades of the dependencies put on a queue
+    until stop_event is set. Triggers that arrive while a check is running
+    are combined into the next check, and every triggered dependency is
+    checked again once upstream caches have expired.
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        trigger_queue (queue.Queue): A queue of lists of dependencies
+        stop_event (threading.Event): Set to stop processing
+        recheck_delay (float, optional): Seconds after a triggered check to
+                                         check the dependencies again. 0
+                                         disables the recheck.
+                                         Defaults to RECHECK_DELAY.
+        **kwargs: Passed on to run_batch for every check
+    """
+    # The time.monotonic() each dependency is due to be checked again
+    rechecks = {}
+
+    while not stop_event.is_set():
+        now = time.monotonic()
+        due = sorted(dep for (dep, at) in rechecks.items() if at <= now)
+        if due:
+            for dep in due:
+                del rechecks[dep]
+
+            logger.info("Checking %s again" % due)
+            _check_dependencies(repos, due, **kwargs)
+            continue
+
+        timeout = min([1] + [at - now for at in rechecks.values()])
+        try:
+            dependencies = set(trigger_queue.get(timeout=timeout))
+        except queue.Empty:
+            continue
+
+        while True:
+            try:
+                dependencies.update(trigger_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        _check_dependencies(repos, sorted(dependencies), **kwargs)
+
+        if recheck_delay > 0:
+            at = time.monotonic() + recheck_delay
+            rechecks.update((dep, at) for dep in dependencies)
+
+
+def serve_webhooks(
+    repos: list,
+    secret: str,
+    host: str = "",
+    port: int = 8080,
+    stop_event: threading.Event = None,
+    recheck_delay: float = RECHECK_DELAY,
+    **kwargs,
+) -> None:
+    """Listen for GitHub webhooks from the upstream chart repositories and
+    check repositories for upgrades of only the affected dependency
+
+    Args:
+        repos (list): Settings for each repository, as from load_manifest
+        secret (str): The webhook secret
+        host (str, optional): The address to listen on. Defaults to "", all
+                              interfaces.
+        port (int, optional): The port to listen on. Defaults to 8080.
+        stop_event (threading.Event, optional): Set to stop the listener.
+                                                Defaults to None.
+        recheck_delay (float, optional): Seconds after a triggered check to
+                                         check the dependencies again.
+                                         Defaults to RECHECK_DELAY.
+        **kwargs: Passed on to run_batch for every check
+    """
+    if not secret:
+        raise ValueError("A webhook secret must be provided")
+
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    trigger_queue = queue.Queue()
+    server = ThreadingHTTPServer(
+        (host, port),
+        make_handler(secret, trigger_queue, webhook_sources(repos)),
+    )
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    logger.info("Listening for webhooks on port %d" % server.server_port)
+
+    try:
+        process_triggers(
+            repos,
+            trigger_queue,
+            stop_event,
+            recheck_delay=recheck_delay,
+            **kwargs,
+        )
+    finally:
+        server.shutdown()
+        server.server_close()
+        logger.info("Stopped listening for webhooks")
+
+
+def replay_webhook(url: str, event: str, body: bytes, secret: str):
+    """Send a signed webhook delivery to a listener, such as one saved from
+    the "Recent Deliveries" of a GitHub webhook
+
+    Args:
+        url (str): The URL of the listener
+        event (str): The event type, e.g. "push" or "release"
+        body (bytes): The raw payload
+        secret (str): The webhook secret
+
+    Returns:
+        requests.Response: The response of the listener
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "X-GitHub-Event": event,
+        "X-GitHub-Delivery": "replay",
+        "X-Hub-Signature-256": sign_payload(body, secret),
+    }
+
+    resp = get_session().post(url, data=body, headers=headers)
+    logger.info("Replayed %s event: %s" % (event, resp.status_code))
+
+    return resp
@@ -66,7 +66,14 @@ setup(
     include_package_data=True,
     license=LICENSE,
     ext_modules=[],
-    entry_points={"console_scripts": ["helm-bot = helm_bot.cli:main"]},
+    entry_points={
+        "console_scripts": [
+            "helm-bot = helm_bot.cli:main",
+            "helm-bot-batch = helm_bot.cli:batch_main",
+            "helm-bot-webhook = helm_bot.cli:webhook_main",
+            "helm-bot-replay-webhook = helm_bot.cli:replay_main",
+        ]
+    },
     classifiers=[
         # Trove classifiers
         # Full list: https://pypi.python.org/pypi?%3Aaction=list_classifiers
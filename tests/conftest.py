@@ -0,0 +1,19 @@
+import pytest
+from helm_bot.cache import configure_index_cache
+from helm_bot.helper_functions import configure_retries
+
+
+@pytest.fixture(autouse=True)
+def no_retries():
+    # Failures are only retried in tests that configure retries themselves
+    configure_retries(max_retries=0)
+    yield
+    configure_retries()
+
+
+@pytest.fixture(autouse=True)
+def no_index_cache():
+    # Indexes are only cached in tests that configure the cache themselves
+    configure_index_cache(ttl=0)
+    yield
+    configure_index_cache()
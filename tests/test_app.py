@@ -1,8 +1,23 @@
+import os
+import json
+import yaml
+import asyncio
+import base64
 import pytest
 import logging
-from unittest.mock import patch
+import threading
+import responses
+from unittest.mock import MagicMock, patch
 from testfixtures import log_capture
-from helm_bot.app import check_versions
+from helm_bot.app import (
+    check_versions,
+    clean_up,
+    get_chart_versions,
+    get_chart_versions_and_token,
+    pull_chart_version,
+    upgrade_chart,
+    upgrade_chart_via_api,
+)
 
 
 @log_capture()
@@ -33,7 +48,7 @@ def test_check_versions_no_match(capture):
     chart_info = {
         chart_name: {"chart1": "1.2.3", "chart2": "4.5.6"},
         "chart1": "7.8.9",
-        "chart2": "1.10.9",
+        "chart2": "4.10.9",
     }
     expected_charts = ["chart1", "chart2"]
 
@@ -55,7 +70,7 @@ def test_check_versions_no_match_dry_run(capture):
     chart_info = {
         chart_name: {"chart1": "1.2.3", "chart2": "4.5.6"},
         "chart1": "7.8.9",
-        "chart2": "1.10.9",
+        "chart2": "4.10.9",
     }
     expected_charts = ["chart1", "chart2"]
 
@@ -70,3 +85,497 @@ def test_check_versions_no_match_dry_run(capture):
     assert charts_out == expected_charts
 
     capture.check_present()
+
+
+def test_check_versions_downgrade():
+    chart_name = "test_chart"
+    chart_info = {
+        chart_name: {"chart1": "1.2.3", "chart2": "4.5.6+build.1"},
+        "chart1": "1.2.2",
+        "chart2": "4.5.6+build.2",
+    }
+
+    charts_out = check_versions(chart_name, chart_info)
+
+    assert charts_out == []
+
+
+def test_check_versions_policy():
+    chart_name = "test_chart"
+    chart_info = {
+        chart_name: {"chart1": "1.2.3", "chart2": "4.5.6", "chart3": "0.1.0"},
+        "chart1": "1.3.0-n10.h1234",
+        "chart2": "5.0.0",
+        "chart3": "0.1.1",
+    }
+
+    assert check_versions(chart_name, chart_info) == [
+        "chart1",
+        "chart2",
+        "chart3",
+    ]
+    assert check_versions(chart_name, chart_info, policy="stable") == [
+        "chart2",
+        "chart3",
+    ]
+    assert check_versions(chart_name, chart_info, policy="minor") == ["chart3"]
+    assert check_versions(chart_name, chart_info, policy="patch") == ["chart3"]
+
+    with pytest.raises(ValueError):
+        check_versions(chart_name, chart_info, policy="major")
+
+
+def test_get_chart_versions_concurrent():
+    chart_name = "test_chart"
+    token = "this_is_a_token"
+
+    # Every source must be in flight at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+
+    def mock_requirements(chart_info, chart, url, token, **kwargs):
+        chart_info[chart] = {"binderhub": "1.2.3", "ingress-nginx": "4.5.6"}
+        return chart_info
+
+    def mock_pull(chart_info, chart, url, token, **kwargs):
+        barrier.wait()
+        chart_info[chart] = "7.8.9"
+        return chart_info
+
+    mock_reqs = patch(
+        "helm_bot.app.pull_version_from_requirements_file",
+        side_effect=mock_requirements,
+    )
+    mock2 = MagicMock(side_effect=mock_pull)
+    mock3 = MagicMock(side_effect=mock_pull)
+    mock_sources = patch.dict(
+        "helm_bot.app.SOURCES", {"chart-file": mock2, "gh-pages": mock3}
+    )
+
+    with mock_reqs as mock1, mock_sources:
+        chart_info = get_chart_versions(
+            chart_name, "test_owner", "test_repo", token, concurrent=True
+        )
+
+        assert mock1.call_count == 1
+        assert mock2.call_count == 1
+        assert mock3.call_count == 1
+
+    assert list(chart_info.keys()) == [
+        chart_name,
+        "binderhub",
+        "ingress-nginx",
+    ]
+    assert chart_info == {
+        chart_name: {"binderhub": "1.2.3", "ingress-nginx": "4.5.6"},
+        "binderhub": "7.8.9",
+        "ingress-nginx": "7.8.9",
+    }
+
+
+def test_get_chart_versions_and_token():
+    token_requested = threading.Event()
+    url = "https://raw.githubusercontent.com/owner/charts/gh-pages/index.yaml"
+
+    async def mock_token_side_effect(token_name, keyvault, identity=False):
+        token_requested.set()
+        await asyncio.sleep(0.1)
+        return "token"
+
+    def mock_source_side_effect(info, chart, url, token, **kwargs):
+        # The configured source starts without waiting for the token
+        assert token is None
+        assert token_requested.wait(timeout=5)
+        info[chart] = "7.8.9"
+        return info
+
+    def mock_reqs_side_effect(info, chart_name, url, token, **kwargs):
+        # The requirements file may be private so waits for the token
+        assert token == "token"
+        info[chart_name] = {"binderhub": "1.2.3"}
+        return info
+
+    mock_token = patch(
+        "helm_bot.app.get_token_async", side_effect=mock_token_side_effect
+    )
+    mock_reqs = patch(
+        "helm_bot.app.pull_version_from_requirements_file",
+        side_effect=mock_reqs_side_effect,
+    )
+    mock_source = MagicMock(side_effect=mock_source_side_effect)
+    mock_sources = patch.dict(
+        "helm_bot.app.SOURCES", {"gh-pages": mock_source}
+    )
+
+    with mock_token as mock1, mock_reqs as mock2, mock_sources:
+        chart_info, token = asyncio.run(
+            get_chart_versions_and_token(
+                "chart",
+                "owner",
+                "repo",
+                "name",
+                "vault",
+                sources={"binderhub": {"url": url}},
+            )
+        )
+
+        assert mock1.call_count == 1
+        assert mock2.call_count == 1
+        # The source is only pulled once
+        assert mock_source.call_count == 1
+
+    assert chart_info == {
+        "chart": {"binderhub": "1.2.3"},
+        "binderhub": "7.8.9",
+    }
+    assert token == "token"
+
+
+def test_get_chart_versions_cache_dir():
+    mock_reqs = patch(
+        "helm_bot.app.pull_version_from_requirements_file",
+        side_effect=lambda info, chart, *a, **k: {
+            chart: {"binderhub": "0.1.0", "ingress-nginx": "0.1.0"}
+        },
+    )
+    mock_pull = patch(
+        "helm_bot.app.pull_chart_version",
+        side_effect=lambda info, chart, *a, **k: {**info, chart: "1.2.3"},
+    )
+
+    with mock_reqs, mock_pull as mock1:
+        get_chart_versions(
+            "test_chart", "test_owner", "test_repo", "token", cache_dir="cache"
+        )
+
+        assert mock1.call_count == 2
+        for mock_call in mock1.call_args_list:
+            assert mock_call.kwargs["cache_dir"] == "cache"
+
+
+def test_pull_chart_version_version_cache():
+    chart_url = "https://example.com/gh-pages/index.yaml"
+    version_cache = {}
+
+    def mock_pull(chart_info, chart, url, token, **kwargs):
+        chart_info[chart] = "1.2.3"
+        return chart_info
+
+    mock1 = MagicMock(side_effect=mock_pull)
+
+    with patch.dict("helm_bot.app.SOURCES", {"gh-pages": mock1}):
+        info1 = pull_chart_version(
+            {}, "chart", chart_url, "token", version_cache=version_cache
+        )
+        info2 = pull_chart_version(
+            {}, "chart", chart_url, "token", version_cache=version_cache
+        )
+
+        assert mock1.call_count == 1
+
+    assert info1 == info2 == {"chart": "1.2.3"}
+    assert version_cache == {("chart", chart_url): "1.2.3"}
+
+
+def test_clean_up(tmpdir):
+    tmpdir.mkdir("test_repo").join("file.txt").write("content")
+
+    clean_up("test_repo", workdir=str(tmpdir))
+
+    assert not tmpdir.join("test_repo").exists()
+
+
+def test_upgrade_chart(tmpdir):
+    chart_name = "test_chart"
+    repo_name = "test_repo"
+    workdir = str(tmpdir)
+    repo_dir = os.path.join(workdir, repo_name)
+    filename = os.path.join(repo_dir, chart_name, "requirements.yaml")
+    chart_info = {chart_name: {"chart1": "1.2.3"}, "chart1": "1.2.4"}
+    cwd = os.getcwd()
+
+    def mock_clone_side_effect(repo_name, workdir=None):
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, "w") as stream:
+            stream.write("dependencies:\n- name: chart1\n  version: 1.2.3\n")
+
+    mock_clone = patch(
+        "helm_bot.app.clone_fork", side_effect=mock_clone_side_effect
+    )
+    mock_checkout = patch("helm_bot.app.checkout_branch")
+    mock_push = patch("helm_bot.app.add_commit_push")
+    mock_pr = patch("helm_bot.app.create_pr")
+
+    with mock_clone as mock1, mock_checkout as mock2, mock_push as mock3, (
+        mock_pr
+    ):
+        upgrade_chart(
+            chart_name,
+            chart_info,
+            ["chart1"],
+            "test_owner",
+            repo_name,
+            "repo_api",
+            "main",
+            "test_branch",
+            "token",
+            None,
+            False,
+            workdir=workdir,
+        )
+
+        mock1.assert_called_with(repo_name, workdir=workdir)
+        assert mock2.call_args.kwargs["cwd"] == repo_dir
+        assert mock3.call_args.args[0] == filename
+        assert mock3.call_args.kwargs["cwd"] == repo_dir
+
+    assert os.getcwd() == cwd
+    with open(filename) as stream:
+        assert yaml.safe_load(stream) == {
+            "dependencies": [{"name": "chart1", "version": "1.2.4"}]
+        }
+
+
+@responses.activate
+def test_upgrade_chart_via_api():
+    chart_name = "test_chart"
+    repo_name = "test_repo"
+    repo_api = f"https://api.github.com/repos/test_owner/{repo_name}/"
+    fork_api = f"https://api.github.com/repos/HelmUpgradeBot/{repo_name}/"
+    target_branch = "test_branch"
+    token = "this_is_a_token"
+    chart_info = {chart_name: {"chart1": "1.2.3"}, "chart1": "1.2.4"}
+    requirements = "dependencies:\n- name: chart1\n  version: 1.2.3\n"
+
+    responses.add(
+        responses.POST, fork_api + "merge-upstream", json={}, status=200
+    )
+    responses.add(
+        responses.GET,
+        repo_api + "git/ref/heads/main",
+        json={"object": {"sha": "base_sha"}},
+    )
+    responses.add(
+        responses.GET,
+        fork_api + f"contents/{chart_name}/requirements.yaml?ref=base_sha",
+        json={"content": base64.b64encode(requirements.encode()).decode()},
+    )
+    responses.add(
+        responses.POST, fork_api + "git/blobs", json={"sha": "blob_sha"}
+    )
+    responses.add(
+        responses.GET,
+        fork_api + "git/commits/base_sha",
+        json={"tree": {"sha": "base_tree_sha"}},
+    )
+    responses.add(
+        responses.POST, fork_api + "git/trees", json={"sha": "tree_sha"}
+    )
+    responses.add(
+        responses.POST, fork_api + "git/commits", json={"sha": "commit_sha"}
+    )
+    responses.add(
+        responses.GET, fork_api + "branches", json=[{"name": "main"}]
+    )
+    responses.add(responses.POST, fork_api + "git/refs", json={})
+    responses.add(
+        responses.POST, repo_api + "pulls", json={"issue_url": "url"}
+    )
+
+    upgrade_chart_via_api(
+        chart_name,
+        chart_info,
+        ["chart1"],
+        repo_name,
+        repo_api,
+        "main",
+        target_branch,
+        token,
+        None,
+        False,
+    )
+
+    bodies = {
+        call.request.url: call.request.body
+        for call in responses.calls
+        if call.request.method == "POST"
+    }
+    blob = json.loads(bodies[fork_api + "git/blobs"])
+    tree = json.loads(bodies[fork_api + "git/trees"])
+    commit = json.loads(bodies[fork_api + "git/commits"])
+    ref = json.loads(bodies[fork_api + "git/refs"])
+
+    assert yaml.safe_load(blob["content"]) == {
+        "dependencies": [{"name": "chart1", "version": "1.2.4"}]
+    }
+    assert tree["base_tree"] == "base_tree_sha"
+    assert tree["tree"][0]["path"] == f"{chart_name}/requirements.yaml"
+    assert tree["tree"][0]["sha"] == "blob_sha"
+    assert commit["parents"] == ["base_sha"]
+    assert commit["tree"] == "tree_sha"
+    assert ref == {"ref": f"refs/heads/{target_branch}", "sha": "commit_sha"}
+    assert len(responses.calls) == 10
+
+
+def test_get_chart_versions_dependencies():
+    mock_reqs = patch(
+        "helm_bot.app.pull_version_from_requirements_file",
+        side_effect=lambda info, chart, *a, **k: {
+            chart: {"binderhub": "0.1.0", "ingress-nginx": "0.1.0"}
+        },
+    )
+    mock_pull = patch(
+        "helm_bot.app.pull_chart_version",
+        side_effect=lambda info, chart, *a, **k: {**info, chart: "1.2.3"},
+    )
+
+    with mock_reqs, mock_pull as mock1:
+        get_chart_versions(
+            "test_chart",
+            "test_owner",
+            "test_repo",
+            "token",
+            dependencies=["ingress-nginx"],
+        )
+
+        assert [call.args[1] for call in mock1.call_args_list] == [
+            "ingress-nginx"
+        ]
+
+    # A dependency the chart does not list is nothing to check
+    with mock_reqs, mock_pull as mock1:
+        chart_info = get_chart_versions(
+            "test_chart",
+            "test_owner",
+            "test_repo",
+            "token",
+            dependencies=["jupyterhub"],
+        )
+
+        assert mock1.call_count == 0
+
+    assert check_versions("test_chart", chart_info) == []
+
+
+def test_get_chart_versions_sources():
+    def mock_requirements(chart_info, chart, url, token, repositories):
+        chart_info[chart] = {
+            "binderhub": "0.1.0",
+            "cert-manager": "1.0.0",
+            "local": "0.1.0",
+        }
+        repositories.update(
+            {
+                "binderhub": "https://jupyterhub.github.io/helm-chart",
+                "cert-manager": "https://charts.jetstack.io",
+                "local": "file://../local",
+            }
+        )
+        return chart_info
+
+    def mock_pull(chart_info, chart, url, token, **kwargs):
+        chart_info[chart] = url
+        return chart_info
+
+    mock1 = MagicMock(side_effect=mock_pull)
+    mock2 = MagicMock(side_effect=mock_pull)
+    mock_reqs = patch(
+        "helm_bot.app.pull_version_from_requirements_file",
+        side_effect=mock_requirements,
+    )
+    mock_sources = patch.dict(
+        "helm_bot.app.SOURCES", {"artifacthub": mock1, "helm-repo": mock2}
+    )
+
+    with mock_reqs, mock_sources:
+        chart_info = get_chart_versions(
+            "test_chart",
+            "test_owner",
+            "test_repo",
+            "token",
+            sources={
+                "binderhub": {
+                    "url": "https://artifacthub.io/packages/helm/jupyterhub/binderhub"
+                },
+                "ingress-nginx": None,
+            },
+        )
+
+    assert chart_info == {
+        "test_chart": {
+            "binderhub": "0.1.0",
+            "cert-manager": "1.0.0",
+            "local": "0.1.0",
+        },
+        "binderhub": "https://artifacthub.io/packages/helm/jupyterhub/binderhub",
+        "cert-manager": "https://charts.jetstack.io",
+    }
+    assert mock1.call_count == 1
+    assert mock2.call_count == 1
+
+
+def test_get_chart_versions_listed_only():
+    def mock_requirements(chart_info, chart, url, token, repositories):
+        chart_info[chart] = {"binderhub": "0.1.0", "jupyterhub": "0.1.0"}
+        repositories.update(
+            {
+                "binderhub": "https://jupyterhub.github.io/helm-chart/",
+                "jupyterhub": "https://jupyterhub.github.io/helm-chart/",
+            }
+        )
+        return chart_info
+
+    mock_pull = patch(
+        "helm_bot.app.pull_chart_version",
+        side_effect=lambda info, chart, *a, **k: {**info, chart: "0.1.0"},
+    )
+    mock_reqs = patch(
+        "helm_bot.app.pull_version_from_requirements_file",
+        side_effect=mock_requirements,
+    )
+
+    with mock_reqs, mock_pull as mock1:
+        chart_info = get_chart_versions(
+            "test_chart", "test_owner", "test_repo", "token"
+        )
+
+        # Defaults are neither pulled for unlisted dependencies nor used
+        # over a readable repository
+        assert [call.args[1:3] for call in mock1.call_args_list] == [
+            ("binderhub", "https://jupyterhub.github.io/helm-chart/"),
+            ("jupyterhub", "https://jupyterhub.github.io/helm-chart/"),
+        ]
+
+    assert check_versions("test_chart", chart_info, dry_run=True) == []
+
+
+def test_pull_chart_version_not_implemented():
+    with pytest.raises(NotImplementedError):
+        pull_chart_version({}, "chart", "ftp://example.com/charts", "token")
+
+
+@responses.activate
+def test_pull_chart_version_token_hosts():
+    index = {
+        "entries": {
+            "chart": [
+                {"version": "1.2.3", "created": "2021-01-01T00:00:00Z"},
+            ]
+        }
+    }
+    urls = [
+        "https://charts.example.com/index.yaml",
+        "https://example.com/charts/chart/Chart.yaml",
+        "https://raw.githubusercontent.com/owner/repo/gh-pages/index.yaml",
+    ]
+    responses.add(responses.GET, urls[0], body=yaml.safe_dump(index))
+    responses.add(responses.GET, urls[1], body="version: 1.2.3\n")
+    responses.add(responses.GET, urls[2], body=yaml.safe_dump(index))
+
+    for url in urls:
+        chart_info = pull_chart_version({}, "chart", url, "token")
+        assert chart_info == {"chart": "1.2.3"}
+
+    # The token is only sent to GitHub
+    assert "Authorization" not in responses.calls[0].request.headers
+    assert "Authorization" not in responses.calls[1].request.headers
+    assert responses.calls[2].request.headers["Authorization"] == "token token"
@@ -1,8 +1,23 @@
+import time
 import pytest
+import asyncio
 import logging
+import responses
 from unittest.mock import patch, call
 from testfixtures import log_capture
-from helm_bot.azure import login, get_token
+from helm_bot.azure import (
+    clear_token_cache,
+    login,
+    get_token,
+    get_token_async,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_token_cache():
+    clear_token_cache()
+    yield
+    clear_token_cache()
 
 
 @log_capture()
@@ -173,3 +188,114 @@ def test_get_token_exception(capture):
         assert mock2.call_args == expected_call
 
         capture.check_present()
+
+
+def test_get_token_async():
+    expected_calls = [
+        call(["az", "login"]),
+        call(
+            [
+                "az",
+                "keyvault",
+                "secret",
+                "show",
+                "-n",
+                "test_token",
+                "--vault-name",
+                "test_vault",
+                "--query",
+                "value",
+                "-o",
+                "tsv",
+            ]
+        ),
+    ]
+
+    with patch(
+        "helm_bot.azure.run_cmd_async",
+        return_value={"returncode": 0, "output": "this_is_a_token"},
+    ) as mock_run:
+        token = asyncio.run(get_token_async("test_token", "test_vault"))
+
+        assert token == "this_is_a_token"
+        assert mock_run.call_args_list == expected_calls
+
+
+def test_get_token_async_exception():
+    with patch(
+        "helm_bot.azure.run_cmd_async",
+        return_value={"returncode": 1, "err_msg": "Could not run command"},
+    ), pytest.raises(RuntimeError):
+        asyncio.run(get_token_async("test_token", "test_vault"))
+
+
+def test_get_token_cached():
+    mock_login = patch("helm_bot.azure.login")
+    mock_run = patch(
+        "helm_bot.azure.run_cmd",
+        return_value={"returncode": 0, "output": "this_is_a_token"},
+    )
+
+    with mock_login as mock1, mock_run as mock2:
+        assert (
+            get_token("test_token", "test_vault", ttl=60) == "this_is_a_token"
+        )
+        assert get_token("test_token", "test_vault") == "this_is_a_token"
+        assert (
+            asyncio.run(get_token_async("test_token", "test_vault"))
+            == "this_is_a_token"
+        )
+
+        assert mock1.call_count == 1
+        assert mock2.call_count == 1
+
+        # The cached token expires after the TTL
+        with patch("helm_bot.azure.time.time", return_value=time.time() + 61):
+            get_token("test_token", "test_vault")
+
+        assert mock1.call_count == 2
+        assert mock2.call_count == 2
+
+
+@responses.activate
+def test_get_token_identity(monkeypatch):
+    monkeypatch.setenv("IMDS_ENDPOINT", "http://localhost:50342")
+    imds_url = "http://localhost:50342/metadata/identity/oauth2/token"
+    vault_url = "https://test_vault.vault.azure.net/secrets/"
+
+    responses.add(
+        responses.GET,
+        imds_url,
+        json={
+            "access_token": "access_token",
+            "expires_on": str(int(time.time()) + 3600),
+        },
+    )
+    responses.add(
+        responses.GET, vault_url + "token1", json={"value": "secret1"}
+    )
+    responses.add(
+        responses.GET, vault_url + "token2", json={"value": "secret2"}
+    )
+
+    with patch("helm_bot.azure.run_cmd") as mock_run:
+        assert get_token("token1", "test_vault", identity=True) == "secret1"
+        assert (
+            asyncio.run(get_token_async("token2", "test_vault", identity=True))
+            == "secret2"
+        )
+        assert get_token("token1", "test_vault", identity=True) == "secret1"
+
+        assert mock_run.call_count == 0
+
+    # The access token is reused for both secrets
+    assert len(responses.calls) == 3
+    imds_request = responses.calls[0].request
+    assert imds_request.headers["Metadata"] == "true"
+    assert "resource=https%3A%2F%2Fvault.azure.net" in imds_request.url
+    for vault_call in responses.calls[1:]:
+        assert (
+            vault_call.request.headers["Authorization"]
+            == "Bearer access_token"
+        )
+        assert "api-version=7.4" in vault_call.request.url
@@ -0,0 +1,149 @@
+import os
+import threading
+import pytest
+from unittest.mock import patch
+from helm_bot.batch import load_manifest, run_batch
+
+
+def test_load_manifest(tmpdir):
+    manifest = tmpdir.join("manifest.yaml")
+    manifest.write("""defaults:
+  labels:
+    - dependencies
+repos:
+  - repo_owner: owner1
+    repo_name: repo1
+    chart_name: chart1
+  - repo_owner: owner2
+    repo_name: repo2
+    chart_name: chart2
+    base_branch: master
+    labels: null
+""")
+
+    repos = load_manifest(str(manifest))
+
+    assert repos == [
+        {
+            "repo_owner": "owner1",
+            "repo_name": "repo1",
+            "chart_name": "chart1",
+            "base_branch": "main",
+            "target_branch": "helm_chart_bump",
+            "labels": ["dependencies"],
+            "sources": None,
+        },
+        {
+            "repo_owner": "owner2",
+            "repo_name": "repo2",
+            "chart_name": "chart2",
+            "base_branch": "master",
+            "target_branch": "helm_chart_bump",
+            "labels": None,
+            "sources": None,
+        },
+    ]
+
+
+def test_load_manifest_exceptions(tmpdir):
+    manifest = tmpdir.join("manifest.yaml")
+
+    manifest.write("repos:\n  - repo_owner: owner1\n    repo_name: repo1\n")
+    with pytest.raises(ValueError):
+        load_manifest(str(manifest))
+
+    manifest.write("repos: []\n")
+    with pytest.raises(ValueError):
+        load_manifest(str(manifest))
+
+
+def test_run_batch():
+    repos = [
+        {
+            "repo_owner": f"owner{i}",
+            "repo_name": f"repo{i}",
+            "chart_name": f"chart{i}",
+            "base_branch": "main",
+            "target_branch": "helm_chart_bump",
+            "labels": None,
+        }
+        for i in range(3)
+    ]
+
+    def mock_run_side_effect(**kwargs):
+        if kwargs["repo_name"] == "repo1":
+            raise RuntimeError("Could not push")
+
+    mock_token = patch("helm_bot.batch.get_token", return_value="token")
+    mock_run = patch("helm_bot.batch.run", side_effect=mock_run_side_effect)
+    mock_clean = patch("helm_bot.batch.clean_up")
+
+    with mock_token as mock1, mock_run as mock2, mock_clean as mock3:
+        failures = run_batch(
+            repos, token_name="name", keyvault="vault", dry_run=True
+        )
+
+        assert mock1.call_count == 1
+        assert mock2.call_count == 3
+        assert mock3.call_count == 3
+        mock1.assert_called_with("name", "vault", identity=False)
+
+        version_caches = [
+            c.kwargs["version_cache"] for c in mock2.call_args_list
+        ]
+        assert all(vc is version_caches[0] for vc in version_caches)
+
+        for mock_call in mock2.call_args_list:
+            assert mock_call.kwargs["token"] == "token"
+            assert mock_call.kwargs["dry_run"]
+
+    assert list(failures.keys()) == ["owner1/repo1"]
+    assert isinstance(failures["owner1/repo1"], RuntimeError)
+
+
+def test_run_batch_workers():
+    repos = [
+        {
+            "repo_owner": "owner",
+            "repo_name": f"repo{i}",
+            "chart_name": "chart",
+            "base_branch": "main",
+            "target_branch": "helm_chart_bump",
+            "labels": None,
+        }
+        for i in range(4)
+    ]
+    cwd = os.getcwd()
+    barrier = threading.Barrier(2, timeout=5)
+
+    def mock_run_side_effect(**kwargs):
+        # Two upgrades must be in flight at once to pass the barrier
+        barrier.wait()
+        assert os.path.isdir(kwargs["workdir"])
+        assert os.getcwd() == cwd
+
+    mock_run = patch("helm_bot.batch.run", side_effect=mock_run_side_effect)
+    mock_clean = patch("helm_bot.batch.clean_up")
+
+    with mock_run as mock1, mock_clean as mock2:
+        failures = run_batch(repos, token="token", workers=2)
+
+        assert failures == {}
+        assert mock1.call_count == 4
+
+        workdirs = [c.kwargs["workdir"] for c in mock1.call_args_list]
+        assert len(set(workdirs)) == len(repos)
+        assert not any(os.path.exists(workdir) for workdir in workdirs)
+
+        version_caches = [
+            c.kwargs["version_cache"] for c in mock1.call_args_list
+        ]
+        assert all(vc is version_caches[0] for vc in version_caches)
+
+        for mock_call in mock2.call_args_list:
+            assert mock_call.kwargs["workdir"] in workdirs
+
+
+def test_run_batch_workers_exception():
+    with pytest.raises(ValueError):
+        run_batch([], token="token", workers=0)
@@ -0,0 +1,477 @@
+import os
+import time
+import pytest
+import responses
+from unittest.mock import patch
+from concurrent.futures import ThreadPoolExecutor
+from helm_bot.cache import (
+    clear_index_cache,
+    conditional_get,
+    configure_index_cache,
+    get_cached_index,
+    latest_compact_release,
+    load_cache_entry,
+    load_compact_releases,
+    lookup_parsed_version,
+    save_cache_entry,
+    store_cached_index,
+    store_parsed_version,
+    update_compact_index,
+    update_http_cache,
+)
+from helm_bot.pull_version_info import (
+    pull_version_from_chart_file,
+    pull_version_from_github_pages,
+    pull_version_from_helm_repo,
+)
+
+
+def test_save_and_load_cache_entry(tmpdir):
+    cache_dir = str(tmpdir)
+    entry = {"etag": '"abc"', "versions": {"chart": "1.2.3"}}
+
+    assert load_cache_entry(cache_dir, "http", "some_key") == {}
+
+    save_cache_entry(cache_dir, "http", "some_key", entry)
+
+    assert load_cache_entry(cache_dir, "http", "some_key") == entry
+    assert load_cache_entry(cache_dir, "http", "other_key") == {}
+    assert len(os.listdir(os.path.join(cache_dir, "http"))) == 1
+
+
+def test_load_cache_entry_corrupt(tmpdir):
+    cache_dir = str(tmpdir)
+    save_cache_entry(cache_dir, "http", "some_key", {})
+
+    for filename in os.listdir(os.path.join(cache_dir, "http")):
+        with open(os.path.join(cache_dir, "http", filename), "w") as f:
+            f.write("{not json")
+
+    assert load_cache_entry(cache_dir, "http", "some_key") == {}
+
+
+@responses.activate
+def test_conditional_get_sends_validators(tmpdir):
+    cache_dir = str(tmpdir)
+    test_url = "http://jsonplaceholder.typicode.com/Chart.yaml"
+
+    save_cache_entry(
+        cache_dir,
+        "http",
+        test_url,
+        {
+            "etag": '"abc"',
+            "last_modified": "Wed, 21 Oct 2015 07:28:00 GMT",
+            "versions": {"dependency": "1.2.3"},
+        },
+    )
+
+    responses.add(responses.GET, test_url, status=304)
+
+    resp, entry = conditional_get(test_url, {}, "dependency", cache_dir)
+
+    assert resp is None
+    assert entry["versions"] == {"dependency": "1.2.3"}
+    assert responses.calls[0].request.headers["If-None-Match"] == '"abc"'
+    assert (
+        responses.calls[0].request.headers["If-Modified-Since"]
+        == "Wed, 21 Oct 2015 07:28:00 GMT"
+    )
+
+
+@responses.activate
+def test_conditional_get_unknown_dependency(tmpdir):
+    cache_dir = str(tmpdir)
+    test_url = "http://jsonplaceholder.typicode.com/Chart.yaml"
+
+    save_cache_entry(
+        cache_dir,
+        "http",
+        test_url,
+        {"etag": '"abc"', "versions": {"dependency": "1.2.3"}},
+    )
+
+    responses.add(responses.GET, test_url, body="version: 1.2.3")
+
+    resp, _ = conditional_get(test_url, {}, "other-dependency", cache_dir)
+
+    assert resp.text == "version: 1.2.3"
+    assert "If-None-Match" not in responses.calls[0].request.headers
+
+
+@responses.activate
+def test_update_http_cache_resets_stale_versions(tmpdir):
+    cache_dir = str(tmpdir)
+    test_url = "http://jsonplaceholder.typicode.com/index.yaml"
+    entry = {"etag": '"old"', "versions": {"chart-1": "1.0.0"}}
+
+    responses.add(responses.GET, test_url, headers={"ETag": '"new"'})
+    resp, _ = conditional_get(test_url, {}, "chart-2")
+
+    update_http_cache(cache_dir, test_url, resp, entry, "chart-2", "2.0.0")
+
+    assert load_cache_entry(cache_dir, "http", test_url) == {
+        "etag": '"new"',
+        "last_modified": None,
+        "versions": {"chart-2": "2.0.0"},
+    }
+
+
+@responses.activate
+def test_pull_version_from_chart_file_not_modified(tmpdir):
+    cache_dir = str(tmpdir)
+    test_dep = "dependency"
+    test_url = "http://jsonplaceholder.typicode.com/Chart.yaml"
+    test_token = "tHiS_iS_a_tOkEn"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        body="version: 1.2.3",
+        headers={"ETag": '"abc"'},
+    )
+    responses.add(responses.GET, test_url, status=304)
+
+    test_dict = pull_version_from_chart_file(
+        {}, test_dep, test_url, test_token, cache_dir=cache_dir
+    )
+    test_dict2 = pull_version_from_chart_file(
+        {}, test_dep, test_url, test_token, cache_dir=cache_dir
+    )
+
+    assert test_dict == test_dict2 == {test_dep: "1.2.3"}
+    assert len(responses.calls) == 2
+    assert "If-None-Match" not in responses.calls[0].request.headers
+    assert responses.calls[1].request.headers["If-None-Match"] == '"abc"'
+
+
+@responses.activate
+def test_pull_version_from_github_pages_not_modified(tmpdir):
+    cache_dir = str(tmpdir)
+    test_dep = "dependency"
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+    test_token = "tHiS_iS_a_tOkEn"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        body="entries:\n  dependency:\n  - {created: '2020-07-26T15:33:00Z', version: 1.2.3}\n",
+        headers={"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"},
+    )
+    responses.add(responses.GET, test_url, status=304)
+
+    for _ in range(2):
+        test_dict = pull_version_from_github_pages(
+            {},
+            test_dep,
+            test_url,
+            test_token,
+            stream=True,
+            cache_dir=cache_dir,
+        )
+
+        assert test_dict == {test_dep: "1.2.3"}
+
+    assert len(responses.calls) == 2
+    assert (
+        responses.calls[1].request.headers["If-Modified-Since"]
+        == "Wed, 21 Oct 2015 07:28:00 GMT"
+    )
+
+
+def test_lookup_parsed_version_is_read_only(tmpdir):
+    cache_dir = str(tmpdir)
+    store_parsed_version(cache_dir, b"content", "dependency", "1.2.3")
+
+    with patch("helm_bot.cache.save_cache_entry") as mock_save:
+        assert lookup_parsed_version(cache_dir, b"content", "dependency")
+        assert lookup_parsed_version(cache_dir, b"other", "dependency") is None
+
+        assert mock_save.call_count == 0
+
+
+def test_store_and_lookup_parsed_version(tmpdir):
+    cache_dir = str(tmpdir)
+    content = b"version: 1.2.3"
+
+    assert lookup_parsed_version(cache_dir, content, "dependency") is None
+
+    store_parsed_version(cache_dir, content, "dependency", "1.2.3")
+
+    assert lookup_parsed_version(cache_dir, content, "dependency") == "1.2.3"
+    assert lookup_parsed_version(cache_dir, content, "other") is None
+    assert lookup_parsed_version(cache_dir, b"changed", "dependency") is None
+
+
+def test_store_parsed_version_evicts_least_recently_stored(tmpdir):
+    cache_dir = str(tmpdir)
+
+    with patch("helm_bot.cache.time.time", side_effect=range(100)):
+        store_parsed_version(cache_dir, b"1", "chart", "1", max_entries=2)
+        store_parsed_version(cache_dir, b"2", "chart", "2", max_entries=2)
+        # Storing the oldest entry again protects it from eviction
+        store_parsed_version(cache_dir, b"1", "chart", "1", max_entries=2)
+        store_parsed_version(cache_dir, b"3", "chart", "3", max_entries=2)
+
+    assert lookup_parsed_version(cache_dir, b"1", "chart") == "1"
+    assert lookup_parsed_version(cache_dir, b"2", "chart") is None
+    assert lookup_parsed_version(cache_dir, b"3", "chart") == "3"
+
+
+@responses.activate
+def test_pull_version_from_github_pages_same_content(tmpdir):
+    cache_dir = str(tmpdir)
+    test_dep = "dependency"
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+    test_token = "tHiS_iS_a_tOkEn"
+
+    # No validators are sent, so the index is downloaded both times
+    responses.add(
+        responses.GET,
+        test_url,
+        body="entries:\n  dependency:\n  - {created: '2020-07-26T15:33:00Z', version: 1.2.3}\n",
+    )
+
+    test_dict = pull_version_from_github_pages(
+        {}, test_dep, test_url, test_token, cache_dir=cache_dir
+    )
+
+    with patch(
+        "helm_bot.pull_version_info.load_entries_from_stream"
+    ) as mock_load:
+        test_dict2 = pull_version_from_github_pages(
+            {}, test_dep, test_url, test_token, cache_dir=cache_dir
+        )
+
+        assert mock_load.call_count == 0
+
+    assert test_dict == test_dict2 == {test_dep: "1.2.3"}
+    assert len(responses.calls) == 2
+
+
+@responses.activate
+def test_pull_version_from_github_pages_shared_index():
+    configure_index_cache(ttl=60)
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        body="""entries:
+  binderhub:
+  - {created: '2020-07-26T15:33:00Z', version: 0.2.0, digest: abc}
+  - {created: '2020-07-25T15:33:00Z', version: 0.1.0, digest: def}
+  jupyterhub:
+  - {created: '2020-07-24T15:33:00Z', version: 1.2.3, digest: ghi}
+""",
+    )
+
+    test_dict = {}
+    for dep in ("binderhub", "jupyterhub", "binderhub"):
+        test_dict = pull_version_from_github_pages(
+            test_dict, dep, test_url, None, stream=True
+        )
+
+    assert test_dict == {"binderhub": "0.2.0", "jupyterhub": "1.2.3"}
+    assert len(responses.calls) == 1
+    assert get_cached_index(test_url)["jupyterhub"] == [
+        {"version": "1.2.3", "created": "2020-07-24T15:33:00Z"}
+    ]
+
+    # Once the TTL has passed the index is downloaded again
+    expired = time.monotonic() + 61
+    with patch("helm_bot.cache.time.monotonic", return_value=expired):
+        assert get_cached_index(test_url) is None
+        pull_version_from_github_pages({}, "binderhub", test_url, None)
+
+    assert len(responses.calls) == 2
+
+    clear_index_cache()
+    assert get_cached_index(test_url) is None
+
+
+@responses.activate
+def test_pull_version_from_github_pages_shared_index_concurrent():
+    configure_index_cache(ttl=60)
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        body="""entries:
+  binderhub:
+  - {created: '2020-07-26T15:33:00Z', version: 0.2.0}
+  jupyterhub:
+  - {created: '2020-07-24T15:33:00Z', version: 1.2.3}
+""",
+    )
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(
+            executor.map(
+                lambda dep: pull_version_from_github_pages(
+                    {}, dep, test_url, None
+                ),
+                ["binderhub", "jupyterhub"] * 4,
+            )
+        )
+
+    assert results[:2] == [{"binderhub": "0.2.0"}, {"jupyterhub": "1.2.3"}]
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_pull_version_from_github_pages_shared_index_github_pages():
+    configure_index_cache(ttl=60)
+    raw_url = "https://raw.githubusercontent.com/jupyterhub/helm-chart/gh-pages/index.yaml"
+    pages_url = "https://jupyterhub.github.io/helm-chart"
+
+    responses.add(
+        responses.GET,
+        raw_url,
+        body="""entries:
+  binderhub:
+  - {created: '2020-07-26T15:33:00Z', version: 0.2.0}
+  jupyterhub:
+  - {created: '2020-07-24T15:33:00Z', version: 1.2.3}
+""",
+    )
+
+    test_dict = pull_version_from_github_pages({}, "binderhub", raw_url, None)
+    # The same index, as the `repository` of a dependency
+    test_dict = pull_version_from_helm_repo(
+        test_dict, "jupyterhub", pages_url + "/", None
+    )
+
+    assert test_dict == {"binderhub": "0.2.0", "jupyterhub": "1.2.3"}
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_pull_version_from_github_pages_cache_dir_latest_by(tmpdir):
+    cache_dir = str(tmpdir)
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+
+    # The most recently created release is a backport
+    responses.add(
+        responses.GET,
+        test_url,
+        body="""entries:
+  binderhub:
+  - {created: '2020-07-26T15:33:00Z', version: 0.1.1}
+  - {created: '2020-07-25T15:33:00Z', version: 0.2.0}
+""",
+        headers={"ETag": '"abc"'},
+    )
+
+    by_created = pull_version_from_github_pages(
+        {}, "binderhub", test_url, None, cache_dir=cache_dir
+    )
+    by_version = pull_version_from_github_pages(
+        {},
+        "binderhub",
+        test_url,
+        None,
+        cache_dir=cache_dir,
+        latest_by="version",
+    )
+    by_created2 = pull_version_from_github_pages(
+        {}, "binderhub", test_url, None, cache_dir=cache_dir
+    )
+
+    assert by_created == by_created2 == {"binderhub": "0.1.1"}
+    assert by_version == {"binderhub": "0.2.0"}
+
+
+def test_configure_index_cache():
+    configure_index_cache(ttl=60)
+    store_cached_index("url", {"chart": []})
+    assert get_cached_index("url") == {"chart": []}
+
+    configure_index_cache(ttl=0)
+    assert get_cached_index("url") is None
+    store_cached_index("url", {"chart": []})
+    assert get_cached_index("url") is None
+
+    with pytest.raises(ValueError):
+        configure_index_cache(ttl=-1)
+
+
+def test_update_compact_index(tmpdir):
+    cache_dir = str(tmpdir)
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+    index = {
+        "binderhub": [
+            {"version": "0.2.0", "created": "2020-07-26T16:33:00+01:00"},
+            {"version": "0.1.0", "created": "2020-07-25T15:33:00Z"},
+        ],
+        "jupyterhub": [
+            {"version": "1.2.3", "created": "2020-07-24T15:33:00.123456789Z"}
+        ],
+    }
+
+    assert load_compact_releases(cache_dir, test_url, "binderhub") == []
+    assert update_compact_index(cache_dir, test_url, index) == 3
+    assert update_compact_index(cache_dir, test_url, index) == 0
+
+    index["binderhub"].append(
+        {"version": "0.3.0-n001", "created": "2020-07-27T15:33:00Z"}
+    )
+    index["binderhub"].append(
+        {"version": "0.0.1", "created": "2020-07-01T15:33:00Z"}
+    )
+    index["binderhub"].append({"version": "9.9.9", "created": "yesterday"})
+    index["binderhub"].append({"version": "9.9.8"})
+    assert update_compact_index(cache_dir, test_url, index) == 2
+
+    releases = load_compact_releases(cache_dir, test_url, "binderhub")
+    assert releases == [
+        ["0.0.1", "2020-07-01T15:33:00+00:00"],
+        ["0.1.0", "2020-07-25T15:33:00+00:00"],
+        ["0.2.0", "2020-07-26T15:33:00+00:00"],
+        ["0.3.0-n001", "2020-07-27T15:33:00+00:00"],
+    ]
+    assert latest_compact_release(releases) == "0.3.0-n001"
+    assert latest_compact_release(releases, by="version") == "0.3.0-n001"
+    assert load_compact_releases(cache_dir, test_url, "jupyterhub") == [
+        ["1.2.3", "2020-07-24T15:33:00.123456+00:00"]
+    ]
+    assert load_compact_releases(cache_dir, test_url, "jupyter") == []
+
+    with pytest.raises(ValueError):
+        latest_compact_release([])
+
+
+@responses.activate
+def test_pull_version_from_github_pages_compact_index(tmpdir):
+    cache_dir = str(tmpdir)
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        body="""entries:
+  binderhub:
+  - {created: '2020-07-26T15:33:00Z', version: 0.2.0}
+  jupyterhub:
+  - {created: '2020-07-24T15:33:00Z', version: 1.2.3}
+""",
+        headers={"ETag": '"abc"'},
+    )
+    responses.add(responses.GET, test_url, status=304)
+
+    test_dict = pull_version_from_github_pages(
+        {}, "binderhub", test_url, None, cache_dir=cache_dir
+    )
+
+    # The other dependency is answered from the compact index
+    with patch("helm_bot.pull_version_info.load_index_entries") as mock_load:
+        test_dict = pull_version_from_github_pages(
+            test_dict, "jupyterhub", test_url, None, cache_dir=cache_dir
+        )
+
+        assert mock_load.call_count == 0
+
+    assert test_dict == {"binderhub": "0.2.0", "jupyterhub": "1.2.3"}
+    assert len(responses.calls) == 2
+    assert responses.calls[1].request.headers["If-None-Match"] == '"abc"'
@@ -0,0 +1,129 @@
+import threading
+import pytest
+from unittest.mock import patch
+from helm_bot.daemon import pop_due, run_daemon, schedule_repos
+
+
+def make_repos(n):
+    return [
+        {
+            "repo_owner": f"owner{i}",
+            "repo_name": f"repo{i}",
+            "chart_name": f"chart{i}",
+            "base_branch": "main",
+            "target_branch": "helm_chart_bump",
+            "labels": None,
+        }
+        for i in range(n)
+    ]
+
+
+def test_schedule_repos():
+    repos = make_repos(2)
+    repos[1]["interval"] = 60
+
+    schedule = schedule_repos(repos, interval=600, now=100)
+
+    assert pop_due(schedule, 99) == []
+    checks = pop_due(schedule, 100)
+
+    assert [index for (_, index, _) in checks] == [0, 1]
+    assert [repo["interval"] for (_, _, repo) in checks] == [600, 60]
+    assert schedule == []
+    assert "interval" not in repos[0]
+
+
+def test_schedule_repos_jitter():
+    with patch("helm_bot.daemon.random.uniform", return_value=5) as mock:
+        schedule = schedule_repos(make_repos(1), jitter=10, now=100)
+
+    assert schedule[0][0] == 105
+    mock.assert_called_once_with(0, 10)
+
+
+def test_schedule_repos_exceptions():
+    with pytest.raises(ValueError):
+        schedule_repos(make_repos(1), interval=0)
+
+    with pytest.raises(ValueError):
+        schedule_repos(make_repos(1), jitter=-1)
+
+
+def test_run_daemon():
+    repos = make_repos(2)
+    repos[1]["interval"] = 1000
+    clock = [100]
+
+    def mock_run_batch_side_effect(checked, **kwargs):
+        clock[0] += 1
+
+    def mock_wait_side_effect(delay):
+        clock[0] += delay
+
+    stop_event = threading.Event()
+    mock_run_batch = patch(
+        "helm_bot.daemon.run_batch", side_effect=mock_run_batch_side_effect
+    )
+    mock_clock = patch(
+        "helm_bot.daemon.time.monotonic", side_effect=lambda: clock[0]
+    )
+    mock_wait = patch.object(
+        stop_event, "wait", side_effect=mock_wait_side_effect
+    )
+
+    with mock_run_batch as mock1, mock_clock, mock_wait as mock2:
+        run_daemon(
+            repos,
+            interval=10,
+            stop_event=stop_event,
+            max_rounds=3,
+            token="token",
+            dry_run=True,
+        )
+
+    checked = [
+        [repo["repo_name"] for repo in call.args[0]]
+        for call in mock1.call_args_list
+    ]
+    assert checked == [["repo0", "repo1"], ["repo0"], ["repo0"]]
+    assert mock1.call_args.kwargs == {
+        "version_cache": {},
+        "token": "token",
+        "dry_run": True,
+    }
+    assert mock2.call_count == 2
+
+
+def test_run_daemon_survives_failures():
+    stop_event = threading.Event()
+    mock_run_batch = patch(
+        "helm_bot.daemon.run_batch", side_effect=RuntimeError("No token")
+    )
+
+    with mock_run_batch as mock:
+        run_daemon(
+            make_repos(1), interval=0.01, stop_event=stop_event, max_rounds=2
+        )
+
+    assert mock.call_count == 2
+
+
+def test_run_daemon_resets_retry_budget():
+    mock_run_batch = patch("helm_bot.daemon.run_batch")
+    mock_reset = patch("helm_bot.daemon.reset_retry_budget")
+
+    with mock_run_batch, mock_reset as mock:
+        run_daemon(make_repos(1), interval=0.01, max_rounds=2)
+
+    # Each round gets the full retry budget
+    assert mock.call_count == 2
+
+
+def test_run_daemon_stop_event():
+    stop_event = threading.Event()
+    stop_event.set()
+
+    with patch("helm_bot.daemon.run_batch") as mock:
+        run_daemon(make_repos(1), stop_event=stop_event)
+
+    assert mock.call_count == 0
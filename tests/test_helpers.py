@@ -1,16 +1,72 @@
+import time
 import pytest
+import requests
+import asyncio
 import logging
 import responses
 from unittest.mock import patch
 from testfixtures import log_capture
 from helm_bot.helper_functions import (
+    configure_commands,
+    configure_rate_limits,
+    configure_retries,
+    configure_session,
     delete_request,
+    get_paginated,
+    get_rate_limit_metrics,
     get_request,
+    get_session,
     post_request,
+    reset_rate_limits,
+    reset_retry_budget,
     run_cmd,
+    run_cmd_async,
 )
 
 
+@pytest.fixture(autouse=True)
+def fresh_rate_limits():
+    reset_rate_limits()
+    yield
+    reset_rate_limits()
+    configure_rate_limits()
+
+
+def test_configure_session():
+    session = configure_session(pool_size=3, timeout=5)
+    adapter = session.get_adapter("https://api.github.com/")
+
+    assert get_session() is session
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 3
+
+    new_session = configure_session()
+
+    assert get_session() is new_session
+    assert new_session is not session
+
+
+@responses.activate
+def test_requests_share_session():
+    test_url = "http://jsonplaceholder.typicode.com/"
+    session = configure_session()
+
+    responses.add(responses.GET, test_url, json={"Response": "OK"}, status=200)
+    responses.add(responses.POST, test_url, json={"Request": "Sent"})
+    responses.add(responses.DELETE, test_url)
+
+    with patch.object(
+        session, "request", wraps=session.request
+    ) as mock_request:
+        get_request(test_url, json=True)
+        post_request(test_url, json={"Payload": "Send this"})
+        delete_request(test_url)
+
+        assert mock_request.call_count == 3
+
+    assert len(responses.calls) == 3
+
+
 @responses.activate
 def test_delete_request():
     test_url = "http://jsonplaceholder.typicode.com/"
@@ -101,6 +157,58 @@ def test_get_request_url_exception():
     assert responses.calls[0].request.url == test_url
 
 
+@responses.activate
+def test_get_paginated():
+    test_url = "https://api.github.com/repos/owner/repo/branches"
+    page2_url = test_url + "?per_page=100&page=2"
+    page3_url = test_url + "?per_page=100&page=3"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        json=[{"name": "a"}, {"name": "b"}],
+        headers={
+            "Link": f'<{page2_url}>; rel="next", <{page3_url}>; rel="last"'
+        },
+        match=[responses.matchers.query_param_matcher({"per_page": "100"})],
+    )
+    responses.add(
+        responses.GET,
+        page2_url,
+        json=[{"name": "c"}],
+        headers={"Link": f'<{page3_url}>; rel="next"'},
+        match=[
+            responses.matchers.query_param_matcher(
+                {"per_page": "100", "page": "2"}
+            )
+        ],
+    )
+    responses.add(
+        responses.GET,
+        page3_url,
+        json=[{"name": "d"}],
+        match=[
+            responses.matchers.query_param_matcher(
+                {"per_page": "100", "page": "3"}
+            )
+        ],
+    )
+
+    items = get_paginated(test_url, headers={"Authorization": "token abc"})
+    assert [item["name"] for item in items] == ["a", "b", "c", "d"]
+    assert len(responses.calls) == 3
+    assert all(
+        call.request.headers["Authorization"] == "token abc"
+        for call in responses.calls
+    )
+
+    # Stopping early does not request the remaining pages
+    responses.calls.reset()
+    items = get_paginated(test_url)
+    assert any(item["name"] == "c" for item in items)
+    assert len(responses.calls) == 2
+
+
 @responses.activate
 def test_post_request():
     test_url = "http://jsonplaceholder.typicode.com/"
@@ -147,8 +255,378 @@ def test_run_cmd():
     assert result["err_msg"] == ""
 
 
+def test_run_cmd_cwd(tmpdir):
+    result = run_cmd(["pwd"], cwd=str(tmpdir))
+
+    assert result["returncode"] == 0
+    assert result["output"] == str(tmpdir)
+
+
 def test_run_cmd_exception():
     test_cmd = ["ehco", "hello"]
 
     with pytest.raises(FileNotFoundError):
         run_cmd(test_cmd)
+
+
+def test_run_cmd_timeout():
+    # The sleep is a grandchild, which must be killed along with the shell
+    test_cmd = ["sh", "-c", "echo hello; sleep 10"]
+
+    start = time.monotonic()
+    result = run_cmd(test_cmd, timeout=0.5)
+
+    assert time.monotonic() - start < 5
+    assert result["returncode"] != 0
+    assert result["output"] == "hello"
+    assert result["err_msg"] == "Command timed out after 0.5 seconds: sh -c"
+
+
+def test_run_cmd_async(tmpdir):
+    test_cmd = ["sh", "-c", "pwd; echo error >&2; exit 3"]
+    result = asyncio.run(run_cmd_async(test_cmd, cwd=str(tmpdir)))
+
+    assert result["returncode"] == 3
+    assert result["output"] == str(tmpdir)
+    assert result["err_msg"] == "error"
+
+
+def test_run_cmd_async_timeout():
+    test_cmd = ["sh", "-c", "echo hello; sleep 10"]
+
+    start = time.monotonic()
+    result = asyncio.run(run_cmd_async(test_cmd, timeout=0.5))
+
+    assert time.monotonic() - start < 5
+    assert result["returncode"] != 0
+    assert result["output"] == "hello"
+    assert result["err_msg"] == "Command timed out after 0.5 seconds: sh -c"
+
+
+def test_run_cmd_async_concurrency_limit(tmpdir):
+    # Each command records how many commands are running alongside it
+    test_cmd = [
+        "sh",
+        "-c",
+        "touch $$; ls | wc -l; sleep 0.2; rm $$",
+    ]
+
+    async def run_all():
+        return await asyncio.gather(
+            *[run_cmd_async(test_cmd, cwd=str(tmpdir)) for _ in range(6)]
+        )
+
+    configure_commands(max_concurrent=2)
+    try:
+        results = asyncio.run(run_all())
+    finally:
+        configure_commands()
+
+    assert all(result["returncode"] == 0 for result in results)
+    assert max(int(result["output"]) for result in results) == 2
+
+
+def test_configure_commands_exception():
+    with pytest.raises(ValueError):
+        configure_commands(max_concurrent=0)
+
+
+@responses.activate
+def test_rate_limit_metrics():
+    reset = int(time.time()) + 3600
+    responses.add(
+        responses.GET,
+        "https://api.github.com/repos/owner/repo",
+        json={},
+        headers={
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "4999",
+            "X-RateLimit-Reset": str(reset),
+        },
+    )
+    responses.add(
+        responses.POST,
+        "https://api.github.com/graphql",
+        json={},
+        headers={
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "4990",
+            "X-RateLimit-Reset": str(reset),
+        },
+    )
+
+    get_request("https://api.github.com/repos/owner/repo")
+    post_request("https://api.github.com/graphql", json={})
+
+    assert get_rate_limit_metrics() == {
+        "requests": 2,
+        "rate_limited": 0,
+        "retried": 0,
+        "waited": 0.0,
+        "quotas": {
+            "api.github.com/core": {
+                "limit": 5000,
+                "remaining": 4999,
+                "reset": reset,
+            },
+            "api.github.com/graphql": {
+                "limit": 5000,
+                "remaining": 4990,
+                "reset": reset,
+            },
+        },
+    }
+
+
+@responses.activate
+def test_rate_limit_pacing():
+    test_url = "https://api.github.com/repos/owner/repo"
+    responses.add(
+        responses.GET,
+        test_url,
+        json={},
+        headers={
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "9",
+            "X-RateLimit-Reset": str(int(time.time()) + 100),
+        },
+    )
+
+    with patch("helm_bot.helper_functions.time.sleep") as mock_sleep:
+        get_request(test_url)
+        assert mock_sleep.call_count == 0
+
+        # The remaining 9 requests are spread over the next 100 seconds
+        get_request(test_url)
+        assert mock_sleep.call_count == 1
+        assert 8 < mock_sleep.call_args.args[0] <= 10
+
+
+@responses.activate
+def test_rate_limit_exhausted():
+    test_url = "https://api.github.com/repos/owner/repo"
+    responses.add(
+        responses.GET,
+        test_url,
+        status=403,
+        json={"message": "API rate limit exceeded"},
+        headers={
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(int(time.time()) + 30),
+        },
+    )
+    responses.add(responses.GET, test_url, json={"Response": "OK"})
+
+    with patch("helm_bot.helper_functions.time.sleep") as mock_sleep:
+        assert get_request(test_url, json=True) == {"Response": "OK"}
+
+        # Waits until the quota resets
+        assert 25 < mock_sleep.call_args_list[0].args[0] <= 30
+
+    metrics = get_rate_limit_metrics()
+    assert metrics["requests"] == 2
+    assert metrics["rate_limited"] == 1
+
+
+@responses.activate
+def test_rate_limit_retry_after():
+    test_url = "https://api.github.com/repos/owner/repo"
+    responses.add(
+        responses.POST, test_url, status=429, headers={"Retry-After": "7"}
+    )
+    responses.add(responses.POST, test_url, json={"Request": "Sent"})
+
+    with patch("helm_bot.helper_functions.time.sleep") as mock_sleep:
+        assert post_request(test_url) == {"Request": "Sent"}
+
+        mock_sleep.assert_called_once_with(7.0)
+
+
+@responses.activate
+def test_rate_limit_secondary():
+    test_url = "https://api.github.com/repos/owner/repo"
+    responses.add(
+        responses.GET,
+        test_url,
+        status=403,
+        json={"message": "You have exceeded a secondary rate limit."},
+    )
+
+    configure_rate_limits(max_retries=2, backoff=10)
+
+    with patch(
+        "helm_bot.helper_functions.time.sleep"
+    ) as mock_sleep, pytest.raises(RuntimeError):
+        get_request(test_url)
+
+    # Backs off with jitter up to 10s then 20s, then gives up
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert len(delays) == 2
+    assert 1 <= delays[0] <= 10
+    assert 1 <= delays[1] <= 20
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_forbidden_is_not_retried():
+    test_url = "https://api.github.com/repos/owner/repo"
+    responses.add(
+        responses.GET,
+        test_url,
+        status=403,
+        json={"message": "Resource not accessible by integration"},
+    )
+
+    with patch(
+        "helm_bot.helper_functions.time.sleep"
+    ) as mock_sleep, pytest.raises(RuntimeError):
+        get_request(test_url)
+
+    assert mock_sleep.call_count == 0
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_get_request_retries_transient_errors():
+    test_url = "https://raw.githubusercontent.com/owner/repo/main/index.yaml"
+    responses.add(responses.GET, test_url, status=502)
+    responses.add(
+        responses.GET, test_url, body=requests.ConnectionError("reset")
+    )
+    responses.add(responses.GET, test_url, body="entries: {}")
+
+    configure_retries(max_retries=3, backoff=1, max_backoff=4)
+
+    with patch("helm_bot.helper_functions.time.sleep") as mock_sleep:
+        assert get_request(test_url, text=True) == "entries: {}"
+
+    # Capped exponential backoff with jitter
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert len(delays) == 2
+    assert 0.5 <= delays[0] <= 1
+    assert 1 <= delays[1] <= 2
+    assert get_rate_limit_metrics()["retried"] == 2
+
+
+@responses.activate
+def test_post_request_not_retried():
+    test_url = "https://api.github.com/repos/owner/repo/pulls"
+    responses.add(responses.POST, test_url, status=502)
+
+    configure_retries(max_retries=3)
+
+    with patch(
+        "helm_bot.helper_functions.time.sleep"
+    ) as mock_sleep, pytest.raises(RuntimeError):
+        post_request(test_url, json={})
+
+    assert mock_sleep.call_count == 0
+    assert len(responses.calls) == 1
+
+
+@responses.activate
+def test_retry_budget():
+    test_url = "https://api.github.com/repos/owner/repo"
+    responses.add(responses.GET, test_url, status=503)
+
+    configure_retries(max_retries=10, backoff=10, max_backoff=10, budget=25)
+
+    with patch(
+        "helm_bot.helper_functions.time.sleep"
+    ) as mock_sleep, pytest.raises(RuntimeError):
+        get_request(test_url)
+
+    # Each wait is 5-10s, so at most 25s worth fit in the budget
+    delays = [c.args[0] for c in mock_sleep.call_args_list]
+    assert 2 <= len(delays) <= 5
+    assert sum(delays) <= 25
+
+    # The budget is shared, so little is left for the next request
+    with patch(
+        "helm_bot.helper_functions.time.sleep"
+    ) as mock_sleep, pytest.raises(RuntimeError):
+        get_request(test_url)
+
+    assert (
+        sum(delays) + sum(c.args[0] for c in mock_sleep.call_args_list) <= 25
+    )
+
+    # A new round of checks gets the full budget again
+    reset_retry_budget()
+    with patch("helm_bot.helper_functions.time.sleep") as mock_sleep:
+        with pytest.raises(RuntimeError):
+            get_request(test_url)
+
+        assert len(mock_sleep.call_args_list) >= 2
+
+
+def test_run_cmd_retries_transient_git_errors(tmpdir):
+    # Fails with a network error the first time, then succeeds
+    marker = tmpdir.join("attempted")
+    git = tmpdir.join("git")
+    git.write(
+        "#!/bin/sh\n"
+        f"if [ -e {marker} ]; then echo pushed; exit 0; fi\n"
+        f"touch {marker}\n"
+        "echo 'fatal: unable to access: Could not resolve host: github.com' >&2\n"
+        "exit 128\n"
+    )
+    git.chmod(0o755)
+
+    configure_retries(max_retries=3, backoff=0.01)
+
+    result = run_cmd([str(git), "-C", "repo", "push", "origin", "main"])
+
+    assert result["returncode"] == 0
+    assert result["output"] == "pushed"
+    assert get_rate_limit_metrics()["retried"] == 1
+
+
+def test_run_cmd_does_not_retry_other_errors(tmpdir):
+    git = tmpdir.join("git")
+    git.write(
+        "#!/bin/sh\n"
+        f"echo attempt >> {tmpdir.join('attempts')}\n"
+        "echo 'error: failed to push some refs' >&2\n"
+        "exit 1\n"
+    )
+    git.chmod(0o755)
+
+    configure_retries(max_retries=3, backoff=0.01)
+
+    assert run_cmd([str(git), "push"])["returncode"] == 1
+    assert run_cmd([str(git), "commit", "-m", "timed out"])["returncode"] == 1
+    assert len(tmpdir.join("attempts").readlines()) == 2
+
+
+def test_run_cmd_retries_timed_out_clone(tmpdir):
+    # Writes part of the clone and hangs the first time, then succeeds if the
+    # destination is gone
+    marker = tmpdir.join("attempted")
+    git = tmpdir.join("git")
+    git.write(
+        "#!/bin/sh\n"
+        f"if [ -e {marker} ]; then\n"
+        "  if [ -e dst ]; then\n"
+        "    echo \"fatal: destination path 'dst' already exists\" >&2\n"
+        "    exit 128\n"
+        "  fi\n"
+        "  mkdir dst && echo cloned && exit 0\n"
+        "fi\n"
+        f"touch {marker}\n"
+        "mkdir dst && touch dst/partial\n"
+        "sleep 10\n"
+    )
+    git.chmod(0o755)
+
+    configure_retries(max_retries=3, backoff=0.01)
+
+    result = run_cmd(
+        [str(git), "clone", "https://example.com/repo.git", "dst"],
+        cwd=str(tmpdir),
+        timeout=0.5,
+    )
+
+    assert result["returncode"] == 0
+    assert result["output"] == "cloned"
+    assert not tmpdir.join("dst", "partial").exists()
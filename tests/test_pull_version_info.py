@@ -1,7 +1,14 @@
+import yaml
+import pytest
 import responses
 from helm_bot.pull_version_info import (
+    load_entries_from_stream,
+    load_index_entries,
+    pull_version_from_artifacthub,
     pull_version_from_chart_file,
     pull_version_from_github_pages,
+    pull_version_from_helm_repo,
+    pull_version_from_oci_registry,
     pull_version_from_requirements_file,
 )
 
@@ -71,6 +78,91 @@ def test_pull_version_from_github_pages():
     )
 
 
+@responses.activate
+def test_pull_version_from_github_pages_stream():
+    test_dict = {}
+    test_dep = "dependency"
+    test_url = "http://jsonplaceholder.typicode.com/gh-pages/index.yaml"
+    test_token = "tHiS_iS_a_tOkEn"
+
+    responses.add(
+        responses.GET,
+        test_url,
+        body="""apiVersion: v1
+entries:
+  another-dependency:
+  - created: "2020-07-27T15:33:00.0000000Z"
+    version: 4.5.6
+  dependency:
+  - created: "2020-07-25T15:33:00.0000000Z"
+    version: 1.2.2
+  - created: "2020-07-26T15:33:00.0000000Z"
+    urls:
+    - https://jsonplaceholder.typicode.com/dependency-1.2.3.tgz
+    version: 1.2.3
+generated: "2020-07-27T15:33:00.0000000Z"
+""",
+        status=200,
+    )
+
+    test_dict = pull_version_from_github_pages(
+        test_dict, test_dep, test_url, test_token, stream=True
+    )
+
+    assert len(test_dict) == 1
+    assert list(test_dict.items()) == [(test_dep, "1.2.3")]
+
+    assert len(responses.calls) == 1
+    assert responses.calls[0].request.url == test_url
+
+
+def test_load_entries_from_stream():
+    index = """apiVersion: v1
+entries:
+  dependency:
+  - created: 2020-07-26T15:33:00Z
+    version: "1.0"
+    digest: abc
+  other:
+  - version: 0.1.0
+"""
+
+    entries = load_entries_from_stream(index, "dependency")
+
+    assert entries == yaml.safe_load(index)["entries"]["dependency"]
+
+    with pytest.raises(KeyError):
+        load_entries_from_stream(index, "missing")
+
+
+def test_load_index_entries():
+    index = """apiVersion: v1
+entries:
+  dependency:
+  - created: 2020-07-26T15:33:00Z
+    version: "1.0"
+    digest: abc
+    urls: [https://example.com/dependency-1.0.tgz]
+  - version: 0.1.0
+  other: []
+generated: 2020-07-26T15:33:00Z
+"""
+
+    entries = load_index_entries(index)
+
+    assert entries == {
+        "dependency": [
+            {
+                "version": "1.0",
+                "created": yaml.safe_load(index)["generated"],
+            },
+            {"version": "0.1.0", "created": None},
+        ],
+        "other": [],
+    }
+    assert load_index_entries("") == {}
+
+
 @responses.activate
 def test_pull_version_from_requirements_file():
     test_dict = {}
@@ -106,3 +198,107 @@ def test_pull_version_from_requirements_file():
         responses.calls[0].response.text
         == '{"dependencies": [{"name": "chart-1", "version": "1.2.3"}, {"name": "chart-2", "version": "4.5.6"}]}'
     )
+
+
+@responses.activate
+def test_pull_version_from_helm_repo():
+    test_url = "https://jupyterhub.github.io/helm-chart/"
+
+    responses.add(
+        responses.GET,
+        "https://jupyterhub.github.io/helm-chart/index.yaml",
+        body=yaml.safe_dump(
+            {
+                "entries": {
+                    "binderhub": [
+                        {
+                            "created": "2020-07-25T15:33:00Z",
+                            "version": "0.1.0",
+                        },
+                        {
+                            "created": "2020-07-26T15:33:00Z",
+                            "version": "0.2.0",
+                        },
+                    ]
+                }
+            }
+        ),
+        status=200,
+    )
+
+    test_dict = pull_version_from_helm_repo({}, "binderhub", test_url, "token")
+
+    assert test_dict == {"binderhub": "0.2.0"}
+    assert "Authorization" not in responses.calls[0].request.headers
+
+
+@responses.activate
+def test_pull_version_from_oci_registry():
+    test_url = "oci://ghcr.io/owner/charts"
+    tags_url = "https://ghcr.io/v2/owner/charts/chart/tags/list"
+
+    responses.add(
+        responses.GET,
+        tags_url,
+        status=401,
+        headers={
+            "WWW-Authenticate": 'Bearer realm="https://ghcr.io/token",service="ghcr.io",scope="repository:owner/charts/chart:pull"'
+        },
+    )
+    responses.add(
+        responses.GET,
+        "https://ghcr.io/token",
+        json={"token": "registry_token"},
+        status=200,
+    )
+    responses.add(
+        responses.GET,
+        tags_url,
+        json={"name": "owner/charts/chart", "tags": ["1.10.0", "latest"]},
+        headers={
+            "Link": '</v2/owner/charts/chart/tags/list?last=1.10.0>; rel="next"'
+        },
+        status=200,
+    )
+    responses.add(
+        responses.GET,
+        tags_url + "?last=1.10.0",
+        json={
+            "name": "owner/charts/chart",
+            "tags": ["1.9.0", "1.11.0-beta.1_build"],
+        },
+        status=200,
+    )
+
+    test_dict = pull_version_from_oci_registry({}, "chart", test_url, "token")
+
+    assert test_dict == {"chart": "1.11.0-beta.1+build"}
+    assert len(responses.calls) == 4
+    assert responses.calls[1].request.params == {
+        "service": "ghcr.io",
+        "scope": "repository:owner/charts/chart:pull",
+    }
+    assert (
+        responses.calls[3].request.headers["Authorization"]
+        == "Bearer registry_token"
+    )
+
+
+@responses.activate
+def test_pull_version_from_artifacthub():
+    responses.add(
+        responses.GET,
+        "https://artifacthub.io/api/v1/packages/helm/ingress-nginx/ingress-nginx",
+        json={"name": "ingress-nginx", "version": "4.5.6"},
+        status=200,
+    )
+
+    test_dict = pull_version_from_artifacthub(
+        {},
+        "ingress-nginx",
+        "https://artifacthub.io/packages/helm/ingress-nginx/ingress-nginx",
+        "token",
+    )
+
+    assert test_dict == {"ingress-nginx": "4.5.6"}
+    assert "Authorization" not in responses.calls[0].request.headers
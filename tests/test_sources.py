@@ -0,0 +1,81 @@
+import pytest
+from helm_bot.sources import (
+    DEFAULT_SOURCES,
+    SOURCES,
+    choose_source,
+    get_sources,
+    register_source,
+    resolve_source,
+)
+
+
+def test_resolve_source():
+    assert resolve_source("oci://ghcr.io/owner/charts") == "oci"
+    assert (
+        resolve_source("https://artifacthub.io/packages/helm/repo/chart")
+        == "artifacthub"
+    )
+    assert (
+        resolve_source("https://example.com/charts/chart/Chart.yaml")
+        == "chart-file"
+    )
+    assert resolve_source("https://example.com/index.yaml") == "gh-pages"
+    assert resolve_source("https://charts.jetstack.io") == "helm-repo"
+    assert resolve_source("file://../local-chart") is None
+    assert resolve_source("@stable") is None
+    assert resolve_source(None) is None
+
+
+def test_get_sources():
+    assert get_sources() == DEFAULT_SOURCES
+
+    sources = get_sources(
+        {
+            "binderhub": None,
+            "cert-manager": {"url": "https://charts.jetstack.io"},
+            "ingress-nginx": {"source": "oci", "url": "oci://example.com/x"},
+        }
+    )
+
+    assert sources == {
+        "cert-manager": {
+            "source": "helm-repo",
+            "url": "https://charts.jetstack.io",
+        },
+        "ingress-nginx": {"source": "oci", "url": "oci://example.com/x"},
+    }
+
+    with pytest.raises(ValueError):
+        get_sources({"chart": {"source": "svn", "url": "https://example.com"}})
+
+
+def test_choose_source():
+    repository = "https://jupyterhub.github.io/helm-chart/"
+
+    assert choose_source("binderhub", repository) == {
+        "source": "helm-repo",
+        "url": repository,
+    }
+    assert choose_source("binderhub", None) == DEFAULT_SOURCES["binderhub"]
+    assert choose_source("binderhub", None, {"binderhub": None}) is None
+    assert choose_source("local", "file://../local") is None
+    assert choose_source(
+        "binderhub",
+        repository,
+        {"binderhub": {"url": "oci://example.com/charts"}},
+    ) == {"source": "oci", "url": "oci://example.com/charts"}
+
+
+def test_register_source():
+    def backend(output_dict, dependency, url, token, cache_dir=None):
+        output_dict[dependency] = "1.2.3"
+        return output_dict
+
+    try:
+        register_source("custom", backend)
+
+        assert get_sources(
+            {"chart": {"source": "custom", "url": "https://example.com"}}
+        )["chart"] == {"source": "custom", "url": "https://example.com"}
+    finally:
+        SOURCES.pop("custom", None)
@@ -0,0 +1,124 @@
+import pytest
+from datetime import datetime, timezone, timedelta
+from helm_bot.versions import (
+    is_upgrade,
+    latest_release,
+    parse_created,
+    parse_version,
+    version_key,
+)
+
+
+def test_parse_created():
+    expected = datetime(2020, 7, 26, 15, 33, 0, 123456, tzinfo=timezone.utc)
+
+    assert parse_created("2020-07-26T15:33:00.123456789Z") == expected
+    assert parse_created("2020-07-26T16:33:00.123456+01:00") == expected
+    assert parse_created(expected.replace(tzinfo=None)) == expected
+    assert parse_created("2020-07-26T15:33:00Z") == expected.replace(
+        microsecond=0
+    )
+    assert parse_created("2020-07-26T15:33:00-0130").utcoffset() == -timedelta(
+        hours=1, minutes=30
+    )
+
+
+def test_parse_created_exception():
+    with pytest.raises(ValueError):
+        parse_created("yesterday")
+
+
+def test_version_key_ordering():
+    versions = [
+        "not-a-version",
+        "0.1.0",
+        "0.2.0-alpha",
+        "0.2.0-alpha.1",
+        "0.2.0-beta",
+        "0.2.0-n99.h1234",
+        "0.2.0-n100.habcd",
+        "0.2.0",
+        "0.10.0",
+        "1.0.0",
+    ]
+
+    assert sorted(versions[::-1], key=version_key) == versions
+    assert version_key("1.0.0+build.1") == version_key("1.0.0")
+    assert version_key("v1.0.0") == version_key("1.0.0")
+
+
+def test_parse_version():
+    version = parse_version("1.2.3-rc.1+build.5")
+
+    assert (version.major, version.minor, version.patch) == (1, 2, 3)
+    assert version.prerelease == "rc.1"
+    assert version.build == "build.5"
+    assert parse_version("1.2") is None
+    assert parse_version("1.2.3") is parse_version("1.2.3")
+
+
+def test_is_upgrade():
+    assert is_upgrade("1.2.3", "1.2.4")
+    assert is_upgrade("1.2.3", "1.3.0-n5.h1234")
+    assert is_upgrade("1.2.3-rc.1", "1.2.3", policy="stable")
+    assert is_upgrade("1.2.3", "1.3.0", policy="minor")
+    assert is_upgrade("1.2.3", "1.2.4", policy="patch")
+    assert not is_upgrade("1.2.3", "1.2.3")
+    assert not is_upgrade("1.2.3", "1.2.2")
+    assert not is_upgrade("1.2.3+a", "1.2.3+b")
+    assert not is_upgrade("1.2.3", "1.3.0-rc.1", policy="stable")
+    assert not is_upgrade("1.2.3", "2.0.0", policy="minor")
+    assert not is_upgrade("1.2.3", "1.3.0", policy="patch")
+
+
+def test_is_upgrade_not_semver():
+    assert is_upgrade("latest", "1.2.3")
+    assert is_upgrade("1.0", "1.1")
+    assert not is_upgrade("1.0", 1.0)
+
+
+def test_is_upgrade_exception():
+    with pytest.raises(ValueError):
+        is_upgrade("1.2.3", "1.2.4", policy="major")
+
+
+def test_latest_release_by_created():
+    entries = [
+        {"created": "2020-07-26T15:33:00.0000000Z", "version": "1.2.3"},
+        {"created": "2020-07-26T15:33:00.1000000Z", "version": "1.2.2"},
+        {"created": "2020-07-25T15:33:00.0000000Z", "version": "1.2.4"},
+    ]
+
+    assert latest_release(entries)["version"] == "1.2.2"
+    assert latest_release(entries, by="version")["version"] == "1.2.4"
+
+
+def test_latest_release_ties_go_to_last_entry():
+    entries = [
+        {"created": "2020-07-26T15:33:00Z", "version": "1.2.3"},
+        {"created": "2020-07-26T15:33:00Z", "version": "1.2.4"},
+    ]
+
+    assert latest_release(entries)["version"] == "1.2.4"
+
+
+def test_latest_release_skips_invalid_created():
+    entries = [
+        {"created": "2020-07-26T15:33:00Z", "version": "1.2.3"},
+        {"created": "yesterday", "version": "9.9.9"},
+        {"version": "9.9.8"},
+        {"created": "2020-07-25T15:33:00Z", "version": "1.2.2"},
+    ]
+
+    assert latest_release(entries)["version"] == "1.2.3"
+
+    with pytest.raises(ValueError):
+        latest_release([{"created": "yesterday", "version": "1.2.3"}])
+
+
+def test_latest_release_exceptions():
+    with pytest.raises(ValueError):
+        latest_release([])
+
+    with pytest.raises(ValueError):
+        latest_release([{"created": "", "version": ""}], by="name")
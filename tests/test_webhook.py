@@ -0,0 +1,205 @@
+import json
+import queue
+import threading
+from http.server import ThreadingHTTPServer
+from unittest.mock import patch
+from helm_bot.webhook import (
+    affected_dependencies,
+    make_handler,
+    process_triggers,
+    replay_webhook,
+    sign_payload,
+    verify_signature,
+    webhook_sources,
+)
+
+SECRET = "It's a Secret to Everybody"
+
+
+def test_sign_payload():
+    # The example from GitHub's webhook documentation
+    signature = sign_payload(b"Hello, World!", SECRET)
+
+    assert (
+        signature
+        == "sha256=757107ea0eb2509fc211221cce984b8a37570b6d7586c22c46f4379c8b043e17"
+    )
+
+
+def test_verify_signature():
+    body = b'{"zen": "Keep it logically awesome."}'
+    signature = sign_payload(body, SECRET)
+
+    assert verify_signature(body, signature, SECRET)
+    assert not verify_signature(body, signature, "wrong secret")
+    assert not verify_signature(body + b" ", signature, SECRET)
+    assert not verify_signature(body, None, SECRET)
+
+
+def test_webhook_sources():
+    assert webhook_sources() == {
+        "jupyterhub/helm-chart": {"binderhub": "gh-pages"},
+        "kubernetes/ingress-nginx": {"ingress-nginx": "master"},
+    }
+
+
+def test_webhook_sources_manifest():
+    repos = [
+        {"repo_owner": "owner", "repo_name": "repo1"},
+        {
+            "repo_owner": "owner",
+            "repo_name": "repo2",
+            "sources": {
+                "ingress-nginx": None,
+                "cert-manager": {
+                    "url": "https://raw.githubusercontent.com/owner/charts/main/cert-manager/Chart.yaml"
+                },
+                "grafana": {
+                    "url": "https://grafana.github.io/helm-charts/index.yaml"
+                },
+            },
+        },
+    ]
+
+    assert webhook_sources(repos) == {
+        "jupyterhub/helm-chart": {"binderhub": "gh-pages"},
+        "kubernetes/ingress-nginx": {"ingress-nginx": "master"},
+        "owner/charts": {"cert-manager": "main"},
+    }
+
+    sources = webhook_sources(repos)
+    assert affected_dependencies(
+        "push",
+        {
+            "ref": "refs/heads/main",
+            "repository": {"full_name": "owner/charts"},
+        },
+        sources,
+    ) == ["cert-manager"]
+
+
+def test_affected_dependencies():
+    helm_chart = {"full_name": "jupyterhub/helm-chart"}
+    ingress = {"full_name": "kubernetes/ingress-nginx"}
+
+    assert affected_dependencies(
+        "push", {"ref": "refs/heads/gh-pages", "repository": helm_chart}
+    ) == ["binderhub"]
+    assert (
+        affected_dependencies(
+            "push", {"ref": "refs/heads/main", "repository": helm_chart}
+        )
+        == []
+    )
+    assert affected_dependencies(
+        "release", {"action": "published", "repository": ingress}
+    ) == ["ingress-nginx"]
+    assert (
+        affected_dependencies(
+            "release", {"action": "deleted", "repository": ingress}
+        )
+        == []
+    )
+    assert (
+        affected_dependencies(
+            "push",
+            {"ref": "refs/heads/gh-pages", "repository": {"full_name": "a/b"}},
+        )
+        == []
+    )
+    assert affected_dependencies("ping", {"zen": "Design for failure."}) == []
+
+
+def test_webhook_listener():
+    trigger_queue = queue.Queue()
+    server = ThreadingHTTPServer(
+        ("localhost", 0), make_handler(SECRET, trigger_queue)
+    )
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    url = "http://localhost:%d" % server.server_port
+
+    push = json.dumps(
+        {
+            "ref": "refs/heads/gh-pages",
+            "repository": {"full_name": "jupyterhub/helm-chart"},
+        }
+    ).encode("utf-8")
+
+    try:
+        resp1 = replay_webhook(url, "push", push, SECRET)
+        resp2 = replay_webhook(url, "push", push, "wrong secret")
+        resp3 = replay_webhook(url, "ping", b'{"zen": "Approachable"}', SECRET)
+        resp4 = replay_webhook(url, "push", b"not json", SECRET)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert resp1.status_code == 202
+    assert resp2.status_code == 401
+    assert resp3.status_code == 204
+    assert resp4.status_code == 400
+    assert trigger_queue.get_nowait() == ["binderhub"]
+    assert trigger_queue.empty()
+
+
+def test_process_triggers():
+    repos = [{"repo_owner": "owner", "repo_name": "repo"}]
+    trigger_queue = queue.Queue()
+    trigger_queue.put(["binderhub"])
+    trigger_queue.put(["ingress-nginx"])
+    trigger_queue.put(["binderhub"])
+    stop_event = threading.Event()
+
+    def mock_run_batch_side_effect(*args, **kwargs):
+        stop_event.set()
+        raise RuntimeError("No token")
+
+    mock_run_batch = patch(
+        "helm_bot.webhook.run_batch", side_effect=mock_run_batch_side_effect
+    )
+    mock_clear = patch("helm_bot.webhook.clear_index_cache")
+
+    with mock_run_batch as mock, mock_clear as mock2:
+        process_triggers(
+            repos, trigger_queue, stop_event, recheck_delay=0, token="token"
+        )
+
+    assert mock2.call_count == 1
+
+    mock.assert_called_once_with(
+        repos,
+        dependencies=["binderhub", "ingress-nginx"],
+        version_cache={},
+        token="token",
+    )
+
+
+def test_process_triggers_recheck():
+    repos = [{"repo_owner": "owner", "repo_name": "repo"}]
+    trigger_queue = queue.Queue()
+    trigger_queue.put(["binderhub"])
+    stop_event = threading.Event()
+    checks = []
+
+    def mock_run_batch_side_effect(repos, dependencies, **kwargs):
+        checks.append(dependencies)
+        if len(checks) == 2:
+            stop_event.set()
+
+    mock_run_batch = patch(
+        "helm_bot.webhook.run_batch", side_effect=mock_run_batch_side_effect
+    )
+
+    mock_clear = patch("helm_bot.webhook.clear_index_cache")
+    mock_reset = patch("helm_bot.webhook.reset_retry_budget")
+
+    with mock_run_batch, mock_clear as mock1, mock_reset as mock2:
+        process_triggers(repos, trigger_queue, stop_event, recheck_delay=0.1)
+
+        # Upstream caches may still serve the old index at the first check
+        assert mock1.call_count == 2
+        # Each check gets the full retry budget
+        assert mock2.call_count == 2
+
+    assert checks == [["binderhub"], ["binderhub"]]